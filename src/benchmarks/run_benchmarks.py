@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import click
+import logging
+import hashlib
+import platform
+import resource
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.data import scrap_dataset
+from src.data import crawler
+from src.data.crawler import fetch_pages, get_session, MAX_CONNECTIONS
+from src.data.fixtures import make_corpus
+from src.data.stub_server import StubServer
+from src.data.mongo_writer import MongoWriter
+from src.data.rate_control import RateController
+from src.features.catalog import Catalog
+from src.features.build_features import build_features, save_features
+from src.models.predict_model import Recommender
+
+'''Genres of the frozen corpus'''
+GENRES = ['mystery', 'thriller', 'sci-fi']
+
+'''Pages per genre of the frozen corpus'''
+NUM_PAGES = 20
+
+'''Directory of the benchmark results'''
+RESULTS_DIR = './reports/benchmarks'
+
+'''Relative slowdown of a stage over the baseline that fails the run'''
+TOLERANCE = 0.25
+
+'''Slowdowns shorter than this many seconds are taken as noise'''
+MIN_SLOWDOWN = 0.05
+
+'''Stages timed against mongomock, whose upserts say nothing of the writer'''
+MOCKED_STAGES = ['mongo']
+
+'''Number of runs of every gated stage, the fastest one is kept'''
+STAGE_RUNS = 3
+
+'''Number of runs of the reference workload, the fastest one is kept'''
+REFERENCE_RUNS = 5
+
+'''Seconds between two samples of the resident memory'''
+RSS_INTERVAL = 0.005
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to get the resident memory of the process in bytes'''
+def get_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # outside linux only the peak of the whole process is known
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+'''Class to measure the wall time and the peak resident memory of a stage'''
+class StageMeter:
+
+    def __init__(self):
+        self.peak = 0
+        self.running = False
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, get_rss())
+            time.sleep(RSS_INTERVAL)
+
+    def __enter__(self):
+        self.peak = get_rss()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, get_rss())
+
+'''
+Function to run a stage and record its wall time, rows per second and peak
+memory. The stage is run a few times and the fastest run is kept, the
+slower ones are the rest of the machine getting in the way.
+'''
+def run_stage(results, name, function, *args, runs=STAGE_RUNS):
+    seconds, peak = float('inf'), 0
+    for _ in range(runs):
+        with StageMeter() as meter:
+            output, rows = function(*args)
+        seconds, peak = min(seconds, meter.seconds), max(peak, meter.peak)
+
+    results[name] = {
+        'seconds': seconds,
+        'rows': rows,
+        'rows_per_second': rows / seconds if seconds else 0.0,
+        'peak_rss_mb': peak / 1024 ** 2,
+    }
+    LOGGER.info('%-8s %8.3fs %12.0f rows/s %8.1f MB' % (
+        name, seconds, results[name]['rows_per_second'],
+        results[name]['peak_rss_mb']))
+
+    return output
+
+'''Function to time a fixed mix of python and numpy work, the gate's unit'''
+def get_reference_seconds(runs=REFERENCE_RUNS):
+    rng = np.random.default_rng(0)
+    values = rng.standard_normal(4000000)
+    words = ['title %d' % i for i in range(500000)]
+
+    timings = []
+    for _ in range(runs):
+        begin = time.perf_counter()
+        np.sort(values)
+        counts = {}
+        for word in words:
+            counts[word[-3:]] = counts.get(word[-3:], 0) + 1
+        timings.append(time.perf_counter() - begin)
+
+    # the fastest run is the least disturbed by the rest of the machine
+    return min(timings)
+
+'''
+Function to get a rate controller that sends the requests as fast as the
+connections allow
+'''
+def get_unthrottled_controller():
+    return RateController(get_session(), rate=float('inf'),
+                          max_rate=float('inf'), concurrency=MAX_CONNECTIONS,
+                          max_concurrency=MAX_CONNECTIONS)
+
+'''
+Function to get a fingerprint of the pages of a corpus, so results of
+different corpora are not compared
+'''
+def get_corpus_fingerprint(corpus_directory):
+    digest = hashlib.sha1()
+    for path in sorted(Path(corpus_directory).rglob('*')):
+        if path.is_file():
+            name = str(path.relative_to(corpus_directory))
+            digest.update(name.encode('utf-8'))
+            digest.update(path.read_bytes())
+
+    return digest.hexdigest()
+
+'''Function to download every page of the corpus through the stub server'''
+def fetch_stage(corpus_directory, genres, num_pages):
+    urls = []
+    # the stub server never throttles, so the pacing of the shared controller
+    # would only be measured
+    shared = crawler.CONTROLLER
+    crawler.CONTROLLER = get_unthrottled_controller()
+    try:
+        with StubServer(corpus_directory) as server:
+            for genre in genres:
+                urls += [
+                    scrap_dataset.get_topics_url(genre, start, server.base_url)
+                    for start in scrap_dataset.get_page_numbers(num_pages)]
+            pages = fetch_pages(urls)
+    finally:
+        crawler.CONTROLLER = shared
+
+    failed = [page for page in pages if isinstance(page, Exception)]
+    if failed:
+        raise failed[0]
+    return pages, len(pages)
+
+def parse_stage(pages):
+    records = [record for page in pages
+               for record in scrap_dataset.get_movie_records(page)]
+    df = pd.DataFrame(records, columns=scrap_dataset.MOVIE_COLUMNS)
+    return df, len(records)
+
+def clean_stage(df):
+    num_rows = len(df)
+    df = scrap_dataset.clean_data(scrap_dataset.save_only_movies(df))
+    return df.reset_index(drop=True), num_rows
+
+'''Function to upsert the movies into a database stand-in'''
+def mongo_stage(df, mongodb_uri):
+    if mongodb_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongodb_uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+
+    collection = client['imdb_benchmark']['movies']
+    collection.drop()
+    with MongoWriter(collection) as writer:
+        writer.write_df(df)
+    client.close()
+
+    return None, len(df)
+
+def features_stage(df, features_directory):
+    catalog = Catalog.from_dataframe(df)
+    matrix, feature_names = build_features(catalog)
+    save_features(features_directory, matrix, catalog.get_uids(),
+                  feature_names)
+    return None, len(catalog)
+
+def train_stage(features_directory, neighbors_directory):
+    recommender = Recommender.build(features_directory, neighbors_directory,
+                                    num_workers=1)
+    return recommender, len(recommender.uids)
+
+def query_stage(recommender):
+    uids = np.asarray(recommender.uids).tolist()
+    for start in range(0, len(uids), 1000):
+        recommender.recommend_batch(uids[start:start + 1000])
+    return None, len(uids)
+
+'''Function to run every stage of the pipeline over the frozen corpus'''
+def run_benchmarks(corpus_directory=None, genres=GENRES, num_pages=NUM_PAGES,
+                   mongodb_uri=None):
+    results = {}
+    reference = get_reference_seconds()
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        if corpus_directory is None:
+            corpus_directory = make_corpus(directory / 'corpus', genres,
+                                           num_pages)
+        corpus = get_corpus_fingerprint(corpus_directory)
+
+        pages = run_stage(results, 'fetch', fetch_stage, corpus_directory,
+                          genres, num_pages)
+        df = run_stage(results, 'parse', parse_stage, pages)
+        df = run_stage(results, 'clean', clean_stage, df)
+        # mongomock is slow and not gated, it is only run once
+        run_stage(results, 'mongo', mongo_stage, df, mongodb_uri,
+                  runs=1 if mongodb_uri is None else STAGE_RUNS)
+        run_stage(results, 'features', features_stage, df,
+                  directory / 'features')
+        recommender = run_stage(results, 'train', train_stage,
+                                directory / 'features',
+                                directory / 'neighbors')
+        run_stage(results, 'query', query_stage, recommender)
+
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'config': {'genres': list(genres), 'num_pages': num_pages,
+                   'corpus': corpus,
+                   'database': 'mongodb' if mongodb_uri else 'mongomock'},
+        'reference_seconds': reference,
+        'stages': results,
+    }
+
+'''
+Function to get what differs between the configurations of the run and of
+the baseline
+'''
+def get_config_changes(results, baseline):
+    config, reference = results['config'], baseline.get('config', {})
+    return {key: (reference.get(key), value)
+            for key, value in config.items() if reference.get(key) != value}
+
+'''Function to get the stages timed against a stand-in, left out of the gate'''
+def get_ungated_stages(results):
+    if results['config'].get('database') == 'mongomock':
+        return MOCKED_STAGES
+    return []
+
+'''
+Function to get the stages that got slower than the baseline beyond the
+tolerance. Every time is taken in units of the reference workload of its
+run, so a baseline from a faster or slower host still compares.
+'''
+def get_regressions(results, baseline, tolerance=TOLERANCE):
+    # the baseline times are scaled to the speed of this host
+    scale = results['reference_seconds'] / baseline['reference_seconds']
+    ungated = get_ungated_stages(results)
+
+    regressions = []
+    for stage, result in results['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None or stage in ungated:
+            continue
+        expected = reference['seconds'] * scale
+        slowdown = result['seconds'] / expected - 1 if expected else 0.0
+        if (slowdown > tolerance
+                and result['seconds'] - expected > MIN_SLOWDOWN):
+            regressions.append((stage, expected, result['seconds'], slowdown))
+
+    return regressions
+
+@click.command()
+@click.option('--corpus', 'corpus_directory', default=None,
+              type=click.Path(exists=True),
+              help='Saved search pages, one sub-directory per genre '
+                   '(made up when missing)')
+@click.option('--genre', 'genres', multiple=True, default=GENRES)
+@click.option('--num-pages', default=NUM_PAGES)
+@click.option('--mongodb-uri', default=None,
+              help='Local mongod to write to instead of mongomock')
+@click.option('--results-dir', default=RESULTS_DIR, type=click.Path())
+@click.option('--save-baseline', is_flag=True,
+              help='Stores these results as the new baseline')
+@click.option('--tolerance', default=TOLERANCE)
+def main(corpus_directory, genres, num_pages, mongodb_uri, results_dir,
+         save_baseline, tolerance):
+    """ Benchmarks every stage of the pipeline over a frozen corpus of search
+        pages and compares the results with the stored baseline.
+
+        The baseline is regenerated with `make benchmark-baseline` after a
+        deliberate change of speed, or of the corpus or database settings.
+        Stage times are scaled by a reference workload timed in each run, so
+        the baseline of another host still compares. The mongomock stage is
+        reported but not gated, pass --mongodb-uri to gate a real database.
+    """
+    results = run_benchmarks(corpus_directory, genres, num_pages, mongodb_uri)
+
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    with open(results_dir / 'latest.json', 'w') as f:
+        json.dump(results, f, indent=2)
+
+    baseline_path = results_dir / 'baseline.json'
+    if save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        LOGGER.info('baseline saved to %s' % baseline_path)
+        return
+    if not baseline_path.is_file():
+        LOGGER.error('no baseline in %s, run with --save-baseline to store '
+                     'one' % results_dir)
+        sys.exit(1)
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    # timings are only comparable over the same pages
+    changes = get_config_changes(results, baseline)
+    for key, (before, after) in changes.items():
+        LOGGER.error('%s differs from the baseline: %s -> %s'
+                     % (key, before, after))
+    if changes:
+        LOGGER.error('not comparable with the baseline, run with '
+                     '--save-baseline to replace it')
+        sys.exit(1)
+    if ((baseline.get('python'), baseline.get('machine'))
+            != (results['python'], results['machine'])):
+        LOGGER.warning('the baseline was measured on python %s (%s)'
+                       % (baseline.get('python'), baseline.get('machine')))
+    LOGGER.info('reference workload: %.3fs (baseline %.3fs)'
+                % (results['reference_seconds'],
+                   baseline['reference_seconds']))
+    for stage in get_ungated_stages(results):
+        LOGGER.info('%s is timed against mongomock and not gated' % stage)
+
+    regressions = get_regressions(results, baseline, tolerance)
+    for stage, expected, after, slowdown in regressions:
+        LOGGER.error('%s regressed: %.3fs expected -> %.3fs (+%.0f%%)'
+                     % (stage, expected, after, 100 * slowdown))
+    if regressions:
+        sys.exit(1)
+    LOGGER.info('no stage slower than the baseline by more than %.0f%%'
+                % (100 * tolerance))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import logging
+import time
+import click
+
+from pathlib import Path
+from bs4 import BeautifulSoup
+from dotenv import find_dotenv, load_dotenv
+
+from src.data import scrap_dataset
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to parse a page walking the tree once for every field'''
+def parse_per_field(page):
+    doc = BeautifulSoup(page, 'html.parser')
+    fields = [
+        scrap_dataset.get_movie_uid(doc),
+        scrap_dataset.get_movie_rank(doc),
+        scrap_dataset.get_movie_name(doc),
+        scrap_dataset.get_movie_year(doc),
+        scrap_dataset.get_movie_certificate(doc),
+        scrap_dataset.get_movie_runtime(doc),
+        scrap_dataset.get_movie_genre(doc),
+        scrap_dataset.get_movie_rating(doc),
+        scrap_dataset.get_movie_director(doc),
+        scrap_dataset.get_movie_stars(doc),
+        scrap_dataset.get_movie_num_votes(doc),
+    ]
+
+    return [dict(zip(scrap_dataset.MOVIE_COLUMNS, values))
+            for values in zip(*fields)]
+
+'''Function to parse a page visiting every movie once'''
+def parse_single_pass(page):
+    return scrap_dataset.get_movie_records(page)
+
+'''Function to measure the throughput of a parser over the saved pages'''
+def measure(parser, pages, repeat=3):
+    best = float('inf')
+    num_movies = 0
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        num_movies = sum(len(parser(page)) for page in pages)
+        best = min(best, time.perf_counter() - start)
+
+    return {
+        'seconds': best,
+        'pages_per_second': len(pages) / best,
+        'movies_per_second': num_movies / best,
+    }
+
+'''Function to compare both parsers over the saved pages'''
+def benchmark_parsing(pages, repeat=3):
+    # both parsers must agree before their speed means anything
+    for page in pages:
+        if parse_per_field(page) != parse_single_pass(page):
+            raise ValueError('parsers disagree on a saved page')
+
+    results = {
+        'per_field': measure(parse_per_field, pages, repeat),
+        'single_pass': measure(parse_single_pass, pages, repeat),
+    }
+    results['speedup'] = (results['per_field']['seconds']
+                          / results['single_pass']['seconds'])
+
+    return results
+
+@click.command()
+@click.argument('corpus_directory', type=click.Path(exists=True))
+@click.option('--repeat', default=3)
+def main(corpus_directory, repeat):
+    """ Measures the parse throughput of the saved search pages in
+        CORPUS_DIRECTORY (one sub-directory per genre).
+    """
+    pages = [path.read_text(encoding='utf-8')
+             for path in sorted(Path(corpus_directory).glob('*/*.html'))]
+    LOGGER.info('parsing %d saved pages...' % len(pages))
+
+    results = benchmark_parsing(pages, repeat)
+    for name in ['per_field', 'single_pass']:
+        LOGGER.info('%s: %.1f pages/s, %.0f movies/s' % (
+            name, results[name]['pages_per_second'],
+            results[name]['movies_per_second']))
+    LOGGER.info('speedup: %.1fx' % results['speedup'])
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
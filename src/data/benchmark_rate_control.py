@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import time
+import click
+import logging
+import tempfile
+
+from dotenv import find_dotenv, load_dotenv
+
+from src.data import scrap_dataset
+from src.data.crawler import (fetch_pages, get_session, PageError,
+                              MAX_CONNECTIONS_PER_HOST)
+from src.data.fixtures import make_corpus
+from src.data.rate_control import RateController
+from src.data.stub_server import StubServer, FaultInjector
+from src.data import crawler
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to crawl a corpus through a stub server that throttles, fails and
+lags
+'''
+def benchmark_rate_control(corpus_directory, genres, num_pages, faults,
+                           max_connections=MAX_CONNECTIONS_PER_HOST):
+    # a fresh controller so the governor starts from its initial rate
+    crawler.CONTROLLER = RateController(get_session(),
+                                        max_concurrency=max_connections)
+
+    with StubServer(corpus_directory, faults=faults) as server:
+        urls = [scrap_dataset.get_topics_url(genre, start, server.base_url)
+                for genre in genres
+                for start in scrap_dataset.get_page_numbers(num_pages)]
+        begin = time.perf_counter()
+        pages = fetch_pages(urls, max_connections, max_connections)
+        seconds = time.perf_counter() - begin
+
+    failed = [page for page in pages if isinstance(page, Exception)]
+    for error in failed[:5]:
+        LOGGER.error(error)
+
+    return {
+        'pages': len(pages) - len(failed),
+        'failed': len(failed),
+        'gave_up': sum(isinstance(error, PageError) for error in failed),
+        'seconds': seconds,
+        'pages_per_second': (len(pages) - len(failed)) / seconds,
+        'server': faults.get_stats(),
+        'governor': next(iter(crawler.CONTROLLER.get_stats().values()), {}),
+    }
+
+@click.command()
+@click.option('--genre', 'genres', multiple=True, default=['crime', 'drama'])
+@click.option('--num-pages', default=40)
+@click.option('--max-rate', default=20,
+              help='Requests per second the stub serves before answering 429')
+@click.option('--error-rate', default=0.05,
+              help='Share of the requests failing with a 5xx')
+@click.option('--latency', default=0.02,
+              help='Seconds added to every response')
+@click.option('--retry-after', default=1)
+def main(genres, num_pages, max_rate, error_rate, latency, retry_after):
+    """ Crawls a made up corpus through a stub server injecting 429s, 5xx
+        and latency, and reports the throughput the governor settled on.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        make_corpus(directory, genres, num_pages)
+        faults = FaultInjector(latency, error_rate, max_rate, retry_after)
+        results = benchmark_rate_control(directory, genres, num_pages, faults)
+
+    LOGGER.info('%d pages (%d failed) in %.2fs: %.1f pages/s against a '
+                'limit of %d/s'
+                % (results['pages'], results['failed'], results['seconds'],
+                   results['pages_per_second'], max_rate))
+    LOGGER.info('server: %s, governor: %s'
+                % (results['server'], results['governor']))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
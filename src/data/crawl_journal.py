@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import sqlite3
+import time
+
+from pathlib import Path
+
+'''Maximum number of times a page is tried before it is given up'''
+MAX_ATTEMPTS = 3
+
+'''Status of the pages in the crawl frontier'''
+PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Class to persist the crawl frontier so that a crawl can be resumed'''
+class CrawlJournal:
+
+    def __init__(self, path, max_attempts=MAX_ATTEMPTS):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_attempts = max_attempts
+        self.db = sqlite3.connect(str(path))
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS pages (
+                genre TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                records TEXT,
+                stored INTEGER NOT NULL DEFAULT 0,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (genre, start)
+            );
+            CREATE TABLE IF NOT EXISTS genres (
+                genre TEXT PRIMARY KEY,
+                saved_at REAL NOT NULL
+            );''')
+        # journals written before the stored column had every fetched page
+        # appended on each run
+        columns = [column for _, column, *_
+                   in self.db.execute('PRAGMA table_info(pages)')]
+        if 'stored' not in columns:
+            self.db.execute('ALTER TABLE pages '
+                            'ADD COLUMN stored INTEGER NOT NULL DEFAULT 0')
+            self.db.execute('UPDATE pages SET stored = 1 WHERE status = ?',
+                            (DONE,))
+        self.db.commit()
+
+    def add_pages(self, genre, page_numbers):
+        '''Adds the pages to the frontier, keeping the ones already there'''
+        now = time.time()
+        self.db.executemany(
+            'INSERT OR IGNORE INTO pages (genre, start, status, updated_at) '
+            'VALUES (?, ?, ?, ?)',
+            [(genre, start, PENDING, now) for start in page_numbers])
+        self.db.commit()
+
+    def get_pending_pages(self, genre):
+        '''Returns the pages to fetch, failed ones with attempts left too'''
+        rows = self.db.execute(
+            'SELECT start FROM pages '
+            'WHERE genre = ? AND status != ? AND attempts < ? '
+            'ORDER BY start', (genre, DONE, self.max_attempts)).fetchall()
+        return [start for start, in rows]
+
+    def mark_done(self, genre, start, records):
+        self.db.execute(
+            'UPDATE pages SET status = ?, attempts = attempts + 1, '
+            'error = NULL, records = ?, updated_at = ? '
+            'WHERE genre = ? AND start = ?',
+            (DONE, json.dumps(records), time.time(), genre, start))
+        self.db.commit()
+
+    def mark_failed(self, genre, start, error):
+        self.db.execute(
+            'UPDATE pages SET status = ?, attempts = attempts + 1, error = ?, '
+            'updated_at = ? WHERE genre = ? AND start = ?',
+            (FAILED, str(error), time.time(), genre, start))
+        self.db.commit()
+
+    def get_records(self, genre, stored=None):
+        '''
+        Returns the movie records of every page already fetched, in page order,
+        only those of the pages not yet stored when stored is False.
+        '''
+        query = 'SELECT records FROM pages WHERE genre = ? AND status = ?'
+        if stored is not None:
+            query += ' AND stored = %d' % bool(stored)
+        rows = self.db.execute(query + ' ORDER BY start',
+                               (genre, DONE)).fetchall()
+        return [record for records, in rows for record in json.loads(records)]
+
+    def mark_stored(self, genre):
+        '''Marks the fetched pages of the genre as written to the raw store'''
+        self.db.execute(
+            'UPDATE pages SET stored = 1 WHERE genre = ? AND status = ?',
+            (genre, DONE))
+        self.db.commit()
+
+    def get_counts(self, genre):
+        rows = self.db.execute(
+            'SELECT status, COUNT(*) FROM pages '
+            'WHERE genre = ? GROUP BY status',
+            (genre,)).fetchall()
+        return dict(rows)
+
+    def get_abandoned_pages(self, genre):
+        '''Returns the pages given up on and their last error'''
+        return self.db.execute(
+            'SELECT start, error FROM pages '
+            'WHERE genre = ? AND status = ? AND attempts >= ? '
+            'ORDER BY start', (genre, FAILED, self.max_attempts)).fetchall()
+
+    def is_complete(self, genre):
+        '''Checks whether every page of the genre was fetched'''
+        row = self.db.execute(
+            'SELECT 1 FROM pages WHERE genre = ? AND status != ?',
+            (genre, DONE)).fetchone()
+        return row is None
+
+    def mark_saved(self, genre):
+        self.db.execute('INSERT OR REPLACE INTO genres VALUES (?, ?)',
+                        (genre, time.time()))
+        self.db.commit()
+
+    def is_saved(self, genre):
+        row = self.db.execute('SELECT 1 FROM genres WHERE genre = ?',
+                              (genre,)).fetchone()
+        return row is not None
+
+    def close(self):
+        self.db.close()
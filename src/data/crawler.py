@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from src.data.metrics import METRICS
+from src.data.rate_control import RateController
+
+'''Maximum number of requests in flight across the whole crawl'''
+MAX_CONNECTIONS = 16
+
+'''Maximum number of requests in flight against a single host'''
+MAX_CONNECTIONS_PER_HOST = 8
+
+'''Headers sent along with every request'''
+HEADERS = {'Accept-Language': 'en-US'}
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Session shared by every request so connections are kept alive'''
+SESSION = None
+
+'''Rate controller shared by every request so each host is paced once'''
+CONTROLLER = None
+
+'''Exception raised when a page could not be loaded, even after the retries'''
+class PageError(Exception):
+
+    def __init__(self, url, status):
+        super().__init__(f'Failed to load page {url} (status {status})')
+        self.url = url
+        self.status = status
+
+'''Function to get the shared session, creating it on first use'''
+def get_session():
+    global SESSION
+
+    if SESSION is None:
+        SESSION = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=MAX_CONNECTIONS, pool_maxsize=MAX_CONNECTIONS)
+        SESSION.mount('http://', adapter)
+        SESSION.mount('https://', adapter)
+
+    return SESSION
+
+'''Function to get the shared rate controller, creating it on first use'''
+def get_rate_controller():
+    global CONTROLLER
+
+    if CONTROLLER is None:
+        CONTROLLER = RateController(get_session(),
+                                    max_concurrency=MAX_CONNECTIONS_PER_HOST)
+
+    return CONTROLLER
+
+'''Function to download the content of a single page'''
+@METRICS.instrument('fetch_page')
+def fetch_page(url, headers=HEADERS, cache=None):
+    # throttled and failed requests are retried with backoff by the controller
+    controller = get_rate_controller()
+
+    if cache is not None:
+        return cache.fetch(controller, url, headers)
+
+    response = controller.get(url, headers=headers)
+
+    # to check whether the response is successful or not
+    if response.status_code != 200:
+        raise PageError(url, response.status_code)
+
+    return response.text
+
+'''Coroutine to download a page while holding the global and per-host slots'''
+async def fetch_page_async(url, connections, host_connections,
+                           headers=HEADERS, cache=None):
+    host = urlsplit(url).netloc
+
+    async with connections, host_connections[host]:
+        # requests is blocking, so the download runs on the executor threads
+        return await asyncio.to_thread(fetch_page, url, headers, cache)
+
+'''Coroutine to download all the pages with bounded concurrency'''
+async def fetch_pages_async(urls, max_connections=MAX_CONNECTIONS,
+                            max_connections_per_host=MAX_CONNECTIONS_PER_HOST,
+                            headers=HEADERS, cache=None):
+    connections = asyncio.Semaphore(max_connections)
+    host_connections = {
+        host: asyncio.Semaphore(max_connections_per_host)
+        for host in {urlsplit(url).netloc for url in urls}
+    }
+
+    tasks = [
+        fetch_page_async(url, connections, host_connections, headers, cache)
+        for url in urls
+    ]
+
+    # failures are returned in place so that the caller decides what to keep
+    return await asyncio.gather(*tasks, return_exceptions=True)
+
+'''Function to download all the pages concurrently, in the order of the urls'''
+def fetch_pages(urls, max_connections=MAX_CONNECTIONS,
+                max_connections_per_host=MAX_CONNECTIONS_PER_HOST,
+                headers=HEADERS, cache=None):
+    LOGGER.info('fetching %d pages (connections: %d, per host: %d)...'
+                % (len(urls), max_connections, max_connections_per_host))
+
+    async def run():
+        # the default executor is sized so no slot waits for a free thread
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(max_connections))
+
+        return await fetch_pages_async(
+            urls, max_connections, max_connections_per_host, headers, cache)
+
+    return asyncio.run(run())
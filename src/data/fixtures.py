@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import logging
+import random
+import click
+
+from html import escape
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.stub_server import save_page
+
+'''Certificates used when making up movies'''
+CERTIFICATES = ['G', 'PG', 'PG-13', 'R', 'NC-17', 'TV-14', 'TV-MA',
+                'Not Rated']
+
+'''Genres used when making up movies'''
+GENRES = ['Action', 'Adventure', 'Comedy', 'Crime', 'Drama', 'Fantasy',
+          'Horror', 'Music', 'Musical', 'Mystery', 'Romance', 'Sci-Fi',
+          'Sport', 'Thriller', 'War', 'Western']
+
+'''Number of movies in every search page'''
+MOVIES_PER_PAGE = 50
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Template of a single movie in the IMDB search results, a trailing backslash
+continues a line of the html without changing the pages
+'''
+MOVIE_TEMPLATE = '''
+<div class="lister-item mode-advanced">
+    <div class="lister-item-image float-left">
+        <a href="/title/{uid}/"><img alt="{name}" class="loadlate" \
+data-tconst="{uid}" height="98" src="" width="67"/></a>
+    </div>
+    <div class="lister-item-content">
+        <h3 class="lister-item-header">
+            <span class="lister-item-index unbold text-primary">{rank}.</span>
+            <a href="/title/{uid}/">{name}</a>
+            <span class="lister-item-year text-muted unbold">({year})</span>
+        </h3>
+        <p class="text-muted ">
+            {certificate}
+            <span class="runtime">{runtime} min</span>
+            <span class="ghost">|</span>
+            <span class="genre">
+{genre}            </span>
+        </p>
+        <div class="ratings-bar">
+            <div class="inline-block ratings-imdb-rating" name="ir" \
+data-value="{rating}">
+                <strong>{rating}</strong>
+            </div>
+        </div>
+        <p class="text-muted">A made up plot for {name}.</p>
+        <p class="">
+            Director:
+<a href="/name/{director_id}/">{director}</a>
+            <span class="ghost">|</span>
+            Stars:
+{stars}
+        </p>
+        <p class="sort-num_votes-visible">
+            <span class="text-muted">Votes:</span>
+            <span data-value="{num_votes}" name="nv">{num_votes_text}</span>
+        </p>
+    </div>
+</div>'''
+
+'''Template of a search results page'''
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head><title>IMDb: Advanced Title Search</title></head>
+<body>
+<div id="main">
+<div class="article">
+<div class="lister list detail sub-list">
+<div class="lister-list">{movies}
+</div>
+</div>
+</div>
+</div>
+</body>
+</html>
+'''
+
+'''Function to make up the html of a single movie'''
+def render_movie(rng, uid, rank):
+    certificate = rng.choice(CERTIFICATES)
+    stars = ', \n'.join(
+        '<a href="/name/nm%07d/">Star %d</a>' % (n, n)
+        for n in rng.sample(range(5000), 4)
+    )
+    num_votes = rng.randint(5, 2500000)
+    director = rng.randrange(2000)
+
+    return MOVIE_TEMPLATE.format(
+        uid=uid,
+        rank='{:,}'.format(rank),
+        name=escape('Movie %s' % uid),
+        year=rng.randint(1920, 2023),
+        certificate=('<span class="certificate">%s</span>\n'
+                     '            <span class="ghost">|</span>' % certificate),
+        runtime=rng.randint(60, 200),
+        genre=', '.join(rng.sample(GENRES, rng.randint(1, 3))),
+        rating='%.1f' % rng.uniform(1, 10),
+        director_id='nm%07d' % director,
+        director='Director %d' % director,
+        stars=stars,
+        num_votes=num_votes,
+        num_votes_text='{:,}'.format(num_votes),
+    )
+
+'''Function to make up a whole search results page'''
+def render_search_page(start, seed=0, num_movies=MOVIES_PER_PAGE,
+                       num_titles=100000):
+    rng = random.Random('%d-%d' % (seed, start))
+    # uids repeat across genres like titles listed under several genres
+    movies = ''.join(
+        render_movie(rng, 'tt%07d' % rng.randrange(num_titles), start + n)
+        for n in range(num_movies)
+    )
+
+    return PAGE_TEMPLATE.format(movies=movies)
+
+'''Function to write a frozen corpus of search pages for the stub server'''
+def make_corpus(directory, genres, num_pages, seed=0):
+    LOGGER.info('writing %d pages per genre into %s...'
+                % (num_pages, directory))
+
+    for g, genre in enumerate(genres):
+        for page in range(num_pages):
+            start = 51 + page * MOVIES_PER_PAGE
+            save_page(directory, genre, start,
+                      render_search_page(start, seed + g))
+
+    return Path(directory)
+
+@click.command()
+@click.argument('output_directory', type=click.Path())
+@click.option('--genre', 'genres', multiple=True,
+              default=['mystery', 'thriller'])
+@click.option('--num-pages', default=10)
+@click.option('--seed', default=0)
+def main(output_directory, genres, num_pages, seed):
+    """ Writes made up IMDB search pages to benchmark and test the scraper
+        without touching the network.
+    """
+    make_corpus(output_directory, genres, num_pages, seed)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
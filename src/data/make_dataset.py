@@ -1,20 +1,297 @@
 # -*- coding: utf-8 -*-
+import os
+import json
 import click
+import shutil
+import hashlib
 import logging
+import datetime
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import find_dotenv, load_dotenv
 
+from src.data.raw_store import MOVIES_SCHEMA
+from src.data.scrap_dataset import (MOVIE_COLUMNS, TV_PARENTAL_RATING,
+                                    MISSING_VALUES)
+
+'''Number of raw rows read and cleaned at a time'''
+CHUNK_SIZE = 50000
+
+'''Number of uid buckets, a bucket is the most deduplication holds in memory'''
+NUM_BUCKETS = 16
+
+'''
+Directory of the cleaned chunks and the manifest of the raw files already
+processed
+'''
+INTERIM_DIR = './data/interim/make_dataset'
+
+'''Schema of the processed movies'''
+OUTPUT_SCHEMA = MOVIES_SCHEMA.append(pa.field('search_genre', pa.string())) \
+                             .append(pa.field('scrape_date', pa.string()))
+
+'''Schema of the cleaned chunks, with the row order of the raw file'''
+INTERIM_SCHEMA = OUTPUT_SCHEMA.append(pa.field('row', pa.int64()))
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to list the raw line-delimited dumps and the parquet files of the
+raw store
+'''
+def get_raw_files(input_directory):
+    input_directory = Path(input_directory)
+    return sorted(list(input_directory.glob('*.json'))
+                  + list(input_directory.glob('*.jsonl'))
+                  + list(input_directory.glob('movies/**/*.parquet')))
+
+'''Function to get what tells a raw file apart from its previous version'''
+def get_file_state(path):
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+'''Function to get the genre and the scrape date of a raw file'''
+def get_file_partition(path):
+    # raw store files carry them in the hive partition directories
+    partition = dict(part.split('=', 1) for part in path.parts if '=' in part)
+    scrape_date = partition.get('scrape_date') or \
+        datetime.date.fromtimestamp(path.stat().st_mtime).isoformat()
+
+    return partition.get('search_genre', ''), scrape_date
+
+'''Function to read a raw file a chunk at a time'''
+def iter_chunks(path, chunk_size=CHUNK_SIZE):
+    if path.suffix == '.parquet':
+        batches = pq.ParquetFile(path).iter_batches(chunk_size,
+                                                    columns=MOVIE_COLUMNS)
+        for batch in batches:
+            yield batch.to_pandas()
+    else:
+        # dtype=False keeps the scraped strings so they are coerced in one
+        # place
+        with pd.read_json(path, lines=True, chunksize=chunk_size,
+                          dtype=False) as reader:
+            yield from reader
+
+'''Function to coerce a numeric column, missing or malformed values to 0'''
+def to_number(column, dtype):
+    if not pd.api.types.is_numeric_dtype(column):
+        column = pd.to_numeric(column.astype(str).str.replace(',', ''),
+                               errors='coerce')
+    return column.fillna(0).astype(dtype)
+
+'''Function to get a list column, missing values becoming empty lists'''
+def to_list(column):
+    return column.map(lambda value: list(value)
+                      if isinstance(value, (list, tuple, np.ndarray))
+                      else [])
+
+'''Function to normalize, filter and type a chunk of raw movies'''
+def clean_chunk(df):
+    for column in MOVIE_COLUMNS:
+        if column not in df:
+            df[column] = None
+
+    # only titled movies with a certificate are kept, as in the scraper
+    df = df[df['uid'].notna() & (df['uid'] != '')]
+    certificate = df['certificate'].fillna('not certified').astype(str)
+    df = df[~certificate.isin(TV_PARENTAL_RATING + MISSING_VALUES)]
+
+    return pd.DataFrame({
+        'uid': df['uid'].astype(str),
+        'rank': to_number(df['rank'], np.int32),
+        'name': df['name'].fillna('').astype(str).str.strip(),
+        'year': to_number(df['year'], np.int16),
+        'certificate': df['certificate'].astype(str),
+        'runtime': to_number(df['runtime'], np.int16),
+        'genre': to_list(df['genre']),
+        'rating': to_number(df['rating'], np.float32),
+        'director': df['director'].fillna('').astype(str).str.strip(),
+        'stars': to_list(df['stars']),
+        'num_votes': to_number(df['num_votes'], np.int64),
+    })
+
+'''Function to get the bucket of every uid, the same in every process'''
+def get_buckets(uids, num_buckets=NUM_BUCKETS):
+    return pd.util.hash_array(uids.to_numpy(dtype=object)) % num_buckets
+
+'''
+Function to clean a raw file in chunks, splitting its movies into uid
+buckets
+'''
+def process_file(path, directory, chunk_size=CHUNK_SIZE,
+                 num_buckets=NUM_BUCKETS):
+    path = Path(path)
+    directory = Path(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+
+    search_genre, scrape_date = get_file_partition(path)
+    writers = {}
+    num_raw = num_clean = 0
+
+    try:
+        for df in iter_chunks(path, chunk_size):
+            clean = clean_chunk(df.reset_index(drop=True))
+            clean['search_genre'] = search_genre
+            clean['scrape_date'] = scrape_date
+            # the position in the file breaks the ties between rows of the
+            # same file
+            clean['row'] = num_raw + clean.index.to_numpy()
+            num_raw += len(df)
+            num_clean += len(clean)
+
+            buckets = get_buckets(clean['uid'], num_buckets)
+            for bucket in np.unique(buckets):
+                if bucket not in writers:
+                    writers[bucket] = pq.ParquetWriter(
+                        directory / ('bucket-%d.parquet' % bucket),
+                        INTERIM_SCHEMA)
+                table = pa.Table.from_pandas(clean[buckets == bucket],
+                                             preserve_index=False)
+                writers[bucket].write_table(table.cast(INTERIM_SCHEMA))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    return str(path), num_raw, num_clean
+
+'''
+Function to deduplicate a bucket across every raw file, the latest scrape of
+a uid wins
+'''
+def merge_bucket(bucket, directories):
+    tables = []
+    for rank, directory in enumerate(directories):
+        path = Path(directory) / ('bucket-%d.parquet' % bucket)
+        if path.is_file():
+            table = pq.read_table(path)
+            # later raw files win over earlier ones of the same date
+            files = np.full(table.num_rows, rank, dtype=np.int32)
+            tables.append(table.append_column('file', pa.array(files)))
+    if not tables:
+        return OUTPUT_SCHEMA.empty_table()
+
+    df = pa.concat_tables(tables).to_pandas()
+    df = df.sort_values(['scrape_date', 'file', 'row'], kind='stable')
+    df = df.drop_duplicates(subset='uid', keep='last').sort_values('uid')
+
+    table = pa.Table.from_pandas(df[OUTPUT_SCHEMA.names], preserve_index=False)
+    return table.cast(OUTPUT_SCHEMA)
+
+'''Function to read the manifest of the raw files processed by the last run'''
+def read_manifest(interim_directory):
+    path = Path(interim_directory) / 'manifest.json'
+    if not path.is_file():
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def write_manifest(interim_directory, manifest):
+    with open(Path(interim_directory) / 'manifest.json', 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+'''
+Function to turn the raw files into the processed movies, cleaning only the
+files that changed
+'''
+def make_dataset(input_directory, output_directory,
+                 interim_directory=INTERIM_DIR, chunk_size=CHUNK_SIZE,
+                 num_buckets=NUM_BUCKETS, num_workers=None):
+    interim_directory = Path(interim_directory)
+    interim_directory.mkdir(parents=True, exist_ok=True)
+    output_path = Path(output_directory) / 'movies.parquet'
+
+    manifest = read_manifest(interim_directory)
+    # a different bucket count invalidates every cleaned file
+    if manifest and manifest.get('num_buckets') != num_buckets:
+        manifest = {}
+    files = manifest.get('files', {})
+
+    raw_files = get_raw_files(input_directory)
+    current = {}
+    changed = []
+    for path in raw_files:
+        state = get_file_state(path)
+        key = hashlib.sha1(str(path.resolve()).encode('utf-8'))
+        key = key.hexdigest()[:16]
+        current[str(path)] = dict(state, key=key)
+        previous = files.get(str(path))
+        if (previous is None or previous['size'] != state['size']
+                or previous['mtime_ns'] != state['mtime_ns']):
+            changed.append(path)
+
+    removed = set(files) - set(current)
+    for path in removed:
+        shutil.rmtree(interim_directory / files[path]['key'],
+                      ignore_errors=True)
+
+    LOGGER.info('%d raw files, %d new or changed, %d removed'
+                % (len(raw_files), len(changed), len(removed)))
+    if not changed and not removed and output_path.is_file():
+        LOGGER.info('nothing to do, %s is up to date' % output_path)
+        return output_path
+
+    num_workers = num_workers or os.cpu_count()
+    with ProcessPoolExecutor(num_workers) as executor:
+        futures = []
+        for path in changed:
+            directory = interim_directory / current[str(path)]['key']
+            futures.append(executor.submit(process_file, path, directory,
+                                           chunk_size, num_buckets))
+        for future in futures:
+            path, num_raw, num_clean = future.result()
+            current[path]['rows'] = num_clean
+            LOGGER.info('%s: %d raw rows, %d movies'
+                        % (path, num_raw, num_clean))
+        for path in current:
+            current[path].setdefault('rows', files.get(path, {}).get('rows'))
+
+        directories = [str(interim_directory / current[str(path)]['key'])
+                       for path in raw_files]
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        num_movies = 0
+        # the buckets are merged in parallel and written one after another
+        with pq.ParquetWriter(output_path, OUTPUT_SCHEMA,
+                              compression='zstd') as writer:
+            for table in executor.map(merge_bucket, range(num_buckets),
+                                      [directories] * num_buckets):
+                writer.write_table(table)
+                num_movies += table.num_rows
+
+    write_manifest(interim_directory,
+                   {'num_buckets': num_buckets, 'files': current})
+    LOGGER.info('%d movies saved to %s' % (num_movies, output_path))
+
+    return output_path
+
 
 @click.command()
 @click.argument('input_filepath', type=click.Path(exists=True))
 @click.argument('output_filepath', type=click.Path())
-def main(input_filepath, output_filepath):
+@click.option('--interim', 'interim_filepath', default=INTERIM_DIR,
+              type=click.Path())
+@click.option('--chunk-size', default=CHUNK_SIZE)
+@click.option('--buckets', 'num_buckets', default=NUM_BUCKETS)
+@click.option('--workers', default=0, help='0 uses every core')
+def main(input_filepath, output_filepath, interim_filepath, chunk_size,
+         num_buckets, workers):
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
     logger = logging.getLogger(__name__)
     logger.info('making final data set from raw data')
 
+    # the raw dumps and the raw store files are cleaned in chunks, a file at a
+    # time
+    make_dataset(input_filepath, output_filepath, interim_filepath,
+                 chunk_size, num_buckets, workers or None)
+
 
 if __name__ == '__main__':
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import bisect
+import cProfile
+import logging
+import threading
+import functools
+
+from pathlib import Path
+from contextlib import contextmanager
+
+'''Upper bounds in seconds of the latency histogram buckets'''
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0)
+
+'''Prefix of the exported metric names'''
+METRICS_PREFIX = 'imdb_scraper'
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to get the labels of the buckets, the +Inf one included'''
+def get_bucket_labels(buckets):
+    return [str(bound) for bound in buckets] + ['+Inf']
+
+'''Class to count the observed latencies of a stage in cumulative buckets'''
+class Histogram:
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.rows = 0
+
+    def observe(self, seconds, rows=0):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        self.rows += rows
+
+    def get_quantile(self, quantile):
+        '''Returns the upper bound of the bucket holding the quantile'''
+        if not self.count:
+            return 0.0
+        rank = quantile * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def get_snapshot(self):
+        return {
+            'count': self.count,
+            'seconds': self.sum,
+            'rows': self.rows,
+            'rows_per_second': self.rows / self.sum if self.sum else 0.0,
+            'p50_seconds': self.get_quantile(0.5),
+            'p99_seconds': self.get_quantile(0.99),
+            'buckets': dict(zip(get_bucket_labels(self.buckets), self.counts)),
+        }
+
+'''Class to collect the latencies of the stages and the crawl counters'''
+class Metrics:
+
+    def __init__(self):
+        # stages are timed from the fetching threads as well
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.started_at = time.time()
+
+    def observe(self, stage, seconds, rows=0):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds, rows)
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        '''
+        Times the block as the stage, the rows it handled can be set on the
+        yielded dict
+        '''
+        stats = {'rows': 0}
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            self.observe(stage, time.perf_counter() - start, stats['rows'])
+
+    def instrument(self, stage, rows=None):
+        '''
+        Decorator timing every call of a function, rows counts the rows of
+        its result
+        '''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = function(*args, **kwargs)
+                except Exception:
+                    self.increment('errors', stage=stage)
+                    raise
+                self.observe(stage, time.perf_counter() - start,
+                             rows(result) if rows else 0)
+                return result
+            return wrapper
+        return decorator
+
+    def record_response(self, response):
+        '''Counts the status and the downloaded bytes of an HTTP response'''
+        self.increment('http_responses', status=str(response.status_code))
+        self.increment('bytes_downloaded', len(response.content))
+
+    def reset(self):
+        with self.lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.started_at = time.time()
+
+    def get_snapshot(self):
+        with self.lock:
+            stages = {stage: histogram.get_snapshot()
+                      for stage, histogram in self.histograms.items()}
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value
+                        in sorted(self.counters.items())]
+
+        return {
+            'started_at': self.started_at,
+            'uptime_seconds': time.time() - self.started_at,
+            'stages': stages,
+            'counters': counters,
+        }
+
+    def to_prometheus(self):
+        '''Returns the metrics in the Prometheus text exposition format'''
+        name = METRICS_PREFIX + '_stage_seconds'
+        lines = ['# HELP %s Latency of the scraper stages.' % name,
+                 '# TYPE %s histogram' % name]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                bounds = get_bucket_labels(histogram.buckets)
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{stage="%s",le="%s"} %d'
+                                 % (name, stage, bound, cumulative))
+                lines.append('%s_sum{stage="%s"} %f'
+                             % (name, stage, histogram.sum))
+                lines.append('%s_count{stage="%s"} %d'
+                             % (name, stage, histogram.count))
+
+            rows_name = METRICS_PREFIX + '_stage_rows_total'
+            lines += ['# HELP %s Rows handled by the scraper stages.'
+                      % rows_name, '# TYPE %s counter' % rows_name]
+            lines += ['%s{stage="%s"} %d' % (rows_name, stage, histogram.rows)
+                      for stage, histogram in sorted(self.histograms.items())]
+
+            names = sorted({counter for counter, _ in self.counters})
+            for counter in names:
+                counter_name = '%s_%s_total' % (METRICS_PREFIX, counter)
+                lines.append('# TYPE %s counter' % counter_name)
+                for (other, labels), value in sorted(self.counters.items()):
+                    if other != counter:
+                        continue
+                    labels = ','.join('%s="%s"' % item for item in labels)
+                    labels = '{%s}' % labels if labels else ''
+                    lines.append('%s%s %d' % (counter_name, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, filepath):
+        '''Writes the metrics for the node exporter textfile collector'''
+        write_atomically(filepath, self.to_prometheus())
+
+    def write_json(self, filepath):
+        write_atomically(filepath, json.dumps(self.get_snapshot(), indent=2))
+
+    def log_summary(self):
+        for stage, stats in sorted(self.get_snapshot()['stages'].items()):
+            LOGGER.info('%-20s %7d calls %9.2fs total %10.0f rows/s '
+                        'p50 <= %gs p99 <= %gs' % (
+                            stage, stats['count'], stats['seconds'],
+                            stats['rows_per_second'], stats['p50_seconds'],
+                            stats['p99_seconds']))
+
+'''Function to replace a file at once so a collector never reads half of it'''
+def write_atomically(filepath, text):
+    filepath = Path(filepath)
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    temporary = filepath.with_name(filepath.name + '.tmp')
+    with open(temporary, 'w') as f:
+        f.write(text)
+    os.replace(temporary, filepath)
+
+'''Metrics shared by the whole scraper'''
+METRICS = Metrics()
+
+'''Function to get the metrics shared by the whole scraper'''
+def get_metrics():
+    return METRICS
+
+'''
+Function to write the metrics to the files named by IMDB_METRICS_TEXTFILE and
+IMDB_METRICS_JSON
+'''
+def export_metrics(metrics=METRICS):
+    textfile = os.getenv('IMDB_METRICS_TEXTFILE')
+    if textfile:
+        metrics.write_textfile(textfile)
+    json_file = os.getenv('IMDB_METRICS_JSON')
+    if json_file:
+        metrics.write_json(json_file)
+
+'''
+Context manager to profile the block with cProfile when a stats file is
+given
+'''
+@contextmanager
+def profile(filepath=None):
+    if not filepath:
+        # sampling profilers attach from the outside, e.g. py-spy record --pid
+        LOGGER.debug('running as pid %d' % os.getpid())
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(filepath)
+        LOGGER.info('profile saved to %s (python -m pstats %s)'
+                    % (filepath, filepath))
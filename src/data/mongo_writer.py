@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+import os
+import logging
+import time
+import weakref
+
+from pymongo import MongoClient, UpdateOne, errors, ASCENDING, DESCENDING
+
+from src.data.metrics import METRICS
+
+'''Number of records sent to the database in a single bulk write'''
+BATCH_SIZE = 1000
+
+'''Maximum number of pooled connections of the shared client'''
+MAX_POOL_SIZE = 16
+
+'''
+Secondary indexes of the filtered reads, genre is a multikey index over the
+list
+'''
+ANALYTIC_INDEXES = [
+    [('genre', ASCENDING), ('num_votes', DESCENDING)],
+    [('year', ASCENDING)],
+    [('rating', DESCENDING)],
+    [('num_votes', DESCENDING)],
+]
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Client shared by every writer so connections are pooled for the whole run'''
+CLIENT = None
+
+'''Collections whose indexes were already created in this process, by client'''
+INDEXED = {}
+
+'''Function to get the shared database client, creating it on first use'''
+def get_client():
+    global CLIENT
+
+    if CLIENT is None:
+        CLIENT = MongoClient(os.getenv('MONGODB_URI'),
+                             maxPoolSize=MAX_POOL_SIZE)
+
+    return CLIENT
+
+'''Function to get the movies collection'''
+def get_collection(client=None):
+    client = get_client() if client is None else client
+    # database and collection
+    return client["imdb"]["movies"]
+
+'''
+Function to create the uid and analytic indexes of a collection once per
+process
+'''
+def ensure_indexes(collection):
+    # clients compare equal by address, so they are told apart by identity
+    client = collection.database.client
+    if id(client) not in INDEXED:
+        INDEXED[id(client)] = set()
+        # a collected client can not hand its entry to a new one at the same id
+        weakref.finalize(client, INDEXED.pop, id(client), None)
+    indexed = INDEXED[id(client)]
+    if collection.full_name in indexed:
+        return
+
+    collection.create_index([('uid', ASCENDING)], unique=True)
+    for keys in ANALYTIC_INDEXES:
+        collection.create_index(keys)
+    indexed.add(collection.full_name)
+
+'''Function to convert a data-frame into records without a JSON round-trip'''
+def get_records(df):
+    # to_dict boxes the numpy values into native python types
+    return df.to_dict(orient='records')
+
+'''Class to stream movie records into the database as upserts keyed on uid'''
+class MongoWriter:
+
+    def __init__(self, collection=None, batch_size=BATCH_SIZE):
+        self.collection = (get_collection() if collection is None
+                           else collection)
+        self.batch_size = batch_size
+        self.buffer = []
+        self.num_records = 0
+        self.num_inserted = 0
+        self.num_updated = 0
+        self.num_errors = 0
+        self.seconds = 0.0
+
+        # creating index once instead of on every save
+        ensure_indexes(self.collection)
+
+    def get_operation(self, record, genre=None):
+        fields = dict(record)
+        # the rank of a title is kept for every genre it is listed under
+        if genre is not None:
+            fields['ranks.' + genre] = record['rank']
+        return UpdateOne({'uid': record['uid']}, {'$set': fields}, upsert=True)
+
+    def add(self, operation):
+        self.buffer.append(operation)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def write(self, records, genre=None):
+        '''Buffers the records and flushes every full batch'''
+        for record in records:
+            self.add(self.get_operation(record, genre))
+
+    def write_df(self, df, genre=None):
+        self.write(get_records(df), genre)
+
+    def write_ranks(self, genre, ranks):
+        '''Adds the genre rank of titles already written, not rewriting them'''
+        for uid, rank in ranks:
+            self.add(UpdateOne({'uid': uid},
+                               {'$set': {'ranks.' + genre: rank}}))
+
+    def flush(self):
+        if not self.buffer:
+            return
+
+        operations, self.buffer = self.buffer, []
+        start = time.perf_counter()
+        try:
+            result = self.collection.bulk_write(operations, ordered=False)
+            details = result.bulk_api_result
+        except errors.BulkWriteError as bwe:
+            details = bwe.details
+            for we in details['writeErrors']:
+                LOGGER.error(we['errmsg'])
+            self.num_errors += len(details['writeErrors'])
+        self.seconds += time.perf_counter() - start
+        METRICS.observe('mongo_bulk_write', time.perf_counter() - start,
+                        len(operations))
+
+        self.num_records += len(operations)
+        self.num_inserted += details['nUpserted']
+        self.num_updated += details['nModified']
+
+    def get_stats(self):
+        return {
+            'records': self.num_records,
+            'inserted': self.num_inserted,
+            'updated': self.num_updated,
+            'errors': self.num_errors,
+            'seconds': self.seconds,
+            'records_per_second': (self.num_records / self.seconds
+                                   if self.seconds else 0.0),
+        }
+
+    def close(self):
+        self.flush()
+        stats = self.get_stats()
+        LOGGER.info('%d movies inserted, %d updated (%.0f records/s)'
+                    % (stats['inserted'], stats['updated'],
+                       stats['records_per_second']))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.mongo_writer import ensure_indexes, get_collection
+from src.data.raw_store import MOVIES_SCHEMA
+
+'''Number of documents fetched from the server per cursor batch'''
+READ_BATCH_SIZE = 10000
+
+'''Columns that can be read into NumPy arrays'''
+NUMERIC_COLUMNS = ['rank', 'year', 'runtime', 'rating', 'num_votes']
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to build the filter of a query, skipping conditions not given'''
+def get_query(genres=None, min_year=None, max_year=None, min_rating=None,
+              min_votes=None):
+    query = {}
+    if genres:
+        query['genre'] = {'$in': list(genres)}
+    if min_year is not None or max_year is not None:
+        query['year'] = {}
+        if min_year is not None:
+            query['year']['$gte'] = min_year
+        if max_year is not None:
+            query['year']['$lte'] = max_year
+    if min_rating is not None:
+        query['rating'] = {'$gte': min_rating}
+    if min_votes is not None:
+        query['num_votes'] = {'$gte': min_votes}
+
+    return query
+
+'''Function to get the arrow schema of the requested columns'''
+def get_schema(columns=None):
+    columns = columns or MOVIES_SCHEMA.names
+    return pa.schema([MOVIES_SCHEMA.field(column) for column in columns])
+
+'''Function to turn the column buffers of a batch into an arrow record batch'''
+def get_record_batch(buffers, schema):
+    arrays = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            array = pa.array(buffers[field.name], pa.string())
+            arrays.append(array.dictionary_encode().cast(field.type))
+        else:
+            arrays.append(pa.array(buffers[field.name], field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+'''
+Function to stream the matching movies as arrow record batches of bounded
+size
+'''
+def iter_batches(collection=None, query=None, columns=None,
+                 batch_size=READ_BATCH_SIZE, sort=None):
+    collection = get_collection() if collection is None else collection
+    schema = get_schema(columns)
+    # the filters rely on the analytic indexes, even on a collection no writer
+    # touched
+    ensure_indexes(collection)
+
+    # only the requested fields leave the server
+    projection = {name: 1 for name in schema.names}
+    projection['_id'] = 0
+    cursor = collection.find(query or {}, projection, batch_size=batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+
+    # each document is spread into the column buffers and dropped right away
+    buffers = {name: [] for name in schema.names}
+    size = 0
+    for document in cursor:
+        for name, buffer in buffers.items():
+            buffer.append(document.get(name))
+        size += 1
+        if size == batch_size:
+            yield get_record_batch(buffers, schema)
+            buffers = {name: [] for name in schema.names}
+            size = 0
+
+    if size:
+        yield get_record_batch(buffers, schema)
+
+'''Function to read the matching movies into an arrow table'''
+def read_table(collection=None, query=None, columns=None,
+               batch_size=READ_BATCH_SIZE, sort=None):
+    batches = iter_batches(collection, query, columns, batch_size, sort)
+    return pa.Table.from_batches(list(batches), schema=get_schema(columns))
+
+'''Function to read numeric columns of the matching movies into NumPy arrays'''
+def read_arrays(collection=None, query=None, columns=NUMERIC_COLUMNS,
+                batch_size=READ_BATCH_SIZE):
+    schema = get_schema(columns)
+    chunks = {name: [] for name in schema.names}
+
+    for batch in iter_batches(collection, query, schema.names, batch_size):
+        for name, column in zip(batch.schema.names, batch.columns):
+            # missing values are read as 0 like the scraped defaults
+            column = column.fill_null(0)
+            chunks[name].append(column.to_numpy(zero_copy_only=False))
+
+    return {
+        name: np.concatenate(parts) if parts else np.empty(
+            0, dtype=schema.field(name).type.to_pandas_dtype())
+        for name, parts in chunks.items()
+    }
+
+'''
+Function to write the matching movies to a parquet file one batch at a
+time
+'''
+def export_parquet(filepath, collection=None, query=None, columns=None,
+                   batch_size=READ_BATCH_SIZE):
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    num_rows = 0
+
+    with pq.ParquetWriter(filepath, get_schema(columns),
+                          compression='zstd') as writer:
+        for batch in iter_batches(collection, query, columns, batch_size):
+            writer.write_batch(batch)
+            num_rows += batch.num_rows
+
+    return num_rows
+
+@click.command()
+@click.argument('output_filepath', type=click.Path())
+@click.option('--genre', 'genres', multiple=True)
+@click.option('--min-year', type=int, default=None)
+@click.option('--max-year', type=int, default=None)
+@click.option('--min-rating', type=float, default=None)
+@click.option('--min-votes', type=int, default=None)
+@click.option('--column', 'columns', multiple=True,
+              help='Columns to read (all by default)')
+@click.option('--batch-size', default=READ_BATCH_SIZE)
+def main(output_filepath, genres, min_year, max_year, min_rating, min_votes,
+         columns, batch_size):
+    """ Streams the movies matching the filters from the database into a
+        parquet file in OUTPUT_FILEPATH.
+    """
+    query = get_query(genres, min_year, max_year, min_rating, min_votes)
+    num_rows = export_parquet(output_filepath, query=query,
+                              columns=list(columns) or None,
+                              batch_size=batch_size)
+    LOGGER.info('%d movies matching %s saved to %s'
+                % (num_rows, query, output_filepath))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
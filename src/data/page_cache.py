@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from src.data.metrics import METRICS
+from src.data.crawler import PageError
+
+'''Seconds a cached page is served without asking the server again'''
+CACHE_TTL = 7 * 24 * 60 * 60
+
+'''Maximum number of bytes kept in the cache before evicting old pages'''
+CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Exception raised when an offline cache does not have the page'''
+class CacheMissError(Exception):
+    pass
+
+'''Function to get the cache key (genre, start) of a search url'''
+def get_page_key(url):
+    query = parse_qs(urlsplit(url).query)
+    # the first page of a genre has no start parameter
+    return query.get('genres', [''])[0], int(query.get('start', ['1'])[0])
+
+'''Class to keep the downloaded search pages on disk'''
+class PageCache:
+
+    def __init__(self, directory, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 offline=False):
+        self.directory = Path(directory)
+        self.objects = self.directory / 'objects'
+        self.objects.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+
+        # the pages are fetched from several threads at the same time
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(str(self.directory / 'index.sqlite'),
+                                  check_same_thread=False)
+        self.db.execute('''
+            CREATE TABLE IF NOT EXISTS pages (
+                genre TEXT NOT NULL,
+                start INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                fetched_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (genre, start)
+            )''')
+        self.db.commit()
+
+    def get_object_path(self, digest):
+        return self.objects / digest[:2] / (digest + '.html')
+
+    def get(self, genre, start):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT digest, etag, last_modified, fetched_at FROM pages '
+                'WHERE genre = ? AND start = ?', (genre, start)).fetchone()
+        if row is None:
+            return None
+
+        digest, etag, last_modified, fetched_at = row
+        path = self.get_object_path(digest)
+        if not path.is_file():
+            return None
+
+        return {
+            'text': path.read_text(encoding='utf-8'),
+            'etag': etag,
+            'last_modified': last_modified,
+            'fetched_at': fetched_at,
+        }
+
+    def put(self, genre, start, text, etag=None, last_modified=None):
+        body = text.encode('utf-8')
+        # identical pages share the same file
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.get_object_path(digest)
+        if not path.is_file():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix('.tmp%d' % threading.get_ident())
+            tmp_path.write_bytes(body)
+            tmp_path.replace(path)
+
+        now = time.time()
+        with self.lock:
+            self.db.execute(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (genre, start, digest, len(body), etag, last_modified, now,
+                 now))
+            self.db.commit()
+
+        self.evict()
+
+    def touch(self, genre, start, revalidated=False):
+        now = time.time()
+        with self.lock:
+            if revalidated:
+                self.db.execute(
+                    'UPDATE pages SET fetched_at = ?, accessed_at = ? '
+                    'WHERE genre = ? AND start = ?', (now, now, genre, start))
+            else:
+                self.db.execute(
+                    'UPDATE pages SET accessed_at = ? '
+                    'WHERE genre = ? AND start = ?',
+                    (now, genre, start))
+            self.db.commit()
+
+    def size(self):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM '
+                '(SELECT DISTINCT digest, size FROM pages)').fetchone()
+        return row[0]
+
+    def evict(self):
+        '''Removes the least recently used pages until the cache fits'''
+        if self.size() <= self.max_bytes:
+            return
+
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT genre, start, digest, size FROM pages '
+                'ORDER BY accessed_at').fetchall()
+            total = sum(dict((digest, size)
+                             for _, _, digest, size in rows).values())
+
+            for genre, start, digest, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self.db.execute(
+                    'DELETE FROM pages WHERE genre = ? AND start = ?',
+                    (genre, start))
+                still_used = self.db.execute(
+                    'SELECT 1 FROM pages WHERE digest = ? LIMIT 1',
+                    (digest,)).fetchone()
+                if still_used is None:
+                    self.get_object_path(digest).unlink(missing_ok=True)
+                    total -= size
+            self.db.commit()
+
+    def fetch(self, session, url, headers):
+        '''Returns the page text from the cache, revalidated past the ttl'''
+        genre, start = get_page_key(url)
+        entry = self.get(genre, start)
+
+        if entry is not None and (
+                self.offline or time.time() - entry['fetched_at'] < self.ttl):
+            self.hits += 1
+            METRICS.increment('page_cache', result='hit')
+            self.touch(genre, start)
+            return entry['text']
+
+        if self.offline:
+            self.misses += 1
+            METRICS.increment('page_cache', result='miss')
+            raise CacheMissError(f'Page not cached {url}')
+
+        headers = dict(headers)
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response = session.get(url, headers=headers)
+
+        if response.status_code == 304 and entry is not None:
+            self.revalidations += 1
+            METRICS.increment('page_cache', result='revalidated')
+            self.touch(genre, start, revalidated=True)
+            return entry['text']
+
+        # to check whether the response is successful or not
+        if response.status_code != 200:
+            raise PageError(url, response.status_code)
+
+        self.misses += 1
+        METRICS.increment('page_cache', result='miss')
+        self.put(genre, start, response.text,
+                 response.headers.get('ETag'),
+                 response.headers.get('Last-Modified'))
+
+        return response.text
+
+    def close(self):
+        LOGGER.info('page cache: %d hits, %d revalidated, %d misses'
+                    % (self.hits, self.revalidations, self.misses))
+        self.db.close()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import os
+import time
+import queue
+import logging
+import threading
+
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from src.data.crawler import fetch_page, MAX_CONNECTIONS_PER_HOST
+from src.data.metrics import METRICS
+
+'''Number of parser processes, one per core'''
+NUM_PARSERS = os.cpu_count() or 1
+
+'''Maximum number of downloaded pages waiting for a parser'''
+PAGE_QUEUE_SIZE = 32
+
+'''Maximum number of pages being parsed or waiting for the writer, a parser'''
+PARSED_PER_PARSER = 2
+
+'''
+Seconds a blocked stage waits before checking whether the pipeline was
+stopped
+'''
+POLL_INTERVAL = 0.1
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to run the parser in a worker process, timing it'''
+def run_parser(parse, page):
+    begin = time.perf_counter()
+    records = parse(page)
+    return records, time.perf_counter() - begin
+
+'''
+Function to put an item on a bounded queue, giving up once the pipeline is
+stopped
+'''
+def put(items, item, stopped):
+    while not stopped.is_set():
+        try:
+            items.put(item, timeout=POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+'''
+Class to stream pages from the fetchers through a process pool of parsers to
+a writer
+'''
+class Pipeline:
+
+    def __init__(self, parse, num_fetchers=MAX_CONNECTIONS_PER_HOST,
+                 num_parsers=NUM_PARSERS, page_queue_size=PAGE_QUEUE_SIZE,
+                 cache=None):
+        self.parse = parse
+        self.num_fetchers = num_fetchers
+        self.num_parsers = num_parsers
+        self.cache = cache
+        # each stage blocks on its own bound, so a slow stage holds back the
+        # one before it
+        self.pages = queue.Queue(page_queue_size)
+        self.parsed = queue.Queue()
+        self.in_flight = threading.BoundedSemaphore(
+            num_parsers * PARSED_PER_PARSER)
+        self.stopped = threading.Event()
+
+    def fetch(self, n, url):
+        if self.stopped.is_set():
+            return
+        try:
+            page = fetch_page(url, cache=self.cache)
+        except Exception as e:
+            page = e
+        put(self.pages, (n, page), self.stopped)
+
+    def dispatch(self, parsers, num_pages):
+        '''Hands the pages to the parsers, stopping the writer if it fails'''
+        try:
+            self.dispatch_pages(parsers, num_pages)
+        except Exception as e:
+            # a broken pool fails every later submit, so the writer gives up
+            # instead of waiting
+            LOGGER.exception('the dispatcher failed')
+            self.parsed.put((None, e))
+
+    def dispatch_pages(self, parsers, num_pages):
+        '''Hands the downloaded pages to the parsers as slots free up'''
+        for _ in range(num_pages):
+            item = None
+            while item is None and not self.stopped.is_set():
+                try:
+                    item = self.pages.get(timeout=POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+            if item is None:
+                return
+
+            n, page = item
+            # failed downloads go straight to the writer
+            if isinstance(page, Exception):
+                self.parsed.put((n, page))
+                continue
+
+            while not self.in_flight.acquire(timeout=POLL_INTERVAL):
+                if self.stopped.is_set():
+                    return
+            future = parsers.submit(run_parser, self.parse, page)
+            future.add_done_callback(
+                lambda future, n=n: self.parsed.put((n, future)))
+
+    def run(self, urls, handle):
+        '''
+        Downloads, parses and hands every page to handle(n, records) in the
+        order they are parsed; records is the exception of a failed page.
+        '''
+        LOGGER.info('streaming %d pages (fetchers: %d, parsers: %d)...'
+                    % (len(urls), self.num_fetchers, self.num_parsers))
+        parsers = ProcessPoolExecutor(self.num_parsers)
+        # the pool forks its workers on the first submit, which has to happen
+        # before the fetcher and dispatcher threads are started
+        parsers.submit(os.getpid).result()
+        fetchers = ThreadPoolExecutor(self.num_fetchers)
+        dispatcher = threading.Thread(target=self.dispatch,
+                                      args=(parsers, len(urls)), daemon=True)
+
+        try:
+            dispatcher.start()
+            for n, url in enumerate(urls):
+                fetchers.submit(self.fetch, n, url)
+
+            # the writer stage runs on the calling thread
+            for _ in range(len(urls)):
+                n, result = self.parsed.get()
+                if n is None:
+                    raise result
+                if isinstance(result, Future):
+                    self.in_flight.release()
+                    try:
+                        records, seconds = result.result()
+                        METRICS.observe('parse_page', seconds, len(records))
+                        result = records
+                    except Exception as e:
+                        result = e
+                handle(n, result)
+        finally:
+            self.stopped.set()
+            dispatcher.join()
+            fetchers.shutdown(cancel_futures=True)
+            parsers.shutdown(cancel_futures=True)
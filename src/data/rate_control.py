@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+import logging
+import threading
+import requests
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+from src.data.metrics import METRICS
+
+'''Statuses worth asking again for, the others are final'''
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+'''Statuses telling that the server is overloaded and the crawl must slow'''
+THROTTLE_STATUS = {429, 503}
+
+'''Maximum number of times a request is retried'''
+MAX_RETRIES = 5
+
+'''Seconds of the first backoff, doubled on every retry'''
+BACKOFF_BASE = 0.5
+
+'''Maximum seconds of a single backoff'''
+BACKOFF_MAX = 60.0
+
+'''Seconds before a request is given up'''
+REQUEST_TIMEOUT = 30
+
+'''Requests per second and concurrent requests the governor starts with'''
+INITIAL_RATE = 4.0
+INITIAL_CONCURRENCY = 2.0
+
+'''Bounds of the governor'''
+MIN_RATE = 0.2
+MAX_RATE = 100.0
+MAX_CONCURRENCY = 8
+
+'''Requests per second added every second without throttling'''
+RATE_INCREASE = 1.0
+
+'''Factor applied to the rate and concurrency on throttling'''
+RATE_DECREASE = 0.5
+
+'''Seconds during which further throttled responses do not cut the rate'''
+DECREASE_COOLDOWN = 1.0
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to get the seconds asked by a Retry-After header, either seconds or
+a date
+'''
+def get_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+'''Function to get the full jitter exponential backoff of a retry'''
+def get_backoff(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX, rng=random):
+    return rng.uniform(0, min(cap, base * 2 ** attempt))
+
+'''
+Class to pace the requests to a host, growing additively and cutting
+multiplicatively (AIMD)
+'''
+class RateGovernor:
+
+    def __init__(self, rate=INITIAL_RATE, concurrency=INITIAL_CONCURRENCY,
+                 min_rate=MIN_RATE, max_rate=MAX_RATE,
+                 max_concurrency=MAX_CONCURRENCY):
+        self.rate = rate
+        self.concurrency = concurrency
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        # earliest time of the next request
+        self.next_time = time.monotonic()
+        self.last_decrease = 0.0
+        self.num_decreases = 0
+        # below the threshold the rate doubles every second (slow start)
+        self.threshold = max_rate
+
+    def acquire(self):
+        '''
+        Blocks until a request may be sent without exceeding the rate nor the
+        concurrency
+        '''
+        with self.condition:
+            while self.in_flight >= int(self.concurrency):
+                self.condition.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            wait = self.next_time - now
+            self.next_time = max(now, self.next_time) + 1.0 / self.rate
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def release(self, throttled=False):
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                # a burst of throttled responses is a single congestion event
+                if now - self.last_decrease > DECREASE_COOLDOWN:
+                    self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+                    self.threshold = self.rate
+                    self.concurrency = max(1.0,
+                                           self.concurrency * RATE_DECREASE)
+                    self.last_decrease = now
+                    self.num_decreases += 1
+            else:
+                # every success adds a share so the rate grows RATE_INCREASE
+                # per second
+                if self.rate < self.threshold:
+                    increase = 1.0
+                else:
+                    increase = RATE_INCREASE / self.rate
+                self.rate = min(self.max_rate, self.rate + increase)
+                self.concurrency = min(self.max_concurrency,
+                                       self.concurrency
+                                       + 1.0 / self.concurrency)
+            self.condition.notify_all()
+
+    def hold(self, seconds):
+        '''Keeps every request to the host back for the given seconds'''
+        with self.condition:
+            self.next_time = max(self.next_time, time.monotonic() + seconds)
+
+    def get_stats(self):
+        return {
+            'rate': self.rate,
+            'concurrency': int(self.concurrency),
+            'decreases': self.num_decreases,
+        }
+
+'''
+Class to send requests through the governor of their host, retrying the
+transient failures
+'''
+class RateController:
+
+    def __init__(self, session, max_retries=MAX_RETRIES,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 timeout=REQUEST_TIMEOUT, **governor_options):
+        self.session = session
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.governor_options = governor_options
+        self.governors = {}
+        self.lock = threading.Lock()
+
+    def get_governor(self, url):
+        host = urlsplit(url).netloc
+        with self.lock:
+            governor = self.governors.get(host)
+            if governor is None:
+                governor = RateGovernor(**self.governor_options)
+                self.governors[host] = governor
+        return governor
+
+    def get(self, url, headers=None):
+        '''Returns the response of the url, the last one if all retries fail'''
+        governor = self.get_governor(url)
+
+        for attempt in range(self.max_retries + 1):
+            governor.acquire()
+            response = None
+            try:
+                response = self.session.get(url, headers=headers,
+                                            timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                # a connection that failed or timed out is taken as overload as
+                # well
+                governor.release(
+                    throttled=(response is None
+                               or response.status_code in THROTTLE_STATUS))
+
+            if response is not None:
+                METRICS.record_response(response)
+                if (response.status_code not in RETRYABLE_STATUS
+                        or attempt == self.max_retries):
+                    return response
+                status = str(response.status_code)
+                wait = get_retry_after(response.headers.get('Retry-After'))
+            else:
+                if attempt == self.max_retries:
+                    raise error
+                status = type(error).__name__
+                wait = None
+
+            if wait is None:
+                wait = get_backoff(attempt, self.backoff_base,
+                                   self.backoff_max)
+            else:
+                # the whole host waits, not only this request
+                governor.hold(wait)
+            METRICS.increment('retries', stage='backoff', status=status)
+            LOGGER.debug('retrying %s in %.2fs (%s, attempt %d)'
+                         % (url, wait, status, attempt + 1))
+            time.sleep(wait)
+
+    def get_stats(self):
+        with self.lock:
+            return {host: governor.get_stats()
+                    for host, governor in self.governors.items()}
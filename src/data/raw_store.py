@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import logging
+import uuid
+import datetime
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from pathlib import Path
+
+'''Directory of the raw movies dataset'''
+RAW_STORE_DIR = './data/raw/movies'
+
+'''Schema of the movies in the raw dataset'''
+MOVIES_SCHEMA = pa.schema([
+    ('uid', pa.string()),
+    ('rank', pa.int32()),
+    ('name', pa.string()),
+    ('year', pa.int16()),
+    ('certificate', pa.dictionary(pa.int8(), pa.string())),
+    ('runtime', pa.int16()),
+    ('genre', pa.list_(pa.string())),
+    ('rating', pa.float32()),
+    ('director', pa.string()),
+    ('stars', pa.list_(pa.string())),
+    ('num_votes', pa.int64()),
+])
+
+'''Schema of the partition columns (the crawled genre and the scrape date)'''
+PARTITION_SCHEMA = pa.schema([
+    ('search_genre', pa.string()),
+    ('scrape_date', pa.string()),
+])
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to convert a movies data-frame into a typed arrow table'''
+def get_movies_table(df):
+    table = pa.Table.from_pandas(df[MOVIES_SCHEMA.names], preserve_index=False)
+    return table.cast(MOVIES_SCHEMA)
+
+'''Function to append the movies of a genre to the raw dataset'''
+def write_movies(df, search_genre, directory=RAW_STORE_DIR, scrape_date=None):
+    scrape_date = scrape_date or datetime.date.today().isoformat()
+    LOGGER.info('appending %d movies to %s (genre: \'%s\', date: %s)...'
+                % (len(df), directory, search_genre, scrape_date))
+
+    # partitions are directories, so a file goes straight into its own
+    path = (Path(directory) / ('search_genre=%s' % search_genre)
+            / ('scrape_date=%s' % scrape_date))
+    path.mkdir(parents=True, exist_ok=True)
+
+    # every write gets a new file, nothing already stored is overwritten
+    file_path = path / ('part-%s.parquet' % uuid.uuid4().hex)
+    pq.write_table(get_movies_table(df), file_path, compression='zstd')
+
+    return file_path
+
+'''Function to read the raw dataset, only the columns and partitions needed'''
+def read_movies(directory=RAW_STORE_DIR, columns=None, filters=None):
+    '''
+    filters follow the pyarrow DNF form, e.g.
+    [('search_genre', '=', 'mystery'), ('year', '>=', 2000)]; partition
+    filters skip whole directories and the others are pushed down to the
+    parquet row groups.
+    '''
+    partitioning = ds.partitioning(PARTITION_SCHEMA, flavor='hive')
+    table = pq.read_table(directory, columns=columns, filters=filters,
+                          partitioning=partitioning)
+
+    return table.to_pandas()
+
+'''Function to list the partitions already in the raw dataset'''
+def list_partitions(directory=RAW_STORE_DIR):
+    return sorted(
+        (path.parent.name.split('=', 1)[1], path.name.split('=', 1)[1])
+        for path in Path(directory).glob('search_genre=*/scrape_date=*')
+    )
@@ -3,15 +3,22 @@
 import os
 import logging
 import re
-import json
 import string
-import requests
 import pandas as pd
 
 from bs4 import BeautifulSoup
-from pymongo import MongoClient, errors, ASCENDING
+from lxml import etree, html
 from dotenv import find_dotenv, load_dotenv
 
+from src.data.crawler import fetch_page, fetch_pages, MAX_CONNECTIONS_PER_HOST
+from src.data.page_cache import PageCache
+from src.data.crawl_journal import CrawlJournal, FAILED
+from src.data.mongo_writer import MongoWriter
+from src.data.raw_store import write_movies, RAW_STORE_DIR
+from src.data.uid_index import UidIndex
+from src.data.metrics import METRICS, export_metrics, profile
+from src.data.pipeline import Pipeline, NUM_PARSERS
+
 '''List of popular genres'''
 # GENRE_LIST = ['action', 'adventure', 'animation', 'biography', 'comedy', 'crime', 'documentary', 'drama', 'family', 'fantasy', 'film-noir', 'history', 'horror', 'music', 'musical', 'mystery', 'romance', 'sci-fi', 'sport', 'superhero', 'thriller', 'war', 'western']
 GENRE_LIST = ['music', 'musical', 'mystery', 'romance', 'sci-fi', 'sport', 'superhero', 'thriller', 'war', 'western']
@@ -25,33 +32,58 @@ MISSING_VALUES = ['not certified', 'pre-production', 'post-production', 'filming
 '''Maximum number of pages per title genre'''
 MAX_PAGES = 199
 
+'''Base url of the IMDB title search'''
+IMDB_SEARCH_URL = 'https://www.imdb.com/search/title/'
+
+'''Maximum number of pages downloaded at once (1 fetches one after another)'''
+MAX_CONNECTIONS = 16
+
+'''Directory where the downloaded search pages are cached'''
+PAGE_CACHE_DIR = './data/raw/pages'
+
+'''File where the crawl frontier is journaled to resume interrupted crawls'''
+CRAWL_JOURNAL_PATH = './data/interim/crawl_journal.sqlite'
+
+'''Columns of the movie data-frame'''
+MOVIE_COLUMNS = ['uid', 'rank', 'name', 'year', 'certificate', 'runtime',
+                 'genre', 'rating', 'director', 'stars', 'num_votes']
+
+'''Table to remove the punctuation from the movie genres'''
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
 '''Logging object to log the messages'''
 LOGGER = logging.getLogger(__name__)
 
-'''Function to get the page content of the topic'''
-def get_topics_page(genre, page_number=None):
-    
-    topic_url = 'https://www.imdb.com/search/title/?genres='+genre+'&start='+str(page_number)+'&explore=title_type,genres&ref_=adv_nxt'
-    
+'''Function to get the url of the topic page'''
+def get_topics_url(genre, page_number=None, base_url=IMDB_SEARCH_URL):
+
+    topic_url = (base_url+'?genres='+genre+'&start='+str(page_number)
+                 +'&explore=title_type,genres&ref_=adv_nxt')
+
     if page_number == None:
-        topic_url = 'https://www.imdb.com/search/title/?genres='+genre+'&explore=title_type,genres&ref_=adv_prv'
+        topic_url = (base_url+'?genres='+genre
+                     +'&explore=title_type,genres&ref_=adv_prv')
 
     elif page_number == 1:
-        topic_url = 'https://www.imdb.com/search/title/?genres='+genre+'&start=51&explore=title_type,genres&ref_=adv_nxt'
-    
-    headers = {'Accept-Language': 'en-US'}
-    response=requests.get(topic_url, headers=headers)
+        topic_url = (base_url+'?genres='+genre
+                     +'&start=51&explore=title_type,genres&ref_=adv_nxt')
+
+    return topic_url
+
+'''Function to get the page content of the topic'''
+@METRICS.instrument('get_topics_page')
+def get_topics_page(genre, page_number=None, base_url=IMDB_SEARCH_URL,
+                    cache=None):
+
+    topic_url = get_topics_url(genre, page_number, base_url)
 
-    # to check whether the response is successful or not
-    if response.status_code != 200:                    
-        raise Exception(f'Failed to load page {topic_url}')
-    
     # Parse using BeautifulSoup
-    doc = BeautifulSoup(response.text, 'html.parser')
-    
+    doc = BeautifulSoup(fetch_page(topic_url, cache=cache), 'html.parser')
+
     return doc
 
 '''Function to get the movie uid from the page content'''
+@METRICS.instrument('get_movie_uid', rows=len)
 def get_movie_uid(doc):
     uid_selector = "loadlate"            
     movie_uid_tags = doc.find_all('img',{'class':uid_selector})
@@ -64,6 +96,7 @@ def get_movie_uid(doc):
     return movie_uid
 
 '''Function to get the movie rank from the page content'''
+@METRICS.instrument('get_movie_rank', rows=len)
 def get_movie_rank(doc):
     rank_selector = "lister-item-index unbold text-primary"            
     movie_rank_tags = doc.find_all('span',{'class':rank_selector})
@@ -77,6 +110,7 @@ def get_movie_rank(doc):
     return movie_rank
 
 '''Function to get the movie name from the page content'''
+@METRICS.instrument('get_movie_name', rows=len)
 def get_movie_name(doc):
     selection_class = "lister-item-header"
     movie_name_tags = doc.find_all('h3',{'class':selection_class})
@@ -89,6 +123,7 @@ def get_movie_name(doc):
     return movie_name
 
 '''Function to get the movie year from the page content'''
+@METRICS.instrument('get_movie_year', rows=len)
 def get_movie_year(doc):
     year_selector = "lister-item-year text-muted unbold"           
     movie_year_tags = doc.find_all('span',{'class':year_selector})
@@ -109,6 +144,7 @@ def get_movie_year(doc):
     return movie_year
 
 '''Function to get the movie certificate from the page content'''
+@METRICS.instrument('get_movie_certificate', rows=len)
 def get_movie_certificate(doc):
     # get the first sibling p.text-muted of the h3.lister-item-header 
     movie_feature_tags = doc.select('h3.lister-item-header + p.text-muted')
@@ -133,6 +169,7 @@ def get_movie_certificate(doc):
 
 
 '''Function to get the movie runtime from the page content'''
+@METRICS.instrument('get_movie_runtime', rows=len)
 def get_movie_runtime(doc):
     # get the first sibling p.text-muted of the h3.lister-item-header 
     movie_feature_tags = doc.select('h3.lister-item-header + p.text-muted')
@@ -152,6 +189,7 @@ def get_movie_runtime(doc):
     return movie_runtime
 
 '''Function to get the movie genre from the page content'''
+@METRICS.instrument('get_movie_genre', rows=len)
 def get_movie_genre(doc):
     selection_class = "genre"
     movie_genre_tags = doc.find_all('span',{'class':selection_class})
@@ -164,6 +202,7 @@ def get_movie_genre(doc):
     return movie_genre
 
 '''Function to get the movie rating from the page content'''
+@METRICS.instrument('get_movie_rating', rows=len)
 def get_movie_rating(doc):
     movie_feature_tags = doc.select('div.lister-item-content')
     movie_rating = []
@@ -188,6 +227,7 @@ def get_movie_rating(doc):
     return movie_rating
 
 '''Function to get the movie director from the page content'''
+@METRICS.instrument('get_movie_director', rows=len)
 def get_movie_director(doc):
     selection_class = ""
     movie_director_tags = doc.find_all('p',{'class':selection_class})
@@ -203,6 +243,7 @@ def get_movie_director(doc):
     return movie_director
 
 '''Function to get the movie stars from the page content'''
+@METRICS.instrument('get_movie_stars', rows=len)
 def get_movie_stars(doc):
     selection_class = ""
     movie_stars_tags = doc.find_all('p',{'class':selection_class})
@@ -223,6 +264,7 @@ def get_movie_stars(doc):
     return movie_stars
 
 '''Function to get the movie number of votes from the page content'''
+@METRICS.instrument('get_movie_num_votes', rows=len)
 def get_movie_num_votes(doc):
     movie_feature_tags = doc.select('div.lister-item-content')
     movie_votes = []
@@ -239,64 +281,313 @@ def get_movie_num_votes(doc):
     
     return movie_votes
 
-'''Function to get the movie data from the page content'''
-def imdb_dict(genre_search, num_pages=1):
-    LOGGER.info('scraping IMDB movies for \'%s\'...' % genre_search)
-
-    # Let's we create a dictionary to store data of all movies
-    movies_dictionary={
-        'uid':[],
-        'rank':[],
-        'name':[],
-        'year':[],
-        'certificate':[],
-        'runtime':[],
+'''Function to build an XPath selecting the elements of a tag and class'''
+def class_xpath(path, tag, selection_class):
+    return etree.XPath(
+        '%s%s[contains(concat(" ", normalize-space(@class), " "), " %s ")]'
+        % (path, tag, selection_class))
+
+'''Compiled XPaths used by the single pass movie extractor'''
+MOVIE_ITEM_XPATH = class_xpath('//', 'div', 'lister-item')
+MOVIE_UID_XPATH = class_xpath('.//', 'img', 'loadlate')
+MOVIE_HEADER_XPATH = class_xpath('.//', 'h3', 'lister-item-header')
+MOVIE_RANK_XPATH = class_xpath('./', 'span', 'lister-item-index')
+MOVIE_YEAR_XPATH = class_xpath('./', 'span', 'lister-item-year')
+MOVIE_CERTIFICATE_XPATH = class_xpath('./', 'span', 'certificate')
+MOVIE_PRODUCTION_XPATH = etree.XPath(
+    './span[contains(concat(" ", normalize-space(@class), " "), " ghost ")]'
+    '/following-sibling::*[1][self::b]')
+MOVIE_RUNTIME_XPATH = class_xpath('./', 'span', 'runtime')
+MOVIE_GENRE_XPATH = class_xpath('.//', 'span', 'genre')
+MOVIE_RATINGS_BAR_XPATH = etree.XPath(
+    './/div[contains(concat(" ", normalize-space(@class), " "),'
+    ' " ratings-bar ")]'
+    '[preceding-sibling::*[1][self::p]'
+    '[contains(concat(" ", normalize-space(@class), " "), " text-muted ")]]')
+MOVIE_PEOPLE_XPATH = etree.XPath('.//p[@class=""]')
+MOVIE_GHOST_XPATH = class_xpath('.//', 'span', 'ghost')
+MOVIE_VOTES_XPATH = etree.XPath(
+    './/p[contains(concat(" ", normalize-space(@class), " "),'
+    ' " sort-num_votes-visible ")]'
+    '/span[@name="nv"]/@data-value')
+
+'''Function to get the next sibling element skipping comments'''
+def next_element(tag):
+    for sibling in tag.itersiblings():
+        if isinstance(sibling.tag, str):
+            return sibling
+    return None
+
+'''Function to check whether an element has the given class'''
+def has_class(tag, selection_class):
+    return selection_class in (tag.get('class') or '').split()
+
+'''Function to get a complete movie record from a single lister-item'''
+def get_movie_record(item):
+    record = {
+        'uid':'',
+        'rank':'',
+        'name':'',
+        'year':'0',
+        'certificate':'not certified',
+        'runtime':'0',
         'genre':[],
-        'rating':[],
-        'director':[],
+        'rating':'0.0',
+        'director':'',
         'stars':[],
-        'num_votes':[],
+        'num_votes':'0',
     }
 
-    # We have to scrap more than one page so we want urls of all pages with the help of loop we can get all urls
+    uid = MOVIE_UID_XPATH(item)
+    if uid:
+        record['uid'] = uid[0].get('data-tconst')
+
+    header = MOVIE_HEADER_XPATH(item)
+    if header:
+        header = header[0]
+
+        rank = MOVIE_RANK_XPATH(header)
+        if rank:
+            record['rank'] = rank[0].text_content().strip('.').replace(',', '')
+
+        name = header.find('a')
+        if name is not None:
+            record['name'] = name.text_content()
+
+        year = MOVIE_YEAR_XPATH(header)
+        if year:
+            # get only the year from the text
+            year = re.search(r'\d+', year[0].text_content())
+            if year is not None:
+                record['year'] = year.group().replace(',', '')
+
+        # the first sibling p.text-muted of the h3.lister-item-header
+        features = next_element(header)
+        if (features is not None and features.tag == 'p'
+                and has_class(features, 'text-muted')):
+            # check if it is in post-production
+            production = MOVIE_PRODUCTION_XPATH(features)
+            if production:
+                record['certificate'] = production[0].text_content().lower()
+            # save the certificate if it is not missing
+            certificate = MOVIE_CERTIFICATE_XPATH(features)
+            if certificate:
+                record['certificate'] = certificate[0].text_content()[:10]
+
+            runtime = MOVIE_RUNTIME_XPATH(features)
+            if runtime:
+                runtime = runtime[0].text_content()[:10].replace(' min','')
+                record['runtime'] = runtime.replace(',', '')
+
+    genre = MOVIE_GENRE_XPATH(item)
+    if genre:
+        genre = genre[0].text_content().lower()
+        record['genre'] = genre.translate(PUNCTUATION_TABLE).split()
+
+    # get the div.ratings-bar right after the p.text-muted
+    ratings_bar = MOVIE_RATINGS_BAR_XPATH(item)
+    if ratings_bar:
+        rating = ratings_bar[0].text_content().strip().split('\n')[0]
+        rating = re.search(r'\d+\.\d+', rating)
+        if rating is not None:
+            record['rating'] = rating.group().replace(',', '')
+
+    people = MOVIE_PEOPLE_XPATH(item)
+    if people:
+        people = people[0]
+        # get all links limited to top 5
+        links = people.findall('.//a')[:5]
+
+        if '|' in people.text_content() and links:
+            record['director'] = links[0].text_content()
+
+        if MOVIE_GHOST_XPATH(people) and links:
+            links.pop(0)
+        record['stars'] = [link.text_content() for link in links]
+
+    num_votes = MOVIE_VOTES_XPATH(item)
+    if num_votes:
+        record['num_votes'] = num_votes[0].replace(',', '')
+
+    return record
+
+'''Function to get the movie records of the page visiting every movie once'''
+@METRICS.instrument('get_movie_records', rows=len)
+def get_movie_records(page):
+    doc = html.fromstring(page) if isinstance(page, (str, bytes)) else page
+
+    return [get_movie_record(item) for item in MOVIE_ITEM_XPATH(doc)]
+
+'''
+Function to get the movie records of the uids not in the index, parsing the
+others only up to their rank
+'''
+@METRICS.instrument('get_new_movie_records',
+                    rows=lambda result: len(result[0]) + len(result[1]))
+def get_new_movie_records(page, genre_search, uid_index):
+    doc = html.fromstring(page) if isinstance(page, (str, bytes)) else page
+    records = []
+    duplicates = []
+
+    for item in MOVIE_ITEM_XPATH(doc):
+        uid = MOVIE_UID_XPATH(item)
+        uid = uid[0].get('data-tconst') if uid else ''
+        header = MOVIE_HEADER_XPATH(item)
+        rank = MOVIE_RANK_XPATH(header[0]) if header else []
+        rank = (int(rank[0].text_content().strip('.').replace(',', '') or 0)
+                if rank else 0)
+
+        # titles seen under another genre only get their rank in this one
+        if uid_index.add(uid, genre_search, rank):
+            records.append(get_movie_record(item))
+        else:
+            duplicates.append((uid, rank))
+
+    return records, duplicates
+
+'''Function to get the start of every page of a genre'''
+def get_page_numbers(num_pages=1):
     # each page has 50 movies so we have to get 50 movies from each page (1~51)
     num_titles = (num_pages * 50) + 2
-    for i in range(51, num_titles, 50):
-        LOGGER.info('[genre: \'%s\', page: %d/%d]' % (genre_search, i/50, num_titles/50))
-        # Parse using BeautifulSoup
-        try:
-            doc = get_topics_page(genre_search, i)
-        except Exception as e:
-            LOGGER.error(e)
-            break
-
-        uid = get_movie_uid(doc)
-        rank = get_movie_rank(doc)
-        name = get_movie_name(doc)
-        year = get_movie_year(doc)
-        certificate = get_movie_certificate(doc)
-        runtime = get_movie_runtime(doc)
-        genre = get_movie_genre(doc)
-        rating = get_movie_rating(doc)
-        director = get_movie_director(doc)
-        stars = get_movie_stars(doc)
-        num_votes = get_movie_num_votes(doc)
-
-        # We are adding every movie data to dictionary
-        for i in range(len(name)):
-            movies_dictionary['uid'].append(uid[i])
-            movies_dictionary['rank'].append(rank[i])
-            movies_dictionary['name'].append(name[i])
-            movies_dictionary['year'].append(year[i])
-            movies_dictionary['certificate'].append(certificate[i])
-            movies_dictionary['runtime'].append(runtime[i])
-            movies_dictionary['genre'].append(genre[i])
-            movies_dictionary['rating'].append(rating[i])
-            movies_dictionary['director'].append(director[i])
-            movies_dictionary['stars'].append(stars[i])
-            movies_dictionary['num_votes'].append(num_votes[i])
-        
-    return pd.DataFrame(movies_dictionary)
+    return list(range(51, num_titles, 50))
+
+'''
+Function to keep the parsed records of the uids not in the index, the others
+only get their rank
+'''
+def get_new_records(records, genre_search, uid_index):
+    new_records = []
+    duplicates = []
+
+    for record in records:
+        rank = int(record['rank'] or 0)
+        if uid_index.add(record['uid'], genre_search, rank):
+            new_records.append(record)
+        else:
+            duplicates.append((record['uid'], rank))
+
+    return new_records, duplicates
+
+'''Function to get the movie data from the page content'''
+def imdb_dict(genre_search, num_pages=1, max_connections=1,
+              base_url=IMDB_SEARCH_URL, cache=None, journal=None, writer=None,
+              uid_index=None, num_parsers=0):
+    LOGGER.info('scraping IMDB movies for \'%s\'...' % genre_search)
+
+    # Let's we create a list to store the records of all movies
+    movies_records = []
+
+    # We have to scrap more than one page so we want urls of all pages with the help of loop we can get all urls
+    page_numbers = get_page_numbers(num_pages)
+
+    # with a journal only the pages not fetched by a previous run are left
+    if journal is not None:
+        journal.add_pages(genre_search, page_numbers)
+        page_numbers = journal.get_pending_pages(genre_search)
+        # pages that failed on a previous run are fetched again
+        num_retried = (journal.get_counts(genre_search).get(FAILED, 0)
+                       - len(journal.get_abandoned_pages(genre_search)))
+        METRICS.increment('retries', num_retried, stage='journal')
+
+    urls = [get_topics_url(genre_search, i, base_url) for i in page_numbers]
+
+    def add_records(n, records, duplicates):
+        # the writer gets the movies of every page while the crawl goes on
+        if writer is not None:
+            df = pd.DataFrame(records, columns=MOVIE_COLUMNS)
+            writer.write_df(clean_data(save_only_movies(df)), genre_search)
+            writer.write_ranks(genre_search, duplicates)
+            # a page is only journaled once its movies are in the database,
+            # a crash can not leave buffered writes behind a page marked done
+            writer.flush()
+        if uid_index is not None:
+            uid_index.commit()
+
+        METRICS.increment('pages', genre=genre_search)
+        if journal is not None:
+            journal.mark_done(genre_search, page_numbers[n], records)
+
+    def add_failure(n, e):
+        LOGGER.error(e)
+        METRICS.increment('failed_pages', genre=genre_search)
+        # the journal keeps the failed page to be retried on the next run
+        if journal is not None:
+            journal.mark_failed(genre_search, page_numbers[n], e)
+
+    # with parser processes the pages are fetched, parsed and written by
+    # separate stages
+    if num_parsers > 0 and urls:
+        pages_records = {}
+
+        def handle(n, records):
+            LOGGER.info('[genre: \'%s\', page: %d/%d]'
+                        % (genre_search, len(pages_records) + 1, len(urls)))
+            if isinstance(records, Exception):
+                add_failure(n, records)
+                pages_records[n] = None
+                return
+
+            duplicates = []
+            if uid_index is not None:
+                records, duplicates = get_new_records(records, genre_search,
+                                                      uid_index)
+            add_records(n, records, duplicates)
+            pages_records[n] = records
+
+        num_fetchers = min(max(max_connections, 1), MAX_CONNECTIONS_PER_HOST)
+        pipeline = Pipeline(get_movie_records, num_fetchers, num_parsers,
+                            cache=cache)
+        pipeline.run(urls, handle)
+
+        # pages finish out of order, so without a journal the pages after a
+        # failure are dropped
+        for n in range(len(urls)):
+            if pages_records[n] is None:
+                break
+            movies_records.extend(pages_records[n])
+    else:
+        # with more than one connection every page is downloaded up front
+        pages = None
+        if max_connections > 1 and urls:
+            pages = fetch_pages(urls, max_connections,
+                                min(max_connections, MAX_CONNECTIONS_PER_HOST),
+                                cache=cache)
+
+        for n, url in enumerate(urls):
+            LOGGER.info('[genre: \'%s\', page: %d/%d]'
+                        % (genre_search, n + 1, len(urls)))
+            try:
+                if pages is None:
+                    page = fetch_page(url, cache=cache)
+                else:
+                    page = pages[n]
+                if isinstance(page, Exception):
+                    raise page
+            except Exception as e:
+                add_failure(n, e)
+                if journal is None:
+                    break
+                continue
+
+            # We are adding every movie record of the page in a single pass
+            duplicates = []
+            if uid_index is None:
+                records = get_movie_records(page)
+            else:
+                records, duplicates = get_new_movie_records(
+                    page, genre_search, uid_index)
+
+            add_records(n, records, duplicates)
+            if journal is None:
+                movies_records.extend(records)
+
+    if journal is not None:
+        LOGGER.info('[genre: \'%s\', pages: %s]'
+                    % (genre_search, journal.get_counts(genre_search)))
+        # the pages appended to the raw store by a previous run are left out
+        movies_records = journal.get_records(genre_search, stored=False)
+
+    return pd.DataFrame(movies_records, columns=MOVIE_COLUMNS)
 
 '''Function to remove duplicate movies from the data-frame'''
 def remove_duplicates(df):
@@ -308,6 +599,7 @@ def remove_duplicates(df):
     return df
 
 '''Function to clean the data'''
+@METRICS.instrument('clean_data', rows=len)
 def clean_data(df):
     LOGGER.info('cleaning data...')
 
@@ -338,65 +630,102 @@ def save_to_json(df):
     # We are saving data to json file
     df.to_json('./data/raw/movies.json', orient='records', lines=True)
 
+'''Function to append data to the partitioned raw dataset'''
+def save_to_parquet(df, genre_search):
+    LOGGER.info('saving data to parquet dataset...')
+
+    # We are appending the genre to its own partition instead of overwriting
+    write_movies(df, genre_search, os.getenv('IMDB_RAW_STORE', RAW_STORE_DIR))
+
 '''Function to save data to database'''
-def save_to_db(df):
+def save_to_db(df, collection=None):
     LOGGER.info('saving data to database...')
 
-    # We are saving data to database
-    json_obj = json.loads(df.to_json(orient='records'))
-    # Making a Connection with MongoClient
-    client = MongoClient(os.getenv('MONGODB_URI'))
-    # database
-    db = client["imdb"]
-    # collection
-    movies = db["movies"]
-    # creating index
-    movies.create_index([('uid', ASCENDING)], unique=True)
-    
-    if json_obj == []:
+    if df.empty:
         LOGGER.info('no movies to insert')
         return
-    
-    num_insertions = 0
-    try:
-        result = movies.insert_many(json_obj, ordered=False).inserted_ids
-        num_insertions = len(result)
-    except errors.BulkWriteError as bwe:
-        write_errors = bwe.details['writeErrors']
-        for we in write_errors:
-            LOGGER.error(we['errmsg'])
-        num_insertions = bwe.details['nInserted']
-    finally:
-        client.close()
-        LOGGER.info('%d movies inserted' % num_insertions)
+
+    # We are saving data to database as upserts keyed on uid
+    with METRICS.timer('save_to_db') as stats:
+        with MongoWriter(collection) as writer:
+            writer.write_df(df)
+        stats['rows'] = len(df)
+
+'''Function to get the page cache, replayed offline when IMDB_OFFLINE is set'''
+def get_page_cache():
+    offline = os.getenv('IMDB_OFFLINE', '').lower() in ('1', 'true', 'yes')
+    if offline:
+        LOGGER.info('replaying cached pages offline.')
+
+    return PageCache(os.getenv('IMDB_PAGE_CACHE', PAGE_CACHE_DIR),
+                     offline=offline)
 
 '''Function to carry out a single page test'''
 def single_page_test():
     LOGGER.info('starting single test page.')
+    cache = get_page_cache()
 
     for genre in ['crime']:
-        df = imdb_dict(genre)
+        df = imdb_dict(genre, cache=cache)
 
         df = save_only_movies(df)
         df = clean_data(df)
 
-        save_to_json(df)
+        save_to_parquet(df, genre)
         save_to_db(df)
 
+    cache.close()
+
 '''Function to carry out the main program'''
 def main():
     """ Runs data processing scripts to turn raw data from (../raw) into
         cleaned data ready to be analyzed (saved in ../processed).
     """
     LOGGER.info('getting data from IMDB website.')
-    
+    cache = get_page_cache()
+    journal = CrawlJournal(os.getenv('IMDB_CRAWL_JOURNAL', CRAWL_JOURNAL_PATH))
+    writer = MongoWriter()
+    # titles crawled under a previous genre are not parsed nor saved again
+    uid_index = UidIndex(os.getenv('IMDB_UID_INDEX'))
+
     for genre in GENRE_LIST:
-        df = imdb_dict(genre, MAX_PAGES)
+        # genres saved by a previous run are not crawled again
+        if journal.is_saved(genre):
+            LOGGER.info('skipping \'%s\', already saved.' % genre)
+            continue
+
+        df = imdb_dict(genre, MAX_PAGES, MAX_CONNECTIONS, cache=cache,
+                       journal=journal, writer=writer, uid_index=uid_index,
+                       num_parsers=NUM_PARSERS)
         df = save_only_movies(df)
         df = clean_data(df)
 
-        save_to_json(df)
-        save_to_db(df)
+        # the movies were already written to the database page by page
+        save_to_parquet(df, genre)
+        journal.mark_stored(genre)
+        writer.flush()
+
+        # a genre with failed pages is saved again once they are retried
+        if journal.is_complete(genre):
+            journal.mark_saved(genre)
+        else:
+            # pages out of attempts are never fetched again, it stays unsaved
+            for start, error in journal.get_abandoned_pages(genre):
+                LOGGER.error('[genre: \'%s\', page: %d] given up after %d '
+                             'attempts: %s'
+                             % (genre, start, journal.max_attempts, error))
+
+        # the snapshot is refreshed after every genre so a long crawl can be
+        # watched
+        export_metrics()
+
+    writer.close()
+    uid_index.close()
+    journal.close()
+    cache.close()
+
+    METRICS.log_summary()
+    export_metrics()
 
 if __name__ == "__main__":
     log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -406,5 +735,7 @@ if __name__ == "__main__":
     # load up the .env entries as environment variables
     load_dotenv(find_dotenv())
 
-    main()
+    # IMDB_PROFILE names the file of the cProfile stats of the whole crawl
+    with profile(os.getenv('IMDB_PROFILE')):
+        main()
     # single_page_test()
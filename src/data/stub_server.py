@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import time
+import random
+import hashlib
+import logging
+import threading
+
+from pathlib import Path
+from email.utils import formatdate
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to get the path of a saved search page in the corpus directory'''
+def get_page_path(directory, genre, start):
+    return Path(directory) / genre / ('%d.html' % start)
+
+'''Function to save a search page into the corpus directory'''
+def save_page(directory, genre, start, text):
+    path = get_page_path(directory, genre, start)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding='utf-8')
+
+    return path
+
+'''
+Class to make the stub server slow, flaky and rate limited like the real
+site
+'''
+class FaultInjector:
+
+    def __init__(self, latency=0.0, error_rate=0.0, max_rate=None,
+                 retry_after=1, seed=0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.max_rate = max_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # arrival times of the requests served within the last second
+        self.arrivals = deque()
+        self.served = 0
+        self.throttled = 0
+        self.failed = 0
+
+    def get_fault(self):
+        '''Returns the status of the injected failure, None serves the page'''
+        now = time.monotonic()
+        with self.lock:
+            while self.arrivals and now - self.arrivals[0] > 1.0:
+                self.arrivals.popleft()
+            if (self.max_rate is not None
+                    and len(self.arrivals) >= self.max_rate):
+                self.throttled += 1
+                return 429
+            self.arrivals.append(now)
+            if self.random.random() < self.error_rate:
+                self.failed += 1
+                return self.random.choice([500, 502, 503])
+            self.served += 1
+        return None
+
+    def get_stats(self):
+        return {'served': self.served, 'throttled': self.throttled,
+                'failed': self.failed}
+
+'''Class to answer IMDB search requests with the saved pages'''
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def send_fault(self, status):
+        self.send_response(status)
+        if status in (429, 503):
+            self.send_header('Retry-After',
+                             str(self.server.faults.retry_after))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        faults = self.server.faults
+        if faults.latency:
+            time.sleep(faults.latency)
+        status = faults.get_fault()
+        if status is not None:
+            self.send_fault(status)
+            return
+
+        query = parse_qs(urlsplit(self.path).query)
+        genre = query.get('genres', [''])[0]
+        # the first page of a genre has no start parameter
+        start = int(query.get('start', ['1'])[0])
+
+        path = get_page_path(self.server.directory, genre, start)
+        if not path.is_file():
+            self.send_error(404)
+            return
+
+        body = path.read_bytes()
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+
+        # answer revalidations of unchanged pages without the body
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         formatdate(path.stat().st_mtime, usegmt=True))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+'''Class to serve a directory of saved search pages on a local port'''
+class StubServer:
+
+    def __init__(self, directory, host='127.0.0.1', port=0, faults=None):
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.directory = directory
+        # without faults every request is served right away
+        self.httpd.faults = faults or FaultInjector()
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://%s:%d/search/title/' % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        LOGGER.info('stub server listening on %s' % self.base_url)
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
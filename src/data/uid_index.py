@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import math
+import sqlite3
+
+from pathlib import Path
+
+'''Number of titles the Bloom filter is sized for'''
+BLOOM_CAPACITY = 1000000
+
+'''False positive rate of the Bloom filter at full capacity'''
+BLOOM_ERROR_RATE = 0.001
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Class to tell whether a uid may have been seen, in a fixed number of bits'''
+class BloomFilter:
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.num_bits = int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(
+            1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def get_positions(self, key):
+        # two independent hashes combined into num_hashes positions
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        for position in self.get_positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self.get_positions(key))
+
+'''Class to keep every uid seen in the crawl and its rank in each genre'''
+class UidIndex:
+
+    def __init__(self, path=None, in_memory=True, capacity=BLOOM_CAPACITY,
+                 error_rate=BLOOM_ERROR_RATE):
+        '''
+        With a path the uids and ranks are persisted in SQLite and reloaded
+        on the next crawl. With in_memory=False only the Bloom filter is kept
+        in memory and the uids it may contain are confirmed on disk.
+        '''
+        if path is None and not in_memory:
+            raise ValueError('an index kept out of memory needs a path')
+
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.ranks = {} if in_memory else None
+        self.num_new = 0
+        self.num_duplicates = 0
+
+        self.db = None
+        if path is not None:
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+            self.db = sqlite3.connect(str(path))
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS ranks (
+                    uid TEXT NOT NULL,
+                    genre TEXT NOT NULL,
+                    rank INTEGER NOT NULL,
+                    PRIMARY KEY (uid, genre)
+                )''')
+            self.db.commit()
+
+            rows = self.db.execute('SELECT uid, genre, rank FROM ranks')
+            for uid, genre, rank in rows:
+                self.bloom.add(uid)
+                if self.ranks is not None:
+                    self.ranks.setdefault(uid, {})[genre] = rank
+
+    def __contains__(self, uid):
+        # most new titles are told apart by the filter alone
+        if uid not in self.bloom:
+            return False
+        if self.ranks is not None:
+            return uid in self.ranks
+
+        row = self.db.execute('SELECT 1 FROM ranks WHERE uid = ? LIMIT 1',
+                              (uid,)).fetchone()
+        return row is not None
+
+    def add(self, uid, genre, rank):
+        '''Records the rank of the uid in the genre, tells whether it is new'''
+        is_new = uid not in self
+
+        if is_new:
+            self.bloom.add(uid)
+            self.num_new += 1
+        else:
+            self.num_duplicates += 1
+
+        if self.ranks is not None:
+            self.ranks.setdefault(uid, {})[genre] = int(rank or 0)
+        if self.db is not None:
+            self.db.execute('INSERT OR REPLACE INTO ranks VALUES (?, ?, ?)',
+                            (uid, genre, int(rank or 0)))
+
+        return is_new
+
+    def get_ranks(self, uid):
+        if self.ranks is not None:
+            return dict(self.ranks.get(uid, {}))
+
+        rows = self.db.execute('SELECT genre, rank FROM ranks WHERE uid = ?',
+                               (uid,))
+        return dict(rows.fetchall())
+
+    def get_stats(self):
+        num_titles = self.num_new + self.num_duplicates
+        return {
+            'titles': num_titles,
+            'new': self.num_new,
+            'duplicates': self.num_duplicates,
+            'saved_ratio': (self.num_duplicates / num_titles
+                            if num_titles else 0.0),
+        }
+
+    def commit(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        stats = self.get_stats()
+        LOGGER.info('uid index: %d titles, %d duplicates not parsed nor '
+                    'written again (%.1f%%)'
+                    % (stats['titles'], stats['duplicates'],
+                       100 * stats['saved_ratio']))
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
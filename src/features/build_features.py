@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import json
+import click
+import logging
+import numpy as np
+import scipy.sparse as sp
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.features.catalog import Catalog, read_movies
+
+'''Maximum number of stars kept as features, the most credited first'''
+MAX_STARS = 20000
+
+'''Weight of every block of features in the similarity between titles'''
+BLOCK_WEIGHTS = {
+    'genre': 1.0,
+    'director': 0.6,
+    'stars': 0.8,
+    'numeric': 0.4,
+}
+
+'''Numeric columns used as features'''
+NUMERIC_COLUMNS = ['year', 'runtime', 'rating', 'log_votes']
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to scale every row of a sparse block to unit length'''
+def normalize_rows(block):
+    norms = np.sqrt(np.asarray(block.multiply(block).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sp.diags(1.0 / norms) @ block
+
+'''
+Function to weight the columns of a binary block by their inverse document
+frequency
+'''
+def tfidf(block):
+    document_frequency = np.bincount(block.indices, minlength=block.shape[1])
+    idf = np.log((1 + block.shape[0]) / (1 + document_frequency)) + 1.0
+    return normalize_rows(block @ sp.diags(idf))
+
+'''Function to build a binary CSR block from the row and column of entries'''
+def get_binary_block(rows, columns, shape):
+    data = np.ones(len(rows), dtype=np.float32)
+    block = sp.csr_matrix((data, (rows, columns)), shape=shape)
+    # repeated entries are summed, keep them binary
+    block.data[:] = 1.0
+    return block
+
+'''Function to get the genre block from the multi-hot genre mask'''
+def get_genre_block(catalog):
+    bits = np.arange(len(catalog.genres), dtype=catalog.genre_mask.dtype)
+    rows, columns = np.nonzero((catalog.genre_mask[:, None] >> bits) & 1)
+    shape = (len(catalog), len(catalog.genres))
+    block = get_binary_block(rows, columns, shape)
+
+    return tfidf(block), ['genre=%s' % genre for genre in catalog.genres]
+
+'''
+Function to get the director block, titles without director have an empty
+row
+'''
+def get_director_block(catalog):
+    codes = catalog.director.cat.codes.to_numpy()
+    directors = np.asarray(catalog.director.cat.categories, dtype=object)
+
+    rows = np.flatnonzero((codes >= 0) & (directors[codes] != ''))
+    block = get_binary_block(rows, codes[rows], (len(catalog), len(directors)))
+
+    return tfidf(block), ['director=%s' % director for director in directors]
+
+'''Function to get the block of the most credited stars'''
+def get_stars_block(catalog, max_stars=MAX_STARS):
+    counts = np.bincount(catalog.star_ids, minlength=len(catalog.stars))
+    # keep the most credited stars, stars credited once never link two titles
+    kept = np.argsort(-counts, kind='stable')[:max_stars]
+    kept = np.sort(kept[counts[kept] > 1])
+
+    columns = np.full(len(catalog.stars), -1, dtype=np.int64)
+    columns[kept] = np.arange(len(kept))
+
+    rows = np.repeat(np.arange(len(catalog)), np.diff(catalog.star_offsets))
+    columns = columns[catalog.star_ids]
+    known = columns >= 0
+    block = get_binary_block(rows[known], columns[known],
+                             (len(catalog), len(kept)))
+
+    return tfidf(block), ['star=%s' % star for star in catalog.stars[kept]]
+
+'''
+Function to get the standardized numeric block, missing values are left at
+the mean
+'''
+def get_numeric_block(catalog):
+    values = np.column_stack([
+        catalog.numeric['year'].astype(np.float64),
+        catalog.numeric['runtime'].astype(np.float64),
+        catalog.numeric['rating'].astype(np.float64),
+        np.log1p(catalog.numeric['num_votes'].astype(np.float64)),
+    ])
+
+    # the scraper writes 0 when a field is missing
+    present = values > 0
+    counts = np.maximum(present.sum(axis=0), 1)
+    mean = np.where(present, values, 0).sum(axis=0) / counts
+    squares = np.where(present, (values - mean) ** 2, 0)
+    std = np.sqrt(squares.sum(axis=0) / counts)
+    std[std == 0] = 1.0
+
+    scaled = np.where(present, (values - mean) / std, 0.0)
+    # the numeric block is scaled down by its number of columns instead of per
+    # row
+    block = sp.csr_matrix(scaled / np.sqrt(values.shape[1]))
+
+    return block, NUMERIC_COLUMNS
+
+'''Function to build the sparse feature matrix of the catalog'''
+def build_features(catalog, max_stars=MAX_STARS, weights=BLOCK_WEIGHTS):
+    LOGGER.info('building features of %d movies...' % len(catalog))
+
+    blocks = {
+        'genre': get_genre_block(catalog),
+        'director': get_director_block(catalog),
+        'stars': get_stars_block(catalog, max_stars),
+        'numeric': get_numeric_block(catalog),
+    }
+
+    matrix = sp.hstack(
+        [weights[name] * block for name, (block, _) in blocks.items()],
+        format='csr', dtype=np.float32)
+    feature_names = [feature for _, names in blocks.values()
+                     for feature in names]
+
+    LOGGER.info('%d features, %d non-zero values'
+                % (matrix.shape[1], matrix.nnz))
+    return matrix, feature_names
+
+'''
+Function to save the feature matrix as plain .npy arrays that can be
+memory-mapped
+'''
+def save_features(directory, matrix, uids, feature_names):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    matrix = matrix.tocsr()
+    np.save(directory / 'data.npy', matrix.data.astype(np.float32))
+    np.save(directory / 'indices.npy', matrix.indices.astype(np.int32))
+    np.save(directory / 'indptr.npy', matrix.indptr.astype(np.int64))
+    np.save(directory / 'uids.npy', np.asarray(uids, dtype='U12'))
+    with open(directory / 'features.json', 'w') as f:
+        json.dump({'shape': list(matrix.shape), 'features': feature_names}, f)
+
+'''Function to load the feature matrix, memory-mapping its arrays'''
+def load_features(directory, mmap=True):
+    directory = Path(directory)
+    mmap_mode = 'r' if mmap else None
+
+    with open(directory / 'features.json') as f:
+        meta = json.load(f)
+
+    matrix = sp.csr_matrix((
+        np.load(directory / 'data.npy', mmap_mode=mmap_mode),
+        np.load(directory / 'indices.npy', mmap_mode=mmap_mode),
+        np.load(directory / 'indptr.npy', mmap_mode=mmap_mode),
+    ), shape=tuple(meta['shape']), copy=False)
+    uids = np.load(directory / 'uids.npy', mmap_mode=mmap_mode)
+
+    return matrix, uids, meta['features']
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--max-stars', default=MAX_STARS)
+def main(input_filepath, output_filepath, max_stars):
+    """ Builds the sparse feature matrix of the processed movies in
+        INPUT_FILEPATH and saves it in OUTPUT_FILEPATH.
+    """
+    catalog = Catalog.from_dataframe(read_movies(input_filepath))
+    matrix, feature_names = build_features(catalog, max_stars)
+    save_features(output_filepath, matrix, catalog.get_uids(), feature_names)
+    LOGGER.info('features saved to %s' % output_filepath)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import numpy as np
+import pandas as pd
+from dotenv import find_dotenv, load_dotenv
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to get the smallest unsigned integer type holding the bits'''
+def get_mask_dtype(num_bits):
+    for dtype in [np.uint8, np.uint16, np.uint32, np.uint64]:
+        if num_bits <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError('%d genres do not fit a 64 bits mask' % num_bits)
+
+'''Function to intern the values of a list column into CSR offsets and ids'''
+def get_csr(column):
+    lengths = column.map(len).to_numpy(dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    values = column.explode().dropna()
+    codes, vocabulary = pd.factorize(values, sort=True)
+
+    vocabulary = np.asarray(vocabulary, dtype=object)
+    return offsets, codes.astype(np.int32), vocabulary
+
+'''Class to hold the catalog in compact typed arrays'''
+class Catalog:
+
+    '''Numeric columns and the types they are downcast to'''
+    NUMERIC_TYPES = {
+        'rank': np.int32,
+        'year': np.uint16,
+        'runtime': np.uint16,
+        'rating': np.float32,
+        'num_votes': np.uint32,
+    }
+
+    def __init__(self, uid, name, certificate, director, genre_mask, genres,
+                 star_offsets, star_ids, stars, numeric):
+        self.uid = uid
+        self.name = name
+        self.certificate = certificate
+        self.director = director
+        self.genre_mask = genre_mask
+        self.genres = genres
+        self.star_offsets = star_offsets
+        self.star_ids = star_ids
+        self.stars = stars
+        self.numeric = numeric
+
+    @classmethod
+    def from_dataframe(cls, df):
+        df = df.reset_index(drop=True)
+
+        # uids are tt + digits, so they fit an unsigned 32 bits number
+        uid = df['uid'].str.slice(2).astype(np.uint32).to_numpy()
+
+        # genres become one bit each in a multi-hot mask
+        genre_offsets, genre_codes, genres = get_csr(df['genre'])
+        genre_mask = np.zeros(len(df), dtype=get_mask_dtype(len(genres)))
+        rows = np.repeat(np.arange(len(df)), np.diff(genre_offsets))
+        bits = 1 << genre_codes.astype(np.uint64)
+        np.bitwise_or.at(genre_mask, rows, bits.astype(genre_mask.dtype))
+
+        star_offsets, star_ids, stars = get_csr(df['stars'])
+
+        numeric = {column: df[column].to_numpy(dtype=dtype)
+                   for column, dtype in cls.NUMERIC_TYPES.items()}
+
+        return cls(
+            uid=uid,
+            name=df['name'].astype('string[pyarrow]'),
+            certificate=df['certificate'].astype('category'),
+            director=df['director'].astype('category'),
+            genre_mask=genre_mask,
+            genres=genres,
+            star_offsets=star_offsets.astype(
+                np.int32 if len(star_ids) < 2 ** 31 else np.int64),
+            star_ids=star_ids,
+            stars=stars,
+            numeric=numeric,
+        )
+
+    def __len__(self):
+        return len(self.uid)
+
+    def get_uids(self):
+        return np.char.add('tt', np.char.zfill(self.uid.astype(str), 7))
+
+    def get_genres(self, row):
+        bits = int(self.genre_mask[row])
+        return [genre for n, genre in enumerate(self.genres) if bits >> n & 1]
+
+    def get_stars(self, row):
+        start, stop = self.star_offsets[row], self.star_offsets[row + 1]
+        return list(self.stars[self.star_ids[start:stop]])
+
+    def has_genre(self, genre):
+        '''Returns a boolean array of the titles listed under the genre'''
+        bit = np.searchsorted(self.genres, genre)
+        if bit == len(self.genres) or self.genres[bit] != genre:
+            return np.zeros(len(self), dtype=bool)
+        return (self.genre_mask >> self.genre_mask.dtype.type(bit)) & 1 == 1
+
+    def to_dataframe(self):
+        df = pd.DataFrame({
+            'uid': self.get_uids(),
+            'name': self.name.astype(object),
+            'certificate': self.certificate.astype(object),
+            'director': self.director.astype(object),
+        })
+        df['genre'] = [self.get_genres(row) for row in range(len(self))]
+        df['stars'] = [self.get_stars(row) for row in range(len(self))]
+        for column, values in self.numeric.items():
+            df[column] = values
+
+        return df
+
+    def nbytes(self):
+        '''Returns the bytes held by the catalog, strings included'''
+        vocabularies = (sum(len(value) for value in self.genres)
+                        + sum(len(value) for value in self.stars))
+        return int(
+            self.uid.nbytes
+            + self.name.memory_usage(deep=True, index=False)
+            + self.certificate.memory_usage(deep=True, index=False)
+            + self.director.memory_usage(deep=True, index=False)
+            + self.genre_mask.nbytes
+            + self.star_offsets.nbytes
+            + self.star_ids.nbytes
+            + vocabularies
+            + sum(values.nbytes for values in self.numeric.values())
+        )
+
+'''Function to read the processed movies with python lists in list columns'''
+def read_movies(filepath):
+    df = pd.read_parquet(filepath)
+    # parquet gives back numpy arrays in the list columns
+    df['genre'] = df['genre'].map(list)
+    df['stars'] = df['stars'].map(list)
+
+    return df
+
+'''Function to compare the memory of the catalog with the cleaned data-frame'''
+def benchmark_memory(df):
+    catalog = Catalog.from_dataframe(df)
+    dataframe_bytes = int(df.memory_usage(deep=True, index=False).sum())
+    catalog_bytes = catalog.nbytes()
+
+    return {
+        'rows': len(df),
+        'dataframe_bytes': dataframe_bytes,
+        'catalog_bytes': catalog_bytes,
+        'ratio': dataframe_bytes / catalog_bytes,
+    }
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+def main(input_filepath):
+    """ Compares the memory of the processed movies in INPUT_FILEPATH as a
+        data-frame and as a compact catalog.
+    """
+    df = read_movies(input_filepath)
+
+    results = benchmark_memory(df)
+    LOGGER.info('%d movies: data-frame %.1f MB, catalog %.1f MB '
+                '(%.1fx smaller)' % (
+        results['rows'], results['dataframe_bytes'] / 1e6,
+        results['catalog_bytes'] / 1e6, results['ratio']))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import json
+import click
+import logging
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.features.catalog import read_movies
+
+'''Number of titles kept in every leaderboard'''
+TOP_N = 50
+
+'''Quantile of the votes used as the minimum votes of the weighted rating'''
+MIN_VOTES_QUANTILE = 0.9
+
+'''Dimensions with a leaderboard for each of their values'''
+DIMENSIONS = ['genre', 'director', 'certificate', 'decade']
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to get the IMDB-style weighted rating, pulling titles with few votes
+towards the mean
+'''
+def get_weighted_rating(rating, num_votes, min_votes, mean_rating):
+    # WR = v / (v + m) * R + m / (v + m) * C
+    return ((num_votes * rating + min_votes * mean_rating)
+            / (num_votes + min_votes))
+
+'''
+Function to build the leaderboards of every dimension in a single sorted
+pass
+'''
+def build_leaderboards(df, top_n=TOP_N, min_votes_quantile=MIN_VOTES_QUANTILE):
+    LOGGER.info('building leaderboards of %d movies...' % len(df))
+
+    rated = df[df['num_votes'] > 0]
+    num_votes = df['num_votes'].to_numpy(dtype=np.float64)
+    min_votes = (float(rated['num_votes'].quantile(min_votes_quantile))
+                 if len(rated) else 0.0)
+    mean_rating = float(rated['rating'].mean()) if len(rated) else 0.0
+
+    scores = pd.DataFrame({
+        'uid': df['uid'].to_numpy(),
+        'score': get_weighted_rating(df['rating'].to_numpy(dtype=np.float64),
+                                     num_votes, min_votes, mean_rating),
+        'genre': df['genre'].to_numpy(),
+        'director': df['director'].to_numpy(),
+        'certificate': df['certificate'].astype(str).to_numpy(),
+        'decade': np.where(df['year'] > 0, df['year'] // 10 * 10, -1),
+    })
+    # sorted once, every leaderboard is then the head of its group
+    scores = scores[num_votes > 0].sort_values('score', ascending=False,
+                                               kind='stable')
+
+    tables = {'all': {'all': scores['uid'].head(top_n).tolist()}}
+    for dimension in DIMENSIONS:
+        column = scores[['uid', dimension]]
+        if dimension == 'genre':
+            column = column.explode('genre')
+        values = column[dimension]
+        column = column[values.notna() & (values != '') & (values != -1)]
+
+        top = column.groupby(dimension, sort=False).head(top_n)
+        groups = top.groupby(dimension, sort=False)['uid'].agg(list)
+        tables[dimension] = {str(key): uids for key, uids in groups.items()}
+
+    # only the scores of the titles in some leaderboard are kept
+    listed = {uid for table in tables.values() for uids in table.values()
+              for uid in uids}
+    listed = scores[scores['uid'].isin(listed)]
+
+    return {
+        'min_votes': min_votes,
+        'mean_rating': mean_rating,
+        'scores': dict(zip(listed['uid'], listed['score'].round(4))),
+        'tables': tables,
+    }
+
+'''
+Class to answer "popular in X" and cold-start lookups from the precomputed
+tables
+'''
+class Leaderboards:
+
+    def __init__(self, leaderboards):
+        self.min_votes = leaderboards['min_votes']
+        self.mean_rating = leaderboards['mean_rating']
+        self.scores = leaderboards['scores']
+        self.tables = leaderboards['tables']
+
+    @classmethod
+    def load(cls, filepath):
+        with open(filepath) as f:
+            return cls(json.load(f))
+
+    def popular(self, dimension, key, n=10):
+        '''
+        Returns the n best titles of the value of a dimension, e.g.
+        popular('decade', 1990)
+        '''
+        return self.tables.get(dimension, {}).get(str(key), [])[:n]
+
+    def cold_start(self, n=10):
+        '''Returns the n best titles of the whole catalog'''
+        return self.tables['all']['all'][:n]
+
+    def get_score(self, uid):
+        return self.scores.get(uid)
+
+'''Function to save the leaderboards as a JSON lookup table'''
+def save_leaderboards(filepath, leaderboards):
+    Path(filepath).parent.mkdir(parents=True, exist_ok=True)
+    with open(filepath, 'w') as f:
+        json.dump(leaderboards, f)
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--top-n', default=TOP_N)
+def main(input_filepath, output_filepath, top_n):
+    """ Builds the vote-weighted leaderboards of the processed movies in
+        INPUT_FILEPATH and saves them in OUTPUT_FILEPATH.
+    """
+    leaderboards = build_leaderboards(read_movies(input_filepath), top_n)
+    save_leaderboards(output_filepath, leaderboards)
+    LOGGER.info('leaderboards saved to %s (m = %.0f votes, C = %.2f)'
+                % (output_filepath, leaderboards['min_votes'],
+                   leaderboards['mean_rating']))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,454 @@
+# -*- coding: utf-8 -*-
+import re
+import json
+import time
+import click
+import logging
+import unicodedata
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+'''Fields of a title that are searched'''
+SEARCH_FIELDS = ['name', 'director', 'stars']
+
+'''Number of results of a query'''
+NUM_RESULTS = 10
+
+'''Maximum number of vocabulary words a prefix expands to'''
+MAX_EXPANSIONS = 16
+
+'''Maximum number of vocabulary words whose distance to a typo is computed'''
+MAX_CANDIDATES = 24
+
+'''
+Number of candidates in the first window of ranks of a query, the next ones
+doubling
+'''
+WINDOW_SIZE = 1024
+
+'''Penalty of a title missing a word of the query, above any sum of typos'''
+UNMATCHED = 1 << 20
+
+'''Pattern of the characters that split the words'''
+SEPARATORS = re.compile(r'[^0-9a-z]+')
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to lowercase the text, dropping the accents and the punctuation'''
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = text.encode('ascii', 'ignore').decode('ascii')
+    return SEPARATORS.sub(' ', text.lower()).strip()
+
+'''Function to split the text into normalized words'''
+def tokenize(text):
+    return normalize(text).split()
+
+'''
+Function to get the character trigrams of a word, padded so the ends of short
+words weigh in
+'''
+def get_trigrams(word):
+    padded = '$$%s$$' % word
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+'''Function to get the number of typos tolerated in a word of the query'''
+def get_max_typos(word):
+    return 0 if len(word) < 4 else 1 if len(word) < 8 else 2
+
+'''
+Function to get the edit distance of two words, a swap of neighbors counting
+as one typo, giving up above the limit
+'''
+def get_edit_distance(a, b, limit):
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    # only the cells within the limit of the diagonal can stay under it
+    beyond = limit + 1
+    before = None
+    previous = [j if j <= limit else beyond for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        char_a = a[i - 1]
+        current = [i if i <= limit else beyond] + [beyond] * len(b)
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            char_b = b[j - 1]
+            distance = previous[j - 1] + (char_a != char_b)
+            if previous[j] + 1 < distance:
+                distance = previous[j] + 1
+            if current[j - 1] + 1 < distance:
+                distance = current[j - 1] + 1
+            if (i > 1 and j > 1 and char_a == b[j - 2]
+                    and a[i - 2] == char_b and before[j - 2] + 1 < distance):
+                distance = before[j - 2] + 1
+            current[j] = distance
+        if min(current) > limit:
+            return beyond
+        before, previous = previous, current
+    return min(previous[-1], beyond)
+
+'''Function to get the values of a CSR-like array of postings'''
+def get_postings(offsets, values, key):
+    return values[offsets[key]:offsets[key + 1]]
+
+'''
+Function to group distinct (key, value) pairs into offsets and sorted values
+per key
+'''
+def get_csr(keys, values, num_keys):
+    width = int(values.max(initial=0)) + 1
+    pairs = np.sort(keys.astype(np.int64) * width + values)
+    offsets = np.searchsorted(pairs // width, np.arange(num_keys + 1))
+    return offsets.astype(np.int64), (pairs % width).astype(np.int32)
+
+'''
+Class to find titles by their name, director and stars, tolerating typos and
+partial words
+'''
+class SearchIndex:
+
+    def __init__(self):
+        self.uids = []
+        self.rows = {}
+        self.names = []
+        self.texts = []
+        self.num_votes = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+        # the words of every title, kept to rebuild the postings without
+        # tokenizing again
+        self.token_docs = np.zeros(0, dtype=np.int32)
+        self.token_words = np.zeros(0, dtype=np.int32)
+        self.words = []
+        self.word_ids = {}
+        self.trigram_ids = {}
+        self.trigram_keys = np.zeros(0, dtype=np.int32)
+        self.trigram_words = np.zeros(0, dtype=np.int32)
+
+    def get_word_id(self, word, trigram_keys, trigram_words):
+        word_id = self.word_ids.get(word)
+        if word_id is None:
+            word_id = self.word_ids[word] = len(self.words)
+            self.words.append(word)
+            for trigram in get_trigrams(word):
+                key = self.trigram_ids.setdefault(trigram,
+                                                  len(self.trigram_ids))
+                trigram_keys.append(key)
+                trigram_words.append(word_id)
+        return word_id
+
+    def add(self, df):
+        '''
+        Adds the titles not in the index yet and refreshes the changed ones,
+        tokenizing only those. Returns the number of titles tokenized.
+        '''
+        token_docs, token_words, trigram_keys, trigram_words = [], [], [], []
+        removed, added_votes = [], []
+
+        titles = zip(df['uid'], df['name'], df['director'], df['stars'],
+                     df['num_votes'])
+        for uid, name, director, stars, votes in titles:
+            text = ' '.join([name or '', director or ''] + list(stars))
+            row = self.rows.get(uid)
+            if row is not None:
+                self.num_votes[row] = votes
+                if self.texts[row] == text:
+                    continue
+                # a title whose text changed is tokenized again under a new
+                # row
+                removed.append(row)
+
+            row = len(self.uids)
+            self.rows[uid] = row
+            self.uids.append(uid)
+            self.names.append(name)
+            self.texts.append(text)
+            added_votes.append(votes)
+            for word in set(tokenize(text)):
+                token_docs.append(row)
+                token_words.append(self.get_word_id(word, trigram_keys,
+                                                    trigram_words))
+
+        self.num_votes = np.concatenate(
+            [self.num_votes, np.asarray(added_votes, dtype=np.int64)])
+        self.alive = np.concatenate(
+            [self.alive, np.ones(len(added_votes), dtype=bool)])
+        self.alive[removed] = False
+
+        self.token_docs = np.concatenate(
+            [self.token_docs, np.asarray(token_docs, dtype=np.int32)])
+        self.token_words = np.concatenate(
+            [self.token_words, np.asarray(token_words, dtype=np.int32)])
+        self.trigram_keys = np.concatenate(
+            [self.trigram_keys, np.asarray(trigram_keys, dtype=np.int32)])
+        self.trigram_words = np.concatenate(
+            [self.trigram_words, np.asarray(trigram_words, dtype=np.int32)])
+        self.build()
+
+        return len(added_votes)
+
+    def build(self):
+        '''
+        Groups the words of every title into the postings, a vectorized pass
+        over every token
+        '''
+        # the titles are ranked by votes, so the postings list the most voted
+        # ones first
+        alive_rows = np.flatnonzero(self.alive)
+        order = np.argsort(-self.num_votes[alive_rows], kind='stable')
+        self.ranked_rows = alive_rows[order].astype(np.int32)
+        ranks = np.full(len(self.alive), -1, dtype=np.int32)
+        ranks[self.ranked_rows] = np.arange(len(self.ranked_rows),
+                                            dtype=np.int32)
+
+        token_ranks = ranks[self.token_docs]
+        alive = token_ranks >= 0
+        self.word_offsets, self.word_ranks = get_csr(
+            self.token_words[alive], token_ranks[alive], len(self.words))
+        self.trigram_offsets, self.trigram_postings = get_csr(
+            self.trigram_keys, self.trigram_words, len(self.trigram_ids))
+        # sorted words answer prefixes with a binary search
+        if self.words:
+            words = np.array(self.words, dtype=str)
+        else:
+            words = np.zeros(0, dtype='U1')
+        self.sorted_word_ids = np.argsort(words, kind='stable')
+        self.sorted_word_ids = self.sorted_word_ids.astype(np.int32)
+        self.sorted_words = words[self.sorted_word_ids]
+        self.word_lengths = np.char.str_len(words)
+        self.word_counts = np.diff(self.word_offsets)
+
+    def get_prefix_words(self, prefix):
+        '''
+        Returns the words starting with the prefix, the most frequent ones
+        when there are too many
+        '''
+        start = np.searchsorted(self.sorted_words, prefix, side='left')
+        stop = np.searchsorted(self.sorted_words, prefix + '\uffff',
+                               side='left')
+        word_ids = self.sorted_word_ids[start:stop]
+        if len(word_ids) > MAX_EXPANSIONS:
+            frequent = np.argpartition(-self.word_counts[word_ids],
+                                       MAX_EXPANSIONS - 1)
+            word_ids = word_ids[frequent[:MAX_EXPANSIONS]]
+        return word_ids
+
+    def get_similar_words(self, word):
+        '''
+        Returns the words within the typos tolerated and their distance, by
+        shared trigrams
+        '''
+        max_typos = get_max_typos(word)
+        trigrams = [self.trigram_ids[trigram] for trigram in get_trigrams(word)
+                    if trigram in self.trigram_ids]
+        if not max_typos or not trigrams:
+            return {}
+
+        candidates = np.concatenate(
+            [get_postings(self.trigram_offsets, self.trigram_postings, key)
+             for key in trigrams])
+        shared = np.bincount(candidates, minlength=len(self.words))
+        # a typo changes at most 4 trigrams, the words sharing the most are
+        # checked first
+        min_shared = len(get_trigrams(word)) - 4 * max_typos
+        word_ids = np.flatnonzero(shared >= min_shared)
+        lengths = self.word_lengths[word_ids]
+        word_ids = word_ids[np.abs(lengths - len(word)) <= max_typos]
+        order = np.argsort(-shared[word_ids], kind='stable')
+        word_ids = word_ids[order][:MAX_CANDIDATES]
+
+        similar = {}
+        for word_id in word_ids:
+            distance = get_edit_distance(word, self.words[word_id], max_typos)
+            if distance <= max_typos:
+                similar[int(word_id)] = distance
+        return similar
+
+    def get_token_words(self, token, prefix=False):
+        '''
+        Returns the words matching a word of the query and their distance to
+        it
+        '''
+        matches = {}
+        word_id = self.word_ids.get(token)
+        if word_id is not None:
+            matches[word_id] = 0
+        if prefix:
+            for word_id in self.get_prefix_words(token):
+                matches.setdefault(int(word_id), 0)
+        # the words of the query missing from the vocabulary are taken as
+        # typos
+        if not matches:
+            matches = self.get_similar_words(token)
+        return matches
+
+    def get_penalties(self, postings, ranks):
+        '''
+        Returns the sum of the distances of the titles at the ranks to the
+        words of the query
+        '''
+        penalties = np.zeros(len(ranks), dtype=np.int32)
+        for token_postings in postings:
+            distances = np.full(len(ranks), UNMATCHED, dtype=np.int32)
+            # the closest words come last so they win the ranks matched by
+            # several words
+            for word_ranks, distance in token_postings:
+                positions = np.minimum(np.searchsorted(word_ranks, ranks),
+                                       len(word_ranks) - 1)
+                distances[word_ranks[positions] == ranks] = distance
+            penalties += distances
+        return penalties
+
+    def search(self, query, n=NUM_RESULTS, autocomplete=False):
+        '''
+        Returns the (uid, name) of the best n titles having every word of the
+        query, the last as a prefix when autocompleting
+        '''
+        tokens = tokenize(query)
+        matches = [self.get_token_words(
+                       token, prefix=autocomplete and i == len(tokens) - 1)
+                   for i, token in enumerate(tokens)]
+        if not matches or not all(matches):
+            return []
+        postings = [[(get_postings(self.word_offsets, self.word_ranks,
+                                   word_id), distance)
+                     for word_id, distance
+                     in sorted(words.items(), key=lambda item: -item[1])]
+                    for words in matches]
+        postings = [[(ranks, distance) for ranks, distance in token_postings
+                     if len(ranks)]
+                    for token_postings in postings]
+        best_penalty = sum(min(words.values()) for words in matches)
+
+        # the candidates come from the rarest word of the query, a window of
+        # ranks at a time
+        driver = min(postings, key=lambda token_postings: sum(
+            len(ranks) for ranks, _ in token_postings))
+        num_driver = sum(len(ranks) for ranks, _ in driver)
+        num_ranks = len(self.ranked_rows)
+        size = max(num_ranks * WINDOW_SIZE // max(num_driver, 1), 1)
+
+        found_ranks, found_penalties = [], []
+        num_best, start = 0, 0
+        # the windows go by votes, so they stop once enough of the closest
+        # matches are found
+        while start < num_ranks and num_best < n:
+            stop = min(start + size, num_ranks)
+            ranks = np.sort(np.concatenate(
+                [word_ranks[np.searchsorted(word_ranks, start):
+                            np.searchsorted(word_ranks, stop)]
+                 for word_ranks, _ in driver]))
+            if len(ranks):
+                ranks = ranks[np.concatenate([[True],
+                                              ranks[1:] != ranks[:-1]])]
+            penalties = self.get_penalties(postings, ranks)
+            matched = penalties < UNMATCHED
+            found_ranks.append(ranks[matched])
+            found_penalties.append(penalties[matched])
+            num_best += int(np.count_nonzero(
+                penalties[matched] == best_penalty))
+            start, size = stop, size * 2
+
+        # the closest matches first, then the most voted titles
+        ranks = np.concatenate(found_ranks)
+        order = np.lexsort((ranks, np.concatenate(found_penalties)))[:n]
+        return [(self.uids[row], self.names[row])
+                for row in self.ranked_rows[ranks[order]]]
+
+    def autocomplete(self, prefix, n=NUM_RESULTS):
+        return self.search(prefix, n, autocomplete=True)
+
+    def save(self, directory):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        np.savez(directory / 'search.npz', num_votes=self.num_votes,
+                 alive=self.alive, token_docs=self.token_docs,
+                 token_words=self.token_words,
+                 trigram_keys=self.trigram_keys,
+                 trigram_words=self.trigram_words)
+        with open(directory / 'search.json', 'w') as f:
+            json.dump({'uids': self.uids, 'names': self.names,
+                       'texts': self.texts, 'words': self.words,
+                       'trigrams': list(self.trigram_ids)}, f)
+
+    @classmethod
+    def load(cls, directory):
+        directory = Path(directory)
+        with open(directory / 'search.json') as f:
+            meta = json.load(f)
+
+        index = cls()
+        with np.load(directory / 'search.npz') as arrays:
+            for name in arrays.files:
+                setattr(index, name, arrays[name])
+        index.uids = meta['uids']
+        index.names = meta['names']
+        index.texts = meta['texts']
+        index.words = meta['words']
+        index.word_ids = {word: word_id
+                          for word_id, word in enumerate(index.words)}
+        index.trigram_ids = {trigram: key
+                             for key, trigram in enumerate(meta['trigrams'])}
+        # the last row of a uid is its current one
+        index.rows = {uid: row for row, uid in enumerate(index.uids)}
+        index.build()
+
+        return index
+
+'''Function to measure the latency of the queries'''
+def benchmark_queries(index, queries, n=NUM_RESULTS, autocomplete=False):
+    latencies = []
+    for query in queries:
+        begin = time.perf_counter()
+        index.search(query, n, autocomplete)
+        latencies.append(time.perf_counter() - begin)
+    latencies = np.array(latencies) * 1e6
+
+    return {'queries': len(queries),
+            'p50_us': float(np.percentile(latencies, 50)),
+            'p99_us': float(np.percentile(latencies, 99)),
+            'mean_us': float(latencies.mean())}
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('index_filepath', type=click.Path())
+@click.option('--query', 'queries', multiple=True,
+              help='Queries to run once the index is up to date')
+@click.option('--autocomplete', is_flag=True,
+              help='Takes the last word of the queries as a prefix')
+@click.option('--n', default=NUM_RESULTS)
+def main(input_filepath, index_filepath, queries, autocomplete, n):
+    """ Builds the search index of the processed movies in INPUT_FILEPATH into
+        INDEX_FILEPATH, tokenizing only the titles new since the last build.
+    """
+    df = pd.read_parquet(input_filepath,
+                         columns=['uid', 'num_votes'] + SEARCH_FIELDS)
+
+    begin = time.perf_counter()
+    if (Path(index_filepath) / 'search.json').is_file():
+        index = SearchIndex.load(index_filepath)
+    else:
+        index = SearchIndex()
+    num_added = index.add(df)
+    index.save(index_filepath)
+    LOGGER.info('%d titles tokenized, %d words, %d titles indexed in %.2fs'
+                % (num_added, len(index.words), int(index.alive.sum()),
+                   time.perf_counter() - begin))
+
+    for query in queries:
+        begin = time.perf_counter()
+        results = index.search(query, n, autocomplete)
+        LOGGER.info('%r in %.0fus: %s'
+                    % (query, (time.perf_counter() - begin) * 1e6, results))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
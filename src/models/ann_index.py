@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import click
+import logging
+import numpy as np
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.features.build_features import load_features
+from src.models.train_model import get_unit_matrices, MEMORY_BUDGET
+
+'''
+Number of hash tables, more tables find more true neighbors but cost more
+candidates
+'''
+NUM_TABLES = 32
+
+'''
+Number of rows a bucket holds on average, the number of bits per table is
+derived from it
+'''
+BUCKET_ROWS = 64
+
+'''Number of extra buckets probed per table, flipping the least certain bits'''
+NUM_PROBES = 2
+
+'''
+Number of rows below which an exact search is faster than probing the
+tables
+'''
+EXACT_SEARCH_ROWS = 100000
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Class to find approximate cosine neighbors with random hyperplane hashing'''
+class LSHIndex:
+
+    def __init__(self, num_tables=NUM_TABLES, num_bits=None, seed=0,
+                 min_rows=EXACT_SEARCH_ROWS):
+        if num_bits is not None and num_bits > 63:
+            raise ValueError('a table hashes into at most 63 bits')
+
+        self.num_tables = num_tables
+        self.num_bits = num_bits
+        self.seed = seed
+        self.min_rows = min_rows
+        self.exact = False
+
+    def set_num_bits(self, num_rows):
+        '''
+        Picks the number of bits that leaves about BUCKET_ROWS rows per bucket,
+        unless it was given
+        '''
+        if self.num_bits is None:
+            num_bits = np.round(np.log2(max(num_rows, 1) / BUCKET_ROWS))
+            self.num_bits = int(np.clip(num_bits, 4, 63))
+        self.bit_weights = (1 << np.arange(self.num_bits, dtype=np.int64))
+
+    def project(self, matrix):
+        '''
+        Returns the projections of unit rows on every hyperplane, num_rows x
+        tables x bits
+        '''
+        num_planes = self.num_tables * self.num_bits
+        projections = np.empty((matrix.shape[0], num_planes),
+                               dtype=np.float32)
+        # the dense product of a block stays within the training memory budget
+        block_size = max(1, MEMORY_BUDGET // (num_planes * 8))
+        for start in range(0, matrix.shape[0], block_size):
+            block = matrix[start:start + block_size]
+            projections[start:start + block_size] = block @ self.planes
+
+        return projections.reshape(matrix.shape[0], self.num_tables,
+                                   self.num_bits)
+
+    def get_codes(self, projections):
+        return ((projections > 0) * self.bit_weights).sum(axis=2)
+
+    def set_buckets(self, codes):
+        '''Finds the code and first row of every bucket, tables end to end'''
+        bucket_codes, bucket_starts, offsets = [], [], [0]
+        for table in range(self.num_tables):
+            sorted_codes = codes[self.orders[table], table]
+            table_codes, starts = np.unique(sorted_codes, return_index=True)
+            bucket_codes.append(table_codes)
+            bucket_starts.append(np.append(starts, len(sorted_codes)))
+            offsets.append(offsets[-1] + len(table_codes))
+
+        self.bucket_codes = np.concatenate(bucket_codes)
+        self.bucket_starts = np.concatenate(bucket_starts)
+        self.table_offsets = np.array(offsets, dtype=np.int64)
+        self.split_buckets()
+
+    def split_buckets(self):
+        '''
+        Splits the buckets into a view per table, every table has one more
+        start than codes
+        '''
+        self.buckets = []
+        for table in range(self.num_tables):
+            start = self.table_offsets[table]
+            stop = self.table_offsets[table + 1]
+            self.buckets.append(
+                (self.bucket_codes[start:stop],
+                 self.bucket_starts[start + table:stop + table + 1]))
+
+    def fit(self, matrix):
+        '''Hashes every row of the feature matrix into the tables'''
+        begin = time.perf_counter()
+        self.matrix, _ = get_unit_matrices(matrix)
+        self.build_seconds = 0.0
+
+        # small catalogs are searched exactly, the tables would cost more than
+        # they save
+        self.exact = matrix.shape[0] < self.min_rows
+        if self.exact:
+            LOGGER.info('%d rows are searched exactly (below %d)'
+                        % (matrix.shape[0], self.min_rows))
+            return self
+
+        self.set_num_bits(matrix.shape[0])
+        rng = np.random.default_rng(self.seed)
+        num_planes = self.num_tables * self.num_bits
+        self.planes = rng.standard_normal(
+            (matrix.shape[1], num_planes)).astype(np.float32)
+        codes = self.get_codes(self.project(self.matrix))
+
+        # every table is the rows sorted by code plus the start of every bucket
+        orders = np.argsort(codes, axis=0, kind='stable')
+        self.orders = orders.astype(np.int32).T
+        self.set_buckets(codes)
+
+        self.build_seconds = time.perf_counter() - begin
+        LOGGER.info('hashed %d rows into %d tables of %d bits in %.2fs'
+                    % (matrix.shape[0], self.num_tables, self.num_bits,
+                       self.build_seconds))
+        return self
+
+    def get_candidates(self, projections, num_probes=NUM_PROBES):
+        '''Returns the rows sharing a bucket with the query in any table'''
+        codes = self.get_codes(projections[None])[0]
+        # the bits whose projection is closest to zero are the least certain
+        flips = np.argsort(np.abs(projections), axis=1)[:, :num_probes]
+        probes = np.column_stack([codes[:, None],
+                                  codes[:, None] ^ self.bit_weights[flips]])
+
+        candidates = []
+        for table in range(self.num_tables):
+            bucket_codes, starts = self.buckets[table]
+            table_probes = np.unique(probes[table])
+            positions = np.minimum(np.searchsorted(bucket_codes, table_probes),
+                                   len(bucket_codes) - 1)
+            found = positions[bucket_codes[positions] == table_probes]
+            for position in found:
+                begin, end = starts[position], starts[position + 1]
+                candidates.append(self.orders[table, begin:end])
+
+        if not candidates:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate(candidates))
+
+    def query(self, vector, k=10, num_probes=NUM_PROBES, exclude=None):
+        '''Returns the k approximate neighbors of a feature row and cosine'''
+        vector, _ = get_unit_matrices(vector)
+        if self.exact:
+            return self.query_exact(vector, k, exclude)
+        projections = (vector @ self.planes).reshape(self.num_tables,
+                                                     self.num_bits)
+
+        candidates = self.get_candidates(projections, num_probes)
+        if exclude is not None:
+            candidates = candidates[candidates != exclude]
+        if len(candidates) == 0:
+            return (np.empty(0, dtype=np.int32),
+                    np.empty(0, dtype=np.float32))
+
+        # the candidates are ranked by their exact similarity
+        scores = self.matrix[candidates] @ vector.T
+        scores = np.asarray(scores.todense()).ravel()
+        top = np.argsort(-scores, kind='stable')[:k]
+
+        return candidates[top], scores[top].astype(np.float32)
+
+    def query_exact(self, vector, k=10, exclude=None):
+        '''Returns the k exact neighbors of a unit feature row, their cosine'''
+        scores = np.asarray((self.matrix @ vector.T).todense()).ravel()
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        k = min(k, len(scores) - (exclude is not None))
+        if k <= 0:
+            return (np.empty(0, dtype=np.int32),
+                    np.empty(0, dtype=np.float32))
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return top.astype(np.int32), scores[top].astype(np.float32)
+
+    def query_row(self, row, k=10, num_probes=NUM_PROBES):
+        '''Returns the k approximate neighbors of a title in the index'''
+        return self.query(self.matrix[row], k, num_probes, exclude=row)
+
+    def save(self, directory):
+        '''
+        Saves the hash tables, sorted rows and buckets included, so loading
+        hashes nothing
+        '''
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / 'lsh.json', 'w') as f:
+            json.dump({'exact': self.exact, 'num_tables': self.num_tables,
+                       'num_bits': self.num_bits, 'seed': self.seed,
+                       'min_rows': self.min_rows}, f, indent=2)
+        if self.exact:
+            return
+
+        np.save(directory / 'lsh_planes.npy', self.planes)
+        np.save(directory / 'lsh_orders.npy', self.orders)
+        np.save(directory / 'lsh_bucket_codes.npy', self.bucket_codes)
+        np.save(directory / 'lsh_bucket_starts.npy', self.bucket_starts)
+        np.save(directory / 'lsh_table_offsets.npy', self.table_offsets)
+
+    @classmethod
+    def load(cls, directory, matrix, mmap=True):
+        '''
+        Loads the hash tables saved for the given feature matrix,
+        memory-mapping them
+        '''
+        directory = Path(directory)
+        mmap_mode = 'r' if mmap else None
+        with open(directory / 'lsh.json') as f:
+            meta = json.load(f)
+
+        index = cls(meta['num_tables'], meta['num_bits'], meta['seed'],
+                    meta['min_rows'])
+        index.matrix, _ = get_unit_matrices(matrix)
+        index.exact = meta['exact']
+        if index.exact:
+            return index
+
+        index.set_num_bits(matrix.shape[0])
+        for name in ['planes', 'orders', 'bucket_codes', 'bucket_starts',
+                     'table_offsets']:
+            setattr(index, name, np.load(directory / ('lsh_%s.npy' % name),
+                                         mmap_mode=mmap_mode))
+        index.split_buckets()
+
+        return index
+
+'''Function to get the exact top-k neighbors of a few rows by brute force'''
+def get_exact_neighbors(matrix, rows, k):
+    unit, transpose = get_unit_matrices(matrix)
+    similarities = (unit[rows] @ transpose).toarray()
+    similarities[np.arange(len(rows)), rows] = -np.inf
+
+    return np.argsort(-similarities, axis=1, kind='stable')[:, :k]
+
+'''
+Function to measure the recall and speed of the index against brute force
+search
+'''
+def benchmark_recall(matrix, settings, num_queries=200, k=10, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(matrix.shape[0], min(num_queries, matrix.shape[0]),
+                      replace=False)
+
+    begin = time.perf_counter()
+    exact = get_exact_neighbors(matrix, rows, k)
+    exact_seconds = (time.perf_counter() - begin) / len(rows)
+
+    results = []
+    for num_tables, num_bits, num_probes in settings:
+        # the tables are built whatever the size, to measure them against the
+        # exact search
+        index = LSHIndex(num_tables, num_bits, seed, min_rows=0).fit(matrix)
+
+        hits = 0
+        latencies = []
+        for row, neighbors in zip(rows, exact):
+            begin = time.perf_counter()
+            found, _ = index.query_row(row, k, num_probes)
+            latencies.append(time.perf_counter() - begin)
+            hits += len(np.intersect1d(found, neighbors))
+
+        results.append({
+            'num_tables': num_tables,
+            'num_bits': index.num_bits,
+            'num_probes': num_probes,
+            'build_seconds': index.build_seconds,
+            'recall': hits / (len(rows) * k),
+            'p50_us': float(np.percentile(latencies, 50) * 1e6),
+            'p99_us': float(np.percentile(latencies, 99) * 1e6),
+            'exact_us': exact_seconds * 1e6,
+        })
+
+    return results
+
+@click.command()
+@click.argument('features_filepath', type=click.Path(exists=True))
+@click.option('--k', default=10)
+@click.option('--num-queries', default=200)
+def main(features_filepath, k, num_queries):
+    """ Measures the recall of the approximate index over the features in
+        FEATURES_FILEPATH for a few build and query settings.
+    """
+    matrix, _, _ = load_features(features_filepath)
+    # no number of bits derives it from the catalog size
+    settings = [(16, None, 2), (NUM_TABLES, None, 0),
+                (NUM_TABLES, None, NUM_PROBES), (16, 14, 4)]
+    if matrix.shape[0] < EXACT_SEARCH_ROWS:
+        LOGGER.info('%d rows: the index searches exactly below %d rows'
+                    % (matrix.shape[0], EXACT_SEARCH_ROWS))
+
+    for result in benchmark_recall(matrix, settings, num_queries, k):
+        LOGGER.info('tables %(num_tables)d, bits %(num_bits)d, '
+                    'probes %(num_probes)d: recall@%(k)d %(recall).3f, '
+                    'p50 %(p50_us).0fus, p99 %(p99_us).0fus (exact '
+                    '%(exact_us).0fus, build %(build_seconds).2fs)'
+                    % dict(result, k=k))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,347 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import click
+import logging
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import find_dotenv, load_dotenv
+
+from src.features.catalog import read_movies
+from src.models.predict_model import Recommender
+
+'''Number of recommendations scored per title'''
+NUM_RECOMMENDATIONS = 10
+
+'''Number of titles a worker process evaluates at a time'''
+BATCH_SIZE = 1024
+
+'''Genre overlap (Jaccard) above which a recommended title is relevant'''
+GENRE_OVERLAP = 0.5
+
+'''Latency percentiles reported'''
+PERCENTILES = [50, 90, 95, 99]
+
+'''Directory of the evaluation results'''
+RESULTS_DIR = './reports/evaluation'
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Relevance proxies and recommender of the worker process, set once by
+init_worker
+'''
+WORKER = {}
+
+'''Number of set bits of every byte'''
+POPCOUNT = np.array([bin(byte).count('1') for byte in range(256)],
+                    dtype=np.uint8)
+
+'''
+Function to get the genres of every title as a bitmask of bytes, any number
+of genres fitting
+'''
+def get_genre_masks(genres):
+    exploded = genres.explode().dropna()
+    codes, names = pd.factorize(exploded)
+    masks = np.zeros((len(genres), len(names) // 8 + 1), dtype=np.uint8)
+    rows = exploded.index.to_numpy()
+    bits = (1 << (codes % 8)).astype(np.uint8)
+    np.bitwise_or.at(masks, (rows, codes // 8), bits)
+
+    return masks
+
+'''Function to count the set bits along the last axis'''
+def get_popcount(masks):
+    return POPCOUNT[masks].sum(axis=-1, dtype=np.int32)
+
+'''
+Function to get the genre overlap (Jaccard) of two broadcastable arrays of
+masks, 0 when both have no genre
+'''
+def get_genre_overlap(a, b):
+    union = get_popcount(a | b)
+    return np.where(union > 0, get_popcount(a & b) / np.maximum(union, 1),
+                    0.0)
+
+'''
+Function to get the relevance proxies of the catalog: the director and the
+genres of every title
+'''
+def get_relevance(df):
+    df = df.reset_index(drop=True)
+    directors, _ = pd.factorize(df['director'].where(df['director'] != ''))
+
+    return {
+        'uids': pd.Index(df['uid'].to_numpy(dtype=object)),
+        'directors': directors.astype(np.int32),
+        'masks': get_genre_masks(df['genre']),
+    }
+
+'''Function to count the titles relevant to every title, itself aside'''
+def get_relevant_counts(relevance, genre_overlap=GENRE_OVERLAP):
+    directors, masks = relevance['directors'], relevance['masks']
+
+    # the titles are grouped by genres, so the overlaps are computed once per
+    # pair of distinct genre sets
+    distinct, inverse, counts = np.unique(masks, axis=0, return_inverse=True,
+                                          return_counts=True)
+    inverse = inverse.ravel()
+    overlapping = get_genre_overlap(distinct[:, None],
+                                    distinct[None]) >= genre_overlap
+    num_genre = (overlapping * counts[None]).sum(axis=1)[inverse]
+
+    # titles of the same director are relevant even when their genres differ
+    directed = np.flatnonzero(directors >= 0)
+    num_director = np.zeros(len(directors), dtype=np.int64)
+    num_director[directed] = \
+        np.bincount(directors[directed])[directors[directed]]
+
+    # the titles of a director are grouped by genres too, the pairs of groups
+    # of a director telling the titles relevant both ways
+    groups = (directors[directed].astype(np.int64) * len(distinct)
+              + inverse[directed])
+    keys, group_inverse, group_counts = np.unique(
+        groups, return_inverse=True, return_counts=True)
+    group_directors, group_masks = keys // len(distinct), keys % len(distinct)
+    starts = np.flatnonzero(np.r_[True, np.diff(group_directors) != 0])
+    sizes = np.diff(np.r_[starts, len(keys)])
+    num_pairs = np.repeat(sizes, sizes)
+    left = np.repeat(np.arange(len(keys)), num_pairs)
+    right = np.repeat(np.repeat(starts, sizes), num_pairs) + \
+        np.arange(len(left)) - \
+        np.repeat(np.cumsum(num_pairs) - num_pairs, num_pairs)
+    both = overlapping[group_masks[left], group_masks[right]]
+    num_both = np.zeros(len(directors), dtype=np.int64)
+    group_both = np.bincount(left[both], weights=group_counts[right[both]],
+                             minlength=len(keys)).astype(np.int64)
+    num_both[directed] = group_both[group_inverse.ravel()]
+
+    # a title always overlaps its own genres and shares its own director
+    if genre_overlap > 0:
+        is_own = (get_popcount(masks) > 0).astype(np.int64)
+    else:
+        is_own = np.ones(len(masks), dtype=np.int64)
+    num_relevant = num_genre + num_director - num_both
+    num_relevant -= np.where(directors >= 0, 1, is_own)
+
+    return num_relevant
+
+'''
+Function to score the recommendations of a batch of titles, every metric
+computed over the whole batch at once
+'''
+def score_batch(relevance, rows, recommended, num_relevant,
+                genre_overlap=GENRE_OVERLAP):
+    directors, masks = relevance['directors'], relevance['masks']
+    k = recommended.shape[1]
+    valid = (recommended >= 0) & (recommended != rows[:, None])
+    safe = np.where(valid, recommended, 0)
+
+    own_directors = directors[rows][:, None]
+    same_director = (directors[safe] == own_directors) & (own_directors >= 0)
+    overlap = get_genre_overlap(masks[safe], masks[rows][:, None])
+    relevant = valid & (same_director | (overlap >= genre_overlap))
+
+    # recall against the relevant titles that fit in the list, so a perfect
+    # list scores 1
+    num_hits = relevant.sum(axis=1)
+    ideal_hits = np.minimum(num_relevant[rows], k)
+    scored = ideal_hits > 0
+    recall = np.where(scored, num_hits / np.maximum(ideal_hits, 1), np.nan)
+
+    discounts = 1 / np.log2(np.arange(k) + 2)
+    ideal = np.r_[0, np.cumsum(discounts)][ideal_hits]
+    gains = (relevant * discounts).sum(axis=1)
+    ndcg = np.where(scored, gains / np.maximum(ideal, 1e-12), np.nan)
+
+    # intra-list diversity, the mean genre distance of every pair of
+    # recommended titles
+    pair_masks = masks[safe]
+    distances = 1 - get_genre_overlap(pair_masks[:, :, None],
+                                      pair_masks[:, None, :])
+    pairs = valid[:, :, None] & valid[:, None, :] & ~np.eye(k, dtype=bool)
+    num_pairs = pairs.sum(axis=(1, 2))
+    total = (distances * pairs).sum(axis=(1, 2))
+    diversity = np.where(num_pairs > 0, total / np.maximum(num_pairs, 1),
+                         np.nan)
+
+    return recall, ndcg, diversity, np.unique(recommended[valid])
+
+'''
+Function to load the relevance proxies and the recommender once in every
+worker process
+'''
+def init_worker(relevance, num_relevant, recommend, k, genre_overlap):
+    # a recommender loaded lazily is loaded here, outside of the timed calls
+    if hasattr(recommend, 'load'):
+        recommend.load()
+    WORKER.update(relevance=relevance, num_relevant=num_relevant,
+                  recommend=recommend, k=k, genre_overlap=genre_overlap)
+
+'''
+Function to run the recommender over a batch of titles in a worker process,
+timing every call
+'''
+def evaluate_batch(rows):
+    relevance, recommend = WORKER['relevance'], WORKER['recommend']
+    k = WORKER['k']
+    uids = relevance['uids']
+
+    results = []
+    latencies = np.zeros(len(rows))
+    for i, uid in enumerate(uids[rows]):
+        begin = time.perf_counter()
+        results.append(list(recommend(uid, k))[:k])
+        latencies[i] = time.perf_counter() - begin
+
+    # the recommended uids are turned into rows in one lookup, -1 for the
+    # unknown ones and the padding
+    lengths = np.array([len(result) for result in results])
+    flat = uids.get_indexer(pd.Index(
+        [uid for result in results for uid in result], dtype=object))
+    recommended = np.full((len(rows), k), -1, dtype=np.int64)
+    recommended[np.arange(k)[None] < lengths[:, None]] = flat
+
+    recall, ndcg, diversity, seen = score_batch(
+        relevance, rows, recommended, WORKER['num_relevant'],
+        WORKER['genre_overlap'])
+    return recall, ndcg, diversity, seen, latencies
+
+'''
+Function to evaluate a recommender, a picklable recommend(uid, k) returning
+ranked uids, over the catalog
+'''
+def evaluate(df, recommend, k=NUM_RECOMMENDATIONS, num_queries=None,
+             batch_size=BATCH_SIZE, genre_overlap=GENRE_OVERLAP,
+             num_workers=None, seed=0):
+    relevance = get_relevance(df)
+    num_relevant = get_relevant_counts(relevance, genre_overlap)
+    num_titles = len(relevance['uids'])
+
+    rows = np.arange(num_titles)
+    if num_queries and num_queries < num_titles:
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(num_titles, num_queries, replace=False))
+    batches = [rows[start:start + batch_size]
+               for start in range(0, len(rows), batch_size)]
+
+    num_workers = num_workers or os.cpu_count()
+    begin = time.perf_counter()
+    initargs = (relevance, num_relevant, recommend, k, genre_overlap)
+    with ProcessPoolExecutor(num_workers, initializer=init_worker,
+                             initargs=initargs) as executor:
+        results = list(executor.map(evaluate_batch, batches))
+    seconds = time.perf_counter() - begin
+
+    recall, ndcg, diversity, seen, latencies = (
+        np.concatenate(arrays) for arrays in zip(*results))
+    latencies *= 1e6
+    # queries without a relevant title or a pair of recommendations are left
+    # out of the means
+    scored = ~np.isnan(recall)
+    diverse = ~np.isnan(diversity)
+
+    return {
+        'k': k,
+        'queries': len(rows),
+        'titles': num_titles,
+        'scored_queries': int(scored.sum()),
+        'recall': (float(recall[scored].mean()) if scored.any()
+                   else float('nan')),
+        'ndcg': float(ndcg[scored].mean()) if scored.any() else float('nan'),
+        'coverage': len(np.unique(seen)) / max(num_titles, 1),
+        'diversity': (float(diversity[diverse].mean()) if diverse.any()
+                      else float('nan')),
+        'latency_us': {'p%d' % q: float(np.percentile(latencies, q))
+                       for q in PERCENTILES},
+        'queries_per_second': len(rows) / seconds,
+        'workers': num_workers,
+    }
+
+'''
+Class to recommend from the neighbor table, loaded lazily so that it is cheap
+to send to the workers
+'''
+class NeighborRecommender:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.recommender = None
+
+    def __getstate__(self):
+        return {'directory': self.directory, 'recommender': None}
+
+    def load(self):
+        if self.recommender is None:
+            self.recommender = Recommender.load(self.directory)
+
+    def __call__(self, uid, k):
+        self.load()
+        return [neighbor
+                for neighbor, _ in self.recommender.recommend(uid, k)]
+
+'''
+Class to recommend the most voted titles to everyone, the baseline a model
+has to beat
+'''
+class PopularityRecommender:
+
+    def __init__(self, df, k=NUM_RECOMMENDATIONS):
+        popular = df.sort_values('num_votes', ascending=False, kind='stable')
+        self.uids = popular['uid'].head(k + 1).tolist()
+
+    def __call__(self, uid, k):
+        return [popular for popular in self.uids if popular != uid][:k]
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('neighbors_filepath', type=click.Path(exists=True))
+@click.option('--k', default=NUM_RECOMMENDATIONS)
+@click.option('--num-queries', default=0,
+              help='0 evaluates every title of the catalog')
+@click.option('--batch-size', default=BATCH_SIZE)
+@click.option('--genre-overlap', default=GENRE_OVERLAP)
+@click.option('--workers', default=0, help='0 uses every core')
+@click.option('--results-dir', default=RESULTS_DIR, type=click.Path())
+def main(input_filepath, neighbors_filepath, k, num_queries, batch_size,
+         genre_overlap, workers, results_dir):
+    """ Evaluates the neighbor table in NEIGHBORS_FILEPATH over the processed
+        movies in INPUT_FILEPATH, next to the most voted titles as a baseline.
+    """
+    df = read_movies(input_filepath)
+    models = {
+        'neighbors': NeighborRecommender(neighbors_filepath),
+        'popularity': PopularityRecommender(df, k),
+    }
+
+    results = {}
+    for name, recommend in models.items():
+        results[name] = evaluate(df, recommend, k, num_queries or None,
+                                 batch_size, genre_overlap, workers or None)
+        scores = results[name]
+        LOGGER.info('%s: recall@%d %.3f, ndcg@%d %.3f, coverage %.3f, '
+                    'diversity %.3f, p50 %.0fus, p99 %.0fus'
+                    % (name, k, scores['recall'], k, scores['ndcg'],
+                       scores['coverage'], scores['diversity'],
+                       scores['latency_us']['p50'],
+                       scores['latency_us']['p99']))
+
+    results_dir = Path(results_dir)
+    results_dir.mkdir(parents=True, exist_ok=True)
+    with open(results_dir / 'latest.json', 'w') as f:
+        json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import click
+import logging
+import numpy as np
+import scipy.sparse as sp
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.data.raw_store import read_movies, RAW_STORE_DIR
+from src.features.build_features import BLOCK_WEIGHTS, normalize_rows
+from src.models.train_model import (get_block_neighbors, get_block_size,
+                                    NUM_NEIGHBORS)
+
+'''Columns of the numeric block, the first columns of every row'''
+NUMERIC_COLUMNS = ['year', 'runtime', 'rating', 'log_votes']
+
+'''Fraction of removed rows past which the index is compacted'''
+MAX_REMOVED_FRACTION = 0.25
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to get the numeric values of the records, 0 when missing'''
+def get_numeric_values(df):
+    return np.column_stack([
+        df['year'].to_numpy(dtype=np.float64),
+        df['runtime'].to_numpy(dtype=np.float64),
+        df['rating'].to_numpy(dtype=np.float64),
+        np.log1p(df['num_votes'].to_numpy(dtype=np.float64)),
+    ])
+
+'''Class to keep item-item neighbors up to date as new titles are scraped'''
+class IncrementalIndex:
+
+    def __init__(self, k=NUM_NEIGHBORS, weights=BLOCK_WEIGHTS):
+        self.k = k
+        self.weights = weights
+        # columns are only ever appended, so encoded rows stay valid
+        self.vocabulary = {}
+        self.uids = []
+        self.rows = {}
+        self.matrix = sp.csr_matrix((0, len(NUMERIC_COLUMNS)),
+                                    dtype=np.float32)
+        self.alive = np.zeros(0, dtype=bool)
+        self.indices = np.zeros((0, k), dtype=np.int32)
+        self.scores = np.zeros((0, k), dtype=np.float32)
+        self.mean = None
+        self.std = None
+
+    def get_column(self, feature):
+        column = self.vocabulary.get(feature)
+        if column is None:
+            column = len(NUMERIC_COLUMNS) + len(self.vocabulary)
+            self.vocabulary[feature] = column
+        return column
+
+    def encode(self, df):
+        '''
+        Encodes the records into unit length rows, growing the vocabulary with
+        unseen values
+        '''
+        values = get_numeric_values(df)
+        # the scaling is frozen at the first fit so earlier rows never change
+        if self.mean is None:
+            present = values > 0
+            counts = np.maximum(present.sum(axis=0), 1)
+            self.mean = np.where(present, values, 0).sum(axis=0) / counts
+            squares = np.where(present, (values - self.mean) ** 2, 0)
+            self.std = np.sqrt(squares.sum(axis=0) / counts)
+            self.std[self.std == 0] = 1.0
+        numeric = np.where(values > 0, (values - self.mean) / self.std, 0.0)
+        numeric /= np.sqrt(len(NUMERIC_COLUMNS))
+
+        blocks = {name: ([], []) for name in ['genre', 'director', 'stars']}
+        columns = zip(df['genre'], df['director'], df['stars'])
+        for row, (genres, director, stars) in enumerate(columns):
+            for genre in genres:
+                blocks['genre'][0].append(row)
+                blocks['genre'][1].append(self.get_column('genre=' + genre))
+            if director:
+                blocks['director'][0].append(row)
+                blocks['director'][1].append(
+                    self.get_column('director=' + director))
+            for star in stars:
+                blocks['stars'][0].append(row)
+                blocks['stars'][1].append(self.get_column('star=' + star))
+
+        num_columns = len(NUMERIC_COLUMNS) + len(self.vocabulary)
+        matrix = sp.csr_matrix(self.weights['numeric'] * numeric)
+        matrix.resize((len(df), num_columns))
+        for name, (rows, columns) in blocks.items():
+            block = sp.csr_matrix((np.ones(len(rows)), (rows, columns)),
+                                  shape=(len(df), num_columns))
+            block.data[:] = 1.0
+            matrix = matrix + self.weights[name] * normalize_rows(block)
+
+        return normalize_rows(matrix.tocsr()).astype(np.float32)
+
+    def resize(self):
+        '''Widens the stored rows to the vocabulary, appending empty columns'''
+        num_columns = len(NUMERIC_COLUMNS) + len(self.vocabulary)
+        if self.matrix.shape[1] < num_columns:
+            self.matrix.resize((self.matrix.shape[0], num_columns))
+
+    def fit(self, df):
+        '''Encodes the catalog and computes the neighbors of every title'''
+        begin = time.perf_counter()
+        df = df.drop_duplicates(subset='uid', keep='last')
+        df = df.reset_index(drop=True)
+
+        self.uids = df['uid'].tolist()
+        self.rows = {uid: row for row, uid in enumerate(self.uids)}
+        self.matrix = self.encode(df)
+        self.alive = np.ones(len(df), dtype=bool)
+
+        num_rows = len(df)
+        # a single title gets an empty list, see get_block_neighbors
+        k = min(self.k, max(num_rows - 1, 0))
+        self.indices = np.full((num_rows, self.k), -1, dtype=np.int32)
+        self.scores = np.full((num_rows, self.k), -np.inf, dtype=np.float32)
+        transpose = self.matrix.T.tocsr()
+        block_size = get_block_size(num_rows)
+        for start in range(0, num_rows, block_size):
+            stop = min(start + block_size, num_rows)
+            indices, scores = get_block_neighbors(self.matrix, transpose,
+                                                  start, stop, k)
+            self.indices[start:stop, :indices.shape[1]] = indices
+            self.scores[start:stop, :scores.shape[1]] = scores
+
+        LOGGER.info('fitted %d titles in %.2fs'
+                    % (num_rows, time.perf_counter() - begin))
+        return self
+
+    def get_similarities(self, rows):
+        '''
+        Returns the similarities of the rows with every title, -inf for
+        removed titles
+        '''
+        similarities = (self.matrix[rows] @ self.matrix.T).toarray()
+        similarities[:, ~self.alive] = -np.inf
+        similarities[np.arange(len(rows)), rows] = -np.inf
+        return similarities
+
+    def get_top_neighbors(self, similarities):
+        k = min(self.k, similarities.shape[1])
+        indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(similarities, indices, axis=1)
+        order = np.argsort(-scores, axis=1, kind='stable')
+
+        indices = np.take_along_axis(indices, order, axis=1).astype(np.int32)
+        scores = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+        indices[~np.isfinite(scores)] = -1
+        return indices, scores
+
+    def update(self, df):
+        '''
+        Adds new titles and re-encodes changed ones, then patches only the
+        neighbor lists they affect. Returns the number of rows touched.
+        '''
+        begin = time.perf_counter()
+        df = df.drop_duplicates(subset='uid', keep='last')
+        df = df.reset_index(drop=True)
+        encoded = self.encode(df)
+        self.resize()
+
+        # unchanged titles are skipped, changed ones get a new row and the old
+        # one is removed
+        keep = []
+        removed = []
+        for position, uid in enumerate(df['uid']):
+            row = self.rows.get(uid)
+            if row is not None:
+                old = self.matrix[row]
+                new = encoded[position]
+                new.resize(old.shape)
+                if (old != new).nnz == 0:
+                    continue
+                removed.append(row)
+            keep.append(position)
+
+        if not keep:
+            LOGGER.info('no new or changed titles')
+            return 0
+
+        first = self.matrix.shape[0]
+        new_rows = np.arange(first, first + len(keep))
+        added = encoded[keep]
+        added.resize((len(keep), self.matrix.shape[1]))
+        self.matrix = sp.vstack([self.matrix, added], format='csr')
+        self.alive = np.concatenate([self.alive,
+                                     np.ones(len(keep), dtype=bool)])
+        self.alive[removed] = False
+        for row, position in zip(new_rows, keep):
+            uid = df['uid'].iat[position]
+            if uid in self.rows:
+                self.uids[self.rows[uid]] = None
+            self.rows[uid] = row
+            self.uids.append(uid)
+
+        # neighbors of the new rows against the whole catalog
+        similarities = self.get_similarities(new_rows)
+        indices, scores = self.get_top_neighbors(similarities)
+        self.indices = np.vstack(
+            [self.indices, np.full((len(keep), self.k), -1, dtype=np.int32)])
+        self.scores = np.vstack(
+            [self.scores,
+             np.full((len(keep), self.k), -np.inf, dtype=np.float32)])
+        self.indices[new_rows, :indices.shape[1]] = indices
+        self.scores[new_rows, :scores.shape[1]] = scores
+
+        # titles whose list held a removed row are recomputed
+        stale = np.isin(self.indices, removed).any(axis=1) & self.alive
+        stale = np.flatnonzero(stale)
+        stale = np.setdiff1d(stale, new_rows)
+        if len(stale):
+            indices, scores = self.get_top_neighbors(
+                self.get_similarities(stale))
+            self.indices[stale, :indices.shape[1]] = indices
+            self.scores[stale, :scores.shape[1]] = scores
+
+        # the new rows enter the lists of the titles they beat
+        for new_row, row_similarities in zip(new_rows, similarities):
+            row_similarities = row_similarities[:first]
+            beaten = np.flatnonzero(row_similarities > self.scores[:first, -1])
+            beaten = beaten[self.alive[beaten] & ~np.isin(beaten, stale)]
+            if not len(beaten):
+                continue
+            indices = np.column_stack([self.indices[beaten],
+                                       np.full(len(beaten), new_row)])
+            scores = np.column_stack([self.scores[beaten],
+                                      row_similarities[beaten]])
+            order = np.argsort(-scores, axis=1, kind='stable')[:, :self.k]
+            self.indices[beaten] = np.take_along_axis(indices, order, axis=1)
+            self.scores[beaten] = np.take_along_axis(scores, order, axis=1)
+
+        LOGGER.info('%d titles added or changed, %d lists recomputed in %.2fs'
+                    % (len(keep), len(stale), time.perf_counter() - begin))
+
+        # every change leaves a removed row behind, so they are dropped once
+        # they pile up
+        if (~self.alive).sum() > MAX_REMOVED_FRACTION * len(self.alive):
+            self.compact()
+        return len(keep)
+
+    def compact(self):
+        '''
+        Drops the removed rows, renumbering the rows left and their neighbor
+        lists
+        '''
+        num_removed = int((~self.alive).sum())
+        # removed rows map to -1, which is also the empty slot of the lists
+        mapping = np.full(len(self.alive) + 1, -1, dtype=np.int32)
+        mapping[:-1][self.alive] = np.arange(self.alive.sum(), dtype=np.int32)
+
+        self.matrix = self.matrix[self.alive]
+        self.indices = mapping[self.indices[self.alive]]
+        self.scores = self.scores[self.alive]
+        self.uids = [uid for uid in self.uids if uid is not None]
+        self.rows = {uid: row for row, uid in enumerate(self.uids)}
+        self.alive = np.ones(len(self.uids), dtype=bool)
+
+        LOGGER.info('%d removed rows compacted, %d titles left'
+                    % (num_removed, len(self.uids)))
+
+    def recommend(self, uid, n=10):
+        row = self.rows.get(uid)
+        if row is None:
+            return []
+
+        return [(self.uids[neighbor], float(score))
+                for neighbor, score in zip(self.indices[row, :n],
+                                           self.scores[row, :n])
+                if neighbor >= 0]
+
+    def save(self, directory):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        matrix = self.matrix.tocsr()
+        np.savez(directory / 'index.npz', data=matrix.data,
+                 indices=matrix.indices, indptr=matrix.indptr,
+                 shape=matrix.shape, alive=self.alive, neighbors=self.indices,
+                 scores=self.scores, mean=self.mean, std=self.std)
+        with open(directory / 'index.json', 'w') as f:
+            json.dump({'k': self.k, 'weights': self.weights,
+                       'uids': self.uids,
+                       'vocabulary': self.vocabulary}, f)
+
+    @classmethod
+    def load(cls, directory):
+        directory = Path(directory)
+        with open(directory / 'index.json') as f:
+            meta = json.load(f)
+        arrays = np.load(directory / 'index.npz')
+
+        index = cls(meta['k'], meta['weights'])
+        index.vocabulary = meta['vocabulary']
+        index.uids = meta['uids']
+        index.rows = {uid: row for row, uid in enumerate(index.uids)
+                      if uid is not None}
+        index.matrix = sp.csr_matrix(
+            (arrays['data'], arrays['indices'], arrays['indptr']),
+            shape=tuple(arrays['shape']))
+        index.alive = arrays['alive']
+        index.indices = arrays['neighbors']
+        index.scores = arrays['scores']
+        index.mean = arrays['mean']
+        index.std = arrays['std']
+
+        return index
+
+@click.command()
+@click.argument('index_filepath', type=click.Path())
+@click.option('--raw', 'raw_filepath', default=RAW_STORE_DIR,
+              type=click.Path(exists=True))
+@click.option('--since', default=None,
+              help='Only the scrapes from this date on (YYYY-MM-DD)')
+@click.option('--k', default=NUM_NEIGHBORS)
+def main(index_filepath, raw_filepath, since, k):
+    """ Updates the incremental index in INDEX_FILEPATH with the movies scraped
+        since a date, creating it from every scrape when it does not exist.
+    """
+    filters = [('scrape_date', '>=', since)] if since else None
+    df = read_movies(raw_filepath, filters=filters)
+    df['genre'] = df['genre'].map(list)
+    df['stars'] = df['stars'].map(list)
+
+    if (Path(index_filepath) / 'index.json').is_file():
+        index = IncrementalIndex.load(index_filepath)
+        index.update(df)
+    else:
+        index = IncrementalIndex(k).fit(df)
+    index.save(index_filepath)
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
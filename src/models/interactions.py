@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import click
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+'''Columns of the interaction logs'''
+INTERACTION_COLUMNS = ['user', 'uid', 'count']
+
+'''Number of taste clusters of the synthetic users and titles'''
+NUM_CLUSTERS = 50
+
+'''Share of the synthetic interactions picked inside the user's cluster'''
+CLUSTER_SHARE = 0.8
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to read the interaction logs, a csv or a parquet file of user, uid
+and count
+'''
+def read_interactions(filepath):
+    filepath = Path(filepath)
+    if filepath.suffix == '.parquet':
+        df = pd.read_parquet(filepath, columns=INTERACTION_COLUMNS)
+    else:
+        df = pd.read_csv(filepath, usecols=INTERACTION_COLUMNS,
+                         dtype={'user': str, 'uid': str})
+
+    return df
+
+'''
+Function to build the sparse user x title matrix, repeated interactions being
+summed
+'''
+def get_interaction_matrix(df):
+    users, user_rows = np.unique(df['user'].to_numpy(), return_inverse=True)
+    uids, item_columns = np.unique(df['uid'].to_numpy(), return_inverse=True)
+    counts = df['count'].to_numpy(dtype=np.float32)
+    matrix = sp.csr_matrix((counts, (user_rows, item_columns)),
+                           shape=(len(users), len(uids)), dtype=np.float32)
+    matrix.sum_duplicates()
+
+    return matrix, users, uids
+
+'''
+Function to make up interaction logs where users mostly play titles of their
+own taste cluster
+'''
+def generate_interactions(uids, num_users, interactions_per_user=20,
+                          num_clusters=NUM_CLUSTERS,
+                          cluster_share=CLUSTER_SHARE, seed=0):
+    rng = np.random.default_rng(seed)
+    num_items = len(uids)
+    num_interactions = num_users * interactions_per_user
+
+    # titles have a popularity drawn from a long tail and a taste cluster
+    popularity = rng.pareto(1.2, num_items) + 1e-3
+    item_clusters = rng.integers(0, num_clusters, num_items)
+    order = np.argsort(item_clusters, kind='stable')
+    cluster_starts = np.searchsorted(item_clusters[order],
+                                     np.arange(num_clusters + 1))
+
+    users = np.repeat(np.arange(num_users), interactions_per_user)
+    user_clusters = rng.integers(0, num_clusters, num_users)[users]
+
+    # global picks follow the popularity over the whole catalog
+    cumulative = np.cumsum(popularity)
+    items = np.searchsorted(cumulative,
+                            rng.uniform(0, cumulative[-1], num_interactions))
+
+    # cluster picks follow the popularity inside the cluster of the user
+    in_cluster = rng.random(num_interactions) < cluster_share
+    cluster_cumulative = np.cumsum(popularity[order])
+    starts = cluster_starts[user_clusters[in_cluster]]
+    stops = cluster_starts[user_clusters[in_cluster] + 1]
+    filled = stops > starts
+    low = np.where(starts > 0, cluster_cumulative[np.maximum(starts - 1, 0)],
+                   0.0)
+    high = cluster_cumulative[np.maximum(stops - 1, 0)]
+    picks = np.searchsorted(cluster_cumulative, rng.uniform(low, high))
+    picks = np.clip(picks, starts, np.maximum(stops - 1, starts))
+    items[np.flatnonzero(in_cluster)[filled]] = order[picks[filled]]
+
+    df = pd.DataFrame({
+        'user': np.char.add('u', users.astype(str)),
+        'uid': np.asarray(uids)[items],
+        'count': rng.geometric(0.5, num_interactions).astype(np.int32),
+    })
+
+    grouped = df.groupby(['user', 'uid'], as_index=False, sort=False)
+    return grouped['count'].sum()
+
+@click.command()
+@click.argument('uids_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--users', 'num_users', default=100000)
+@click.option('--per-user', 'interactions_per_user', default=20)
+@click.option('--seed', default=0)
+def main(uids_filepath, output_filepath, num_users, interactions_per_user,
+         seed):
+    """ Makes up interaction logs over the titles in UIDS_FILEPATH (a uids.npy
+        of the features or of the neighbor table) and saves them in
+        OUTPUT_FILEPATH.
+    """
+    uids = np.load(uids_filepath, allow_pickle=False)
+    df = generate_interactions(uids, num_users, interactions_per_user,
+                               seed=seed)
+
+    Path(output_filepath).parent.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(output_filepath, index=False)
+    LOGGER.info('%d interactions of %d users over %d titles saved to %s'
+                % (len(df), num_users, len(uids), output_filepath))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
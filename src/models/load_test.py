@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import click
+import asyncio
+import logging
+import numpy as np
+from pathlib import Path
+from dotenv import find_dotenv, load_dotenv
+
+from src.models.predict_model import get_percentiles
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Coroutine to send a GET over a kept-alive connection and read the JSON
+answer
+'''
+async def get(reader, writer, host, path):
+    request = 'GET %s HTTP/1.1\r\nHost: %s\r\n\r\n' % (path, host)
+    writer.write(request.encode('ascii'))
+    await writer.drain()
+
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')[1:]
+    headers = dict(line.lower().split(': ', 1)
+                   for line in lines if ': ' in line)
+    body = await reader.readexactly(int(headers['content-length']))
+
+    return json.loads(body)
+
+'''Coroutine of a single client sending its share of the requests'''
+async def run_client(host, port, uids, n, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for uid in uids:
+            begin = time.perf_counter()
+            await get(reader, writer, host,
+                      '/recommend?uid=%s&n=%d' % (uid, n))
+            latencies.append(time.perf_counter() - begin)
+    finally:
+        writer.close()
+
+'''
+Coroutine to load the service with concurrent clients and collect its
+metrics
+'''
+async def run_load(host, port, uids, concurrency, n=10):
+    latencies = []
+    begin = time.perf_counter()
+    await asyncio.gather(*[
+        run_client(host, port, uids[client::concurrency], n, latencies)
+        for client in range(concurrency)
+    ])
+    seconds = time.perf_counter() - begin
+
+    reader, writer = await asyncio.open_connection(host, port)
+    metrics = await get(reader, writer, host, '/metrics')
+    writer.close()
+
+    return {
+        'requests': len(latencies),
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds,
+        'client_latency': get_percentiles(latencies),
+        'server_metrics': metrics,
+    }
+
+'''
+Function to draw the requested uids, a few popular titles get most of the
+requests
+'''
+def get_request_uids(uids, num_requests, skew=1.2, seed=0):
+    rng = np.random.default_rng(seed)
+    ranks = np.minimum(rng.zipf(skew, num_requests) - 1, len(uids) - 1)
+    order = rng.permutation(len(uids))
+    return [str(uid) for uid in np.asarray(uids)[order[ranks]]]
+
+@click.command()
+@click.argument('neighbors_filepath', type=click.Path(exists=True))
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+@click.option('--requests', 'num_requests', default=20000)
+@click.option('--concurrency', default=64)
+@click.option('--skew', default=1.2,
+              help='Zipf exponent of the title popularity')
+def main(neighbors_filepath, host, port, num_requests, concurrency, skew):
+    """ Loads the recommendation service with requests for the titles of
+        the neighbor table in NEIGHBORS_FILEPATH.
+    """
+    uids = np.load(Path(neighbors_filepath) / 'uids.npy', mmap_mode='r')
+    request_uids = get_request_uids(uids, num_requests, skew)
+
+    results = asyncio.run(run_load(host, port, request_uids, concurrency))
+    LOGGER.info('%d requests in %.2fs (%.0f req/s), client p50 %.0fus, '
+                'p99 %.0fus' % (
+                    results['requests'], results['seconds'],
+                    results['requests_per_second'],
+                    results['client_latency']['p50_us'],
+                    results['client_latency']['p99_us']))
+    LOGGER.info('server metrics: %s' % json.dumps(results['server_metrics']))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
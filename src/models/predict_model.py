@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+import click
+import asyncio
+import logging
+import contextlib
+import collections
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+from dotenv import find_dotenv, load_dotenv
+
+from src.models.train_model import (train_neighbors, save_neighbors,
+                                    NUM_NEIGHBORS)
+
+'''Number of recommendations returned by default'''
+NUM_RECOMMENDATIONS = 10
+
+'''Number of results kept by the service cache'''
+CACHE_SIZE = 100000
+
+'''Seconds a cached result is served before it is computed again'''
+CACHE_TTL = 300
+
+'''Seconds the service waits to gather concurrent lookups into one batch'''
+BATCH_WINDOW = 0.001
+
+'''Maximum number of lookups answered by a single batch'''
+MAX_BATCH = 1024
+
+'''Number of latest request latencies kept to compute the percentiles'''
+LATENCY_WINDOW = 10000
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to convert uids such as tt1234567 into their numbers, -1 when
+invalid
+'''
+def get_uid_numbers(uids):
+    uids = pd.Series(np.asarray(uids, dtype=object))
+    numbers = pd.to_numeric(uids.str.slice(2), errors='coerce')
+    return numbers.fillna(-1).to_numpy(dtype=np.int64)
+
+'''Class to answer "titles like this one" from a precomputed neighbor table'''
+class Recommender:
+
+    def __init__(self, uids, indices, scores):
+        self.uids = uids
+        self.indices = indices
+        self.scores = scores
+
+        # dense index from the uid number straight to its row
+        numbers = get_uid_numbers(uids)
+        size = numbers.max() + 1 if len(numbers) else 0
+        self.rows = np.full(size, -1, dtype=np.int32)
+        self.rows[numbers] = np.arange(len(numbers), dtype=np.int32)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        '''Loads the neighbor table saved by train_model, memory-mapping it'''
+        directory = Path(directory)
+        mmap_mode = 'r' if mmap else None
+
+        return cls(np.load(directory / 'uids.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'indices.npy', mmap_mode=mmap_mode),
+                   np.load(directory / 'scores.npy', mmap_mode=mmap_mode))
+
+    @classmethod
+    def build(cls, features_directory, directory, k=NUM_NEIGHBORS,
+              num_workers=None):
+        '''Trains the neighbor table from the saved features, then loads it'''
+        uids, indices, scores, timings = train_neighbors(
+            features_directory, k, num_workers)
+        save_neighbors(directory, uids, indices, scores, timings)
+
+        return cls.load(directory)
+
+    def get_rows(self, uids):
+        '''Returns the row of every uid, -1 for the uids not in the catalog'''
+        numbers = get_uid_numbers(uids)
+        known = (numbers >= 0) & (numbers < len(self.rows))
+        rows = np.full(len(numbers), -1, dtype=np.int32)
+        rows[known] = self.rows[numbers[known]]
+
+        return rows
+
+    def get_row(self, uid):
+        try:
+            number = int(uid[2:])
+        except ValueError:
+            return -1
+
+        return int(self.rows[number]) if 0 <= number < len(self.rows) else -1
+
+    def recommend(self, uid, n=NUM_RECOMMENDATIONS):
+        '''Returns the n titles most similar to the uid, (uid, score) pairs'''
+        # a negative n would slice the neighbors from the end
+        if n < 1:
+            raise ValueError('n must be at least 1, got %d' % n)
+        row = self.get_row(uid)
+        if row < 0:
+            return []
+
+        neighbors = self.indices[row, :n]
+        return list(zip(self.uids[neighbors].tolist(),
+                        self.scores[row, :n].tolist()))
+
+    def recommend_batch(self, uids, n=NUM_RECOMMENDATIONS):
+        '''
+        Returns the recommended uids and their scores as two len(uids) x n
+        arrays, the rows of unknown uids are left empty with a nan score.
+        '''
+        if n < 1:
+            raise ValueError('n must be at least 1, got %d' % n)
+        rows = self.get_rows(uids)
+        known = rows >= 0
+        n = min(n, self.indices.shape[1])
+
+        neighbors = self.indices[rows[known], :n]
+        recommendations = np.full((len(rows), n), '', dtype=self.uids.dtype)
+        scores = np.full((len(rows), n), np.nan, dtype=np.float32)
+        recommendations[known] = self.uids[neighbors]
+        scores[known] = self.scores[rows[known], :n]
+
+        return recommendations, scores
+
+'''
+Class to keep the latest results for a while, evicting the least recently
+used
+'''
+class ResultCache:
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        if expires < time.monotonic():
+            del self.entries[key]
+            return None
+
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+'''
+Class to answer concurrent lookups with a cache, request coalescing and
+micro-batching
+'''
+class RecommendationService:
+
+    def __init__(self, recommender, cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH):
+        self.recommender = recommender
+        self.cache = ResultCache(cache_size, cache_ttl)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.in_flight = {}
+        self.queue = None
+        self.batcher = None
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.counters = collections.Counter()
+
+    def warm_up(self):
+        '''
+        Reads the memory-mapped tables once so the first requests do not fault
+        them in
+        '''
+        begin = time.perf_counter()
+        recommender = self.recommender
+        for array in [recommender.uids, recommender.indices,
+                      recommender.scores]:
+            np.asarray(array).view(np.uint8).reshape(-1)[::4096].sum()
+        uids = np.asarray(recommender.uids[:self.max_batch]).tolist()
+        recommender.recommend_batch(uids)
+        LOGGER.info('indexes warmed up in %.2fs'
+                    % (time.perf_counter() - begin))
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.batcher = asyncio.create_task(self.run_batcher())
+
+    async def stop(self):
+        '''Stops the batcher, failing the lookups still queued or in a batch'''
+        self.batcher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self.batcher
+
+        error = RuntimeError('the recommendation service stopped')
+        while not self.queue.empty():
+            _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(error)
+        # a batch taken off the queue is only left in flight
+        for future in self.in_flight.values():
+            if not future.done():
+                future.set_exception(error)
+        self.in_flight.clear()
+
+    async def run_batcher(self):
+        while True:
+            batch = [await self.queue.get()]
+            deadline = time.monotonic() + self.batch_window
+
+            # lookups arriving within the window share one vectorized call
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(),
+                                                        timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            n = max(key[1] for key, _ in batch)
+            try:
+                recommendations, scores = self.recommender.recommend_batch(
+                    [key[0] for key, _ in batch], n)
+            except Exception as error:
+                # the waiting requests fail, the batcher keeps serving the next
+                # ones
+                LOGGER.exception('batch of %d lookups failed' % len(batch))
+                self.counters['failed_batches'] += 1
+                for key, future in batch:
+                    self.in_flight.pop(key, None)
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            self.counters['batches'] += 1
+            self.counters['batched_lookups'] += len(batch)
+
+            for row, (key, future) in enumerate(batch):
+                pairs = zip(recommendations[row, :key[1]].tolist(),
+                            scores[row, :key[1]].tolist())
+                result = [{'uid': uid, 'score': float(score)}
+                          for uid, score in pairs if uid]
+                self.cache.put(key, result)
+                self.in_flight.pop(key, None)
+                if not future.done():
+                    future.set_result(result)
+
+    async def recommend(self, uid, n=NUM_RECOMMENDATIONS):
+        # checked before the batch, where it would fail every lookup it shares
+        if n < 1:
+            raise ValueError('n must be at least 1, got %d' % n)
+        begin = time.perf_counter()
+        key = (uid, n)
+        self.counters['requests'] += 1
+
+        result = self.cache.get(key)
+        if result is not None:
+            self.counters['cache_hits'] += 1
+        else:
+            self.counters['cache_misses'] += 1
+            future = self.in_flight.get(key)
+            # concurrent requests for the same title wait on the same lookup
+            if future is not None:
+                self.counters['coalesced'] += 1
+            else:
+                future = asyncio.get_running_loop().create_future()
+                self.in_flight[key] = future
+                self.queue.put_nowait((key, future))
+            result = await future
+
+        self.latencies.append(time.perf_counter() - begin)
+        return result
+
+    def get_metrics(self):
+        metrics = dict(self.counters)
+        if self.latencies:
+            metrics['latency'] = get_percentiles(self.latencies)
+        lookups = self.counters['cache_hits'] + self.counters['cache_misses']
+        metrics['cache_hit_ratio'] = (self.counters['cache_hits'] / lookups
+                                      if lookups else 0.0)
+        metrics['cache_size'] = len(self.cache.entries)
+        return metrics
+
+'''Function to write a JSON response'''
+async def write_response(writer, status, body, keep_alive=True):
+    payload = json.dumps(body).encode('utf-8')
+    reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+              500: 'Internal Server Error'}[status]
+    connection = 'keep-alive' if keep_alive else 'close'
+    head = ('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\n'
+            'Content-Length: %d\r\nConnection: %s\r\n\r\n'
+            % (status, reason, len(payload), connection))
+    writer.write(head.encode('ascii'))
+    writer.write(payload)
+    await writer.drain()
+
+'''
+Function to get the number of recommendations asked for, None unless an
+integer from 1 to max_n
+'''
+def get_limit(query, max_n):
+    try:
+        n = int(query.get('n', [min(NUM_RECOMMENDATIONS, max_n)])[0])
+    except ValueError:
+        return None
+
+    return n if 1 <= n <= max_n else None
+
+'''Coroutine to answer the requests of a single connection'''
+async def handle_connection(service, reader, writer):
+    try:
+        while True:
+            request = await reader.readuntil(b'\r\n\r\n')
+            lines = request.decode('latin-1').split('\r\n')
+            method, target, _ = (lines[0].split(' ') + ['', ''])[:3]
+            headers = dict(line.lower().split(': ', 1) for line in lines[1:]
+                           if ': ' in line)
+            keep_alive = headers.get('connection') != 'close'
+
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+            if method != 'GET':
+                status, body = 400, {'error': 'only GET is supported'}
+            elif url.path == '/recommend' and 'uid' in query:
+                max_n = service.recommender.indices.shape[1]
+                n = get_limit(query, max_n)
+                uid = query['uid'][0]
+                if n is None:
+                    status, body = 400, {
+                        'error': 'n must be an integer from 1 to %d' % max_n}
+                else:
+                    try:
+                        result = await service.recommend(uid, n)
+                    except ValueError as error:
+                        status, body = 400, {'error': str(error)}
+                    except Exception:
+                        status, body = 500, {'error': 'the lookup failed'}
+                    else:
+                        status, body = 200, {'uid': uid,
+                                             'recommendations': result}
+            elif url.path == '/metrics':
+                status, body = 200, service.get_metrics()
+            else:
+                status, body = 404, {'error': 'not found'}
+            await write_response(writer, status, body, keep_alive)
+
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+'''Coroutine to serve the recommendations over HTTP until cancelled'''
+async def serve(recommender, host='127.0.0.1', port=8000, **options):
+    service = RecommendationService(recommender, **options)
+    service.warm_up()
+    await service.start()
+
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(service, reader, writer),
+        host, port)
+    LOGGER.info('serving recommendations on http://%s:%d' % (host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+'''Function to get the latency percentiles in microseconds'''
+def get_percentiles(seconds):
+    seconds = np.asarray(seconds) * 1e6
+    return {'p50_us': float(np.percentile(seconds, 50)),
+            'p99_us': float(np.percentile(seconds, 99)),
+            'mean_us': float(seconds.mean())}
+
+'''Function to measure the latency of single and batch recommendations'''
+def benchmark_latency(recommender, num_queries=10000, batch_size=1000,
+                      n=NUM_RECOMMENDATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(recommender.uids), num_queries)
+    uids = np.asarray(recommender.uids)[rows].tolist()
+
+    single = []
+    for uid in uids:
+        start = time.perf_counter()
+        recommender.recommend(uid, n)
+        single.append(time.perf_counter() - start)
+
+    batch = []
+    for start in range(0, num_queries, batch_size):
+        begin = time.perf_counter()
+        recommender.recommend_batch(uids[start:start + batch_size], n)
+        batch.append(time.perf_counter() - begin)
+
+    return {
+        'single': get_percentiles(single),
+        'batch': get_percentiles(batch),
+        'batch_per_query_us': float(np.sum(batch) * 1e6 / num_queries),
+    }
+
+@click.command()
+@click.argument('neighbors_filepath', type=click.Path(exists=True))
+@click.argument('uids', nargs=-1)
+@click.option('--n', default=NUM_RECOMMENDATIONS)
+@click.option('--benchmark', is_flag=True, help='Measures the p50/p99 latency')
+@click.option('--serve', 'serve_http', is_flag=True,
+              help='Serves the recommendations over HTTP')
+@click.option('--host', default='127.0.0.1')
+@click.option('--port', default=8000)
+def main(neighbors_filepath, uids, n, benchmark, serve_http, host, port):
+    """ Recommends the titles most like UIDS from the neighbor table in
+        NEIGHBORS_FILEPATH, or serves them over HTTP.
+    """
+    recommender = Recommender.load(neighbors_filepath)
+
+    if serve_http:
+        asyncio.run(serve(recommender, host, port))
+        return
+
+    for uid in uids:
+        pairs = recommender.recommend(uid, n)
+        LOGGER.info('%s: %s'
+                    % (uid, ', '.join('%s (%.3f)' % pair for pair in pairs)))
+
+    if benchmark:
+        results = benchmark_latency(recommender, n=n)
+        LOGGER.info('single: p50 %.1fus, p99 %.1fus'
+                    % (results['single']['p50_us'],
+                       results['single']['p99_us']))
+        LOGGER.info('batch of 1000: p50 %.1fus, p99 %.1fus '
+                    '(%.2fus per query)' % (
+                        results['batch']['p50_us'],
+                        results['batch']['p99_us'],
+                        results['batch_per_query_us']))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import click
+import logging
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import find_dotenv, load_dotenv
+
+from src.models.interactions import read_interactions, get_interaction_matrix
+
+'''Number of latent factors of users and titles'''
+NUM_FACTORS = 64
+
+'''Weight of the L2 penalty on the factors'''
+REGULARIZATION = 0.1
+
+'''Confidence added per interaction, c = 1 + alpha * count'''
+ALPHA = 40.0
+
+'''Number of alternating sweeps over users and titles'''
+NUM_ITERATIONS = 15
+
+'''Bytes of the outer products and normal equations built for a row block'''
+MEMORY_BUDGET = 64 * 1024 ** 2
+
+'''
+Bytes of the outer products of every fixed factor, above it they are built
+per block
+'''
+PRODUCTS_BUDGET = 1024 ** 3
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''
+Function to get the blocks of rows whose normal equations and non-zeros fit
+in the memory budget
+'''
+def get_row_blocks(matrix, num_factors, memory_budget=MEMORY_BUDGET):
+    # every row and every non-zero of a block costs one f x f matrix
+    max_size = max(memory_budget // (num_factors * num_factors * 4), 1)
+    blocks = []
+    start = 0
+    while start < matrix.shape[0]:
+        stop = np.searchsorted(matrix.indptr, matrix.indptr[start] + max_size,
+                               side='right') - 1
+        stop = min(max(stop, start + 1), start + max_size, matrix.shape[0])
+        blocks.append((start, stop))
+        start = stop
+
+    return blocks
+
+'''
+Function to get the flattened outer product of every factor, y y' as a row of
+f * f values
+'''
+def get_outer_products(factors):
+    products = factors[:, :, None] * factors[:, None, :]
+    return products.reshape(len(factors), -1)
+
+'''
+Function to solve the factors of a block of rows against the fixed factors
+of the other side
+'''
+def solve_block(confidence, weights, fixed, gram, products, regularization,
+                start, stop):
+    num_factors = fixed.shape[1]
+    block = weights[start:stop]
+
+    # A_u = Y'Y + Y'(C_u - I)Y + lambda I, the weighted sum of the outer
+    # products of the observed titles
+    shape = (stop - start, num_factors, num_factors)
+    if products is not None:
+        lhs = (block @ products).reshape(shape)
+    else:
+        vectors = fixed[block.indices]
+        weighted = vectors * block.data[:, None]
+        outer = weighted[:, :, None] * vectors[:, None, :]
+        lhs = np.zeros(shape, dtype=np.float32)
+        observed = np.flatnonzero(np.diff(block.indptr))
+        if len(observed):
+            lhs[observed] = np.add.reduceat(outer, block.indptr[observed],
+                                            axis=0)
+    lhs += gram + regularization * np.eye(num_factors, dtype=np.float32)
+
+    # b_u = Y' C_u p_u, every observed preference being 1
+    rhs = confidence[start:stop] @ fixed
+
+    return np.linalg.solve(lhs, rhs[:, :, None])[:, :, 0]
+
+'''Function to solve every row of one side in parallel blocks'''
+def solve_side(confidence, weights, fixed, factors, regularization, blocks,
+               executor):
+    gram = fixed.T @ fixed
+    num_factors = fixed.shape[1]
+    # a sparse product with the outer products replaces the per interaction
+    # ones when they fit
+    products = None
+    if len(fixed) * num_factors * num_factors * 4 <= PRODUCTS_BUDGET:
+        products = get_outer_products(fixed)
+
+    def run(block):
+        start, stop = block
+        factors[start:stop] = solve_block(confidence, weights, fixed, gram,
+                                          products, regularization, start,
+                                          stop)
+
+    # numpy releases the GIL in the products and solves, so the threads share
+    # the cores
+    list(executor.map(run, blocks))
+
+'''Function to train implicit ALS factors of users and titles'''
+def train_als(matrix, num_factors=NUM_FACTORS, regularization=REGULARIZATION,
+              alpha=ALPHA, num_iterations=NUM_ITERATIONS, num_workers=None,
+              seed=0):
+    num_users, num_items = matrix.shape
+    num_workers = num_workers or os.cpu_count()
+
+    confidence = matrix.tocsr().astype(np.float32)
+    confidence.data = 1 + alpha * confidence.data
+    confidence_t = confidence.T.tocsr()
+    # C - I keeps the structure of C with the confidence above the unobserved
+    # baseline
+    weights = confidence.copy()
+    weights.data -= 1
+    weights_t = weights.T.tocsr()
+
+    rng = np.random.default_rng(seed)
+    user_factors = rng.standard_normal((num_users, num_factors)) * 0.01
+    user_factors = user_factors.astype(np.float32)
+    item_factors = rng.standard_normal((num_items, num_factors)) * 0.01
+    item_factors = item_factors.astype(np.float32)
+
+    user_blocks = get_row_blocks(confidence, num_factors)
+    item_blocks = get_row_blocks(confidence_t, num_factors)
+    LOGGER.info('training %d factors of %d users and %d titles '
+                '(%d interactions, %d workers)...'
+                % (num_factors, num_users, num_items, matrix.nnz, num_workers))
+
+    timings = []
+    with ThreadPoolExecutor(num_workers) as executor:
+        for iteration in range(num_iterations):
+            begin = time.perf_counter()
+            solve_side(confidence, weights, item_factors, user_factors,
+                       regularization, user_blocks, executor)
+            solve_side(confidence_t, weights_t, user_factors, item_factors,
+                       regularization, item_blocks, executor)
+            timings.append(time.perf_counter() - begin)
+            LOGGER.info('iteration %d/%d in %.2fs'
+                        % (iteration + 1, num_iterations, timings[-1]))
+
+    return user_factors, item_factors, timings
+
+'''Function to save the factors as float32 arrays that can be memory-mapped'''
+def save_factors(directory, user_factors, item_factors, users, uids,
+                 params=None):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    np.save(directory / 'user_factors.npy',
+            np.ascontiguousarray(user_factors, dtype=np.float32))
+    np.save(directory / 'item_factors.npy',
+            np.ascontiguousarray(item_factors, dtype=np.float32))
+    np.save(directory / 'users.npy', np.asarray(users, dtype=str))
+    np.save(directory / 'uids.npy', np.asarray(uids, dtype='U12'))
+    with open(directory / 'als.json', 'w') as f:
+        json.dump(params or {}, f, indent=2)
+
+'''Function to load the factors, memory-mapped by default'''
+def load_factors(directory, mmap=True):
+    directory = Path(directory)
+    mmap_mode = 'r' if mmap else None
+
+    return (np.load(directory / 'user_factors.npy', mmap_mode=mmap_mode),
+            np.load(directory / 'item_factors.npy', mmap_mode=mmap_mode),
+            np.load(directory / 'users.npy'),
+            np.load(directory / 'uids.npy'))
+
+'''Function to get the best titles of a user not interacted with yet'''
+def recommend(user_factors, item_factors, matrix, row, n=10):
+    scores = item_factors @ user_factors[row]
+    start, stop = matrix.indptr[row], matrix.indptr[row + 1]
+    scores[matrix.indices[start:stop]] = -np.inf
+    top = np.argpartition(-scores, min(n, len(scores) - 1))[:n]
+
+    return top[np.argsort(-scores[top])]
+
+@click.command()
+@click.argument('interactions_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--factors', 'num_factors', default=NUM_FACTORS)
+@click.option('--regularization', default=REGULARIZATION)
+@click.option('--alpha', default=ALPHA)
+@click.option('--iterations', 'num_iterations', default=NUM_ITERATIONS)
+@click.option('--workers', default=0, help='0 uses every core')
+def main(interactions_filepath, output_filepath, num_factors, regularization,
+         alpha, num_iterations, workers):
+    """ Trains implicit ALS factors on the interaction logs in
+        INTERACTIONS_FILEPATH and saves them in OUTPUT_FILEPATH.
+    """
+    matrix, users, uids = get_interaction_matrix(
+        read_interactions(interactions_filepath))
+    user_factors, item_factors, timings = train_als(
+        matrix, num_factors, regularization, alpha, num_iterations,
+        workers or None)
+
+    params = {
+        'factors': num_factors,
+        'regularization': regularization,
+        'alpha': alpha,
+        'iterations': num_iterations,
+        'seconds_per_iteration': timings,
+    }
+    save_factors(output_filepath, user_factors, item_factors, users, uids,
+                 params)
+    LOGGER.info('factors saved to %s (%.2fs per iteration)'
+                % (output_filepath, np.mean(timings)))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import click
+import logging
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import find_dotenv, load_dotenv
+
+from src.features.build_features import load_features, normalize_rows
+
+'''Number of neighbors kept for every title'''
+NUM_NEIGHBORS = 50
+
+'''Bytes a worker may use for the similarities of a single block of rows'''
+MEMORY_BUDGET = 256 * 1024 ** 2
+
+'''Bytes used by a single similarity: the sparse product and its dense copy'''
+BYTES_PER_SIMILARITY = 16
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Matrices of the worker process, loaded once by init_worker'''
+WORKER = {}
+
+'''
+Function to get the number of rows per block that keeps a block within the
+memory budget
+'''
+def get_block_size(num_rows, memory_budget=MEMORY_BUDGET):
+    row_bytes = num_rows * BYTES_PER_SIMILARITY
+    return max(1, min(num_rows, memory_budget // row_bytes))
+
+'''Function to prepare the unit length rows and their transpose'''
+def get_unit_matrices(matrix):
+    matrix = normalize_rows(matrix).tocsr().astype(np.float32)
+    return matrix, matrix.T.tocsr()
+
+'''Function to load the features once in every worker process'''
+def init_worker(features_directory):
+    matrix, _, _ = load_features(features_directory)
+    WORKER['matrix'], WORKER['transpose'] = get_unit_matrices(matrix)
+
+'''
+Function to get the top-k neighbors of a block of rows without materializing
+the whole similarity matrix
+'''
+def get_block_neighbors(matrix, transpose, start, stop, k):
+    similarities = (matrix[start:stop] @ transpose).toarray()
+
+    # a title is not its own neighbor
+    rows = np.arange(stop - start)
+    similarities[rows, rows + start] = -np.inf
+
+    k = min(k, similarities.shape[1] - 1)
+    # a single title has no neighbor, argpartition would get kth=-1
+    if k <= 0:
+        return (np.empty((len(rows), 0), dtype=np.int32),
+                np.empty((len(rows), 0), dtype=np.float32))
+    # argpartition finds the top-k in linear time, only those k are sorted
+    indices = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    scores = np.take_along_axis(similarities, indices, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+
+    return (np.take_along_axis(indices, order, axis=1).astype(np.int32),
+            np.take_along_axis(scores, order, axis=1).astype(np.float32))
+
+'''Function to run a block in a worker process, timing it'''
+def run_block(start, stop, k):
+    begin = time.perf_counter()
+    indices, scores = get_block_neighbors(
+        WORKER['matrix'], WORKER['transpose'], start, stop, k)
+    return start, indices, scores, time.perf_counter() - begin
+
+'''
+Function to compute the top-k neighbors of every title, a block of rows at a
+time
+'''
+def train_neighbors(features_directory, k=NUM_NEIGHBORS, num_workers=None,
+                    memory_budget=MEMORY_BUDGET):
+    matrix, uids, _ = load_features(features_directory)
+    num_rows = matrix.shape[0]
+    k = max(min(k, num_rows - 1), 0)
+    block_size = get_block_size(num_rows, memory_budget)
+    blocks = [(start, min(start + block_size, num_rows))
+              for start in range(0, num_rows, block_size)]
+    num_workers = num_workers or os.cpu_count()
+
+    LOGGER.info('computing %d neighbors of %d titles in %d blocks of %d rows '
+                '(%d workers)...'
+                % (k, num_rows, len(blocks), block_size, num_workers))
+
+    indices = np.empty((num_rows, k), dtype=np.int32)
+    scores = np.empty((num_rows, k), dtype=np.float32)
+    timings = []
+
+    with ProcessPoolExecutor(num_workers, initializer=init_worker,
+                             initargs=(str(features_directory),)) as executor:
+        futures = [executor.submit(run_block, start, stop, k)
+                   for start, stop in blocks]
+        for future in futures:
+            start, block_indices, block_scores, seconds = future.result()
+            indices[start:start + len(block_indices)] = block_indices
+            scores[start:start + len(block_scores)] = block_scores
+            timings.append({'start': start, 'rows': len(block_indices),
+                            'seconds': seconds})
+
+    return uids, indices, scores, timings
+
+'''Function to save the neighbor table'''
+def save_neighbors(directory, uids, indices, scores, timings=None):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    np.save(directory / 'uids.npy', np.asarray(uids, dtype='U12'))
+    np.save(directory / 'indices.npy', indices)
+    np.save(directory / 'scores.npy', scores)
+    if timings is not None:
+        with open(directory / 'timings.json', 'w') as f:
+            json.dump(timings, f, indent=2)
+
+@click.command()
+@click.argument('features_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', type=click.Path())
+@click.option('--k', default=NUM_NEIGHBORS)
+@click.option('--workers', default=0, help='0 uses every core')
+@click.option('--memory-budget-mb', default=MEMORY_BUDGET // 1024 ** 2)
+def main(features_filepath, output_filepath, k, workers, memory_budget_mb):
+    """ Computes the item-item neighbors of the features in FEATURES_FILEPATH
+        and saves the neighbor table in OUTPUT_FILEPATH.
+    """
+    begin = time.perf_counter()
+    uids, indices, scores, timings = train_neighbors(
+        features_filepath, k, workers or None, memory_budget_mb * 1024 ** 2)
+    save_neighbors(output_filepath, uids, indices, scores, timings)
+
+    seconds = [timing['seconds'] for timing in timings]
+    LOGGER.info('%d blocks in %.1fs (block mean %.3fs, max %.3fs)'
+                % (len(timings), time.perf_counter() - begin,
+                   np.mean(seconds), np.max(seconds)))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
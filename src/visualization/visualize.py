@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+import json
+import click
+import logging
+import numpy as np
+import pyarrow.parquet as pq
+import matplotlib
+from pathlib import Path
+from collections import Counter
+from dotenv import find_dotenv, load_dotenv
+
+# reports are rendered without a display
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+'''Directory of the rendered figures'''
+FIGURES_DIR = './reports/figures'
+
+'''Number of rows aggregated at a time'''
+BATCH_SIZE = 100000
+
+'''Edges of the bins of every aggregated value'''
+RATING_EDGES = np.linspace(0, 10, 51)
+LOG_VOTES_EDGES = np.linspace(0, 7, 57)
+RUNTIME_EDGES = np.linspace(0, 300, 61)
+YEAR_EDGES = np.arange(1900, 2031, 1)
+DECADES = np.arange(1900, 2030, 10)
+
+'''Columns of the correlation matrix'''
+CORRELATION_COLUMNS = ['year', 'rating', 'log_votes', 'runtime']
+
+'''Number of directors in the director charts'''
+TOP_DIRECTORS = 10
+
+'''Columns read from the processed movies'''
+COLUMNS = ['year', 'rating', 'num_votes', 'runtime', 'certificate', 'director']
+
+'''Logging object to log the messages'''
+LOGGER = logging.getLogger(__name__)
+
+'''Function to get the empty aggregates, every array sized by its bins'''
+def get_empty_aggregates():
+    num_moments = len(CORRELATION_COLUMNS)
+    num_ratings = len(RATING_EDGES) - 1
+    num_log_votes = len(LOG_VOTES_EDGES) - 1
+    return {
+        'rating_votes': np.zeros((num_ratings, num_log_votes), dtype=np.int64),
+        'year_rating': np.zeros((len(YEAR_EDGES) - 1, num_ratings),
+                                dtype=np.int64),
+        'rating': np.zeros(num_ratings, dtype=np.int64),
+        'log_votes': np.zeros(num_log_votes, dtype=np.int64),
+        'runtime': np.zeros(len(RUNTIME_EDGES) - 1, dtype=np.int64),
+        'decade_rating': np.zeros((len(DECADES), num_ratings),
+                                  dtype=np.int64),
+        'decade_count': np.zeros(len(DECADES), dtype=np.int64),
+        'decade_rating_sum': np.zeros(len(DECADES)),
+        'decade_votes_sum': np.zeros(len(DECADES)),
+        # sums of the values and of their products give the correlations
+        'moments_count': np.zeros(1, dtype=np.int64),
+        'moments_sum': np.zeros(num_moments),
+        'moments_products': np.zeros((num_moments, num_moments)),
+    }
+
+'''Function to add a batch of movies to the aggregates'''
+def update_aggregates(aggregates, df, certificates, directors):
+    rating = df['rating'].to_numpy(dtype=np.float64)
+    log_votes = np.log10(1 + df['num_votes'].to_numpy(dtype=np.float64))
+    year = df['year'].to_numpy(dtype=np.float64)
+    runtime = df['runtime'].to_numpy(dtype=np.float64)
+    # 0 stands for a missing value in the scraped data
+    rated = df['num_votes'].to_numpy() > 0
+    dated = year > 0
+
+    counts, _, _ = np.histogram2d(rating[rated], log_votes[rated],
+                                  [RATING_EDGES, LOG_VOTES_EDGES])
+    aggregates['rating_votes'] += counts.astype(np.int64)
+    counts, _, _ = np.histogram2d(year[rated & dated], rating[rated & dated],
+                                  [YEAR_EDGES, RATING_EDGES])
+    aggregates['year_rating'] += counts.astype(np.int64)
+    aggregates['rating'] += np.histogram(rating[rated], RATING_EDGES)[0]
+    aggregates['log_votes'] += np.histogram(log_votes[rated],
+                                            LOG_VOTES_EDGES)[0]
+    aggregates['runtime'] += np.histogram(runtime[runtime > 0],
+                                          RUNTIME_EDGES)[0]
+
+    decade = np.searchsorted(DECADES, year, side='right') - 1
+    in_decades = dated & rated & (decade >= 0)
+    decade = decade[in_decades]
+    np.add.at(aggregates['decade_count'], decade, 1)
+    np.add.at(aggregates['decade_rating_sum'], decade, rating[in_decades])
+    np.add.at(aggregates['decade_votes_sum'], decade, log_votes[in_decades])
+    rating_bin = np.searchsorted(RATING_EDGES, rating, side='right') - 1
+    rating_bin = np.clip(rating_bin, 0, len(RATING_EDGES) - 2)
+    np.add.at(aggregates['decade_rating'], (decade, rating_bin[in_decades]), 1)
+
+    values = np.column_stack([year, rating, log_votes, runtime])
+    values = values[rated & dated & (runtime > 0)]
+    aggregates['moments_count'] += len(values)
+    aggregates['moments_sum'] += values.sum(axis=0)
+    aggregates['moments_products'] += values.T @ values
+
+    certificates.update(df['certificate'].astype(str).to_numpy())
+    named = df[(df['director'] != '') & rated]
+    grouped = named.groupby('director', observed=True)['rating']
+    grouped = grouped.agg(['count', 'sum'])
+    for director, count, total in zip(grouped.index, grouped['count'],
+                                      grouped['sum']):
+        stats = directors.setdefault(director, [0, 0.0])
+        stats[0] += count
+        stats[1] += total
+
+'''Function to aggregate the processed movies one batch at a time'''
+def get_aggregates(filepath, batch_size=BATCH_SIZE,
+                   top_directors=TOP_DIRECTORS):
+    aggregates = get_empty_aggregates()
+    certificates = Counter()
+    directors = {}
+    num_rows = 0
+
+    batches = pq.ParquetFile(filepath).iter_batches(batch_size,
+                                                    columns=COLUMNS)
+    for batch in batches:
+        df = batch.to_pandas()
+        update_aggregates(aggregates, df, certificates, directors)
+        num_rows += len(df)
+
+    # only the directors that make it to a chart are kept
+    frequent = sorted(directors.items(),
+                      key=lambda item: -item[1][0])[:top_directors]
+    best = sorted(((name, stats) for name, stats in directors.items()
+                   if stats[0] >= 3),
+                  key=lambda item: -item[1][1] / item[1][0])[:top_directors]
+
+    summary = {
+        'rows': num_rows,
+        'certificates': dict(certificates.most_common()),
+        'frequent_directors': {name: count for name, (count, _) in frequent},
+        'best_directors': {name: total / count
+                           for name, (count, total) in best},
+    }
+    LOGGER.info('%d movies aggregated' % num_rows)
+
+    return aggregates, summary
+
+'''Function to get the cache key of the processed movies'''
+def get_source_state(filepath):
+    stat = Path(filepath).stat()
+    return {'filepath': str(filepath), 'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns}
+
+'''Function to save the aggregates next to the figures'''
+def save_aggregates(directory, aggregates, summary, source):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    np.savez(directory / 'aggregates.npz', **aggregates)
+    with open(directory / 'aggregates.json', 'w') as f:
+        json.dump(dict(summary, source=source), f, indent=2)
+
+'''Function to load the cached aggregates, None when missing or outdated'''
+def load_aggregates(directory, source):
+    directory = Path(directory)
+    if not (directory / 'aggregates.json').is_file():
+        return None
+    with open(directory / 'aggregates.json') as f:
+        summary = json.load(f)
+    if summary.pop('source', None) != source:
+        return None
+    with np.load(directory / 'aggregates.npz') as arrays:
+        return dict(arrays), summary
+
+'''Function to get the correlation matrix from the summed moments'''
+def get_correlations(aggregates):
+    count = aggregates['moments_count'][0]
+    if count < 2:
+        return np.eye(len(CORRELATION_COLUMNS))
+    mean = aggregates['moments_sum'] / count
+    covariance = aggregates['moments_products'] / count - np.outer(mean, mean)
+    std = np.sqrt(np.clip(np.diag(covariance), 1e-12, None))
+    return covariance / np.outer(std, std)
+
+'''Function to get the centers of the bins'''
+def get_centers(edges):
+    return (edges[:-1] + edges[1:]) / 2
+
+'''Function to get the density of a histogram, its integral being 1'''
+def get_density(counts, edges):
+    total = counts.sum()
+    if not total:
+        return np.zeros(len(counts))
+    return counts / (total * np.diff(edges))
+
+def plot_rating_votes(aggregates, ax):
+    # one point per bin weighted by its count, so hexbin works on the bins
+    # and not the rows
+    rating, log_votes = np.meshgrid(get_centers(RATING_EDGES),
+                                    get_centers(LOG_VOTES_EDGES),
+                                    indexing='ij')
+    counts = aggregates['rating_votes'].ravel()
+    present = counts > 0
+    image = ax.hexbin(rating.ravel()[present], log_votes.ravel()[present],
+                      C=counts[present], reduce_C_function=np.sum,
+                      gridsize=30, bins='log', cmap='viridis',
+                      extent=(RATING_EDGES[0], RATING_EDGES[-1],
+                              LOG_VOTES_EDGES[0], LOG_VOTES_EDGES[-1]))
+    ax.figure.colorbar(image, ax=ax, label='movies')
+    ax.set_title('Rating vs. Votes')
+    ax.set_xlabel('Rating')
+    ax.set_ylabel('log10(1 + Votes)')
+
+def plot_year_rating(aggregates, ax):
+    counts = aggregates['year_rating'].T.astype(np.float64)
+    counts[counts == 0] = np.nan
+    image = ax.pcolormesh(YEAR_EDGES, RATING_EDGES, counts, cmap='magma',
+                          shading='flat')
+    ax.figure.colorbar(image, ax=ax, label='movies')
+    ax.set_title('Rating by Year')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Rating')
+
+def plot_distribution(ax, counts, edges, title, xlabel):
+    ax.stairs(get_density(counts, edges), edges, fill=True, alpha=0.6)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel('Density')
+
+def plot_decades(aggregates, axes):
+    present = aggregates['decade_count'] > 0
+    decades = DECADES[present]
+    counts = aggregates['decade_count'][present]
+
+    # one density per decade replaces the scatter coloured by year
+    colors = plt.cm.viridis(np.linspace(0, 1, max(len(decades), 1)))
+    rows = aggregates['decade_rating'][present]
+    for decade, row, color in zip(decades, rows, colors):
+        axes[0].stairs(get_density(row, RATING_EDGES), RATING_EDGES,
+                       color=color, label='%ds' % decade)
+    axes[0].set_title('Rating Distribution by Decade')
+    axes[0].set_xlabel('Rating')
+    axes[0].set_ylabel('Density')
+    axes[0].legend(fontsize='small', ncol=2)
+
+    axes[1].bar(decades, aggregates['decade_rating_sum'][present] / counts,
+                width=8)
+    axes[1].set_title('Average Rating by Decade')
+    axes[1].set_xlabel('Decade')
+    axes[1].set_ylabel('Average Rating')
+
+def plot_correlations(aggregates, ax):
+    correlations = get_correlations(aggregates)
+    image = ax.imshow(correlations, vmin=-1, vmax=1, cmap='coolwarm')
+    ax.figure.colorbar(image, ax=ax)
+    ax.set_xticks(range(len(CORRELATION_COLUMNS)), CORRELATION_COLUMNS)
+    ax.set_yticks(range(len(CORRELATION_COLUMNS)), CORRELATION_COLUMNS)
+    for (row, column), value in np.ndenumerate(correlations):
+        ax.text(column, row, '%.2f' % value, ha='center', va='center')
+    ax.set_title('Correlations')
+
+def plot_bars(ax, values, title, xlabel):
+    names = list(values)[::-1]
+    ax.barh(names, [values[name] for name in names])
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+
+'''Function to render every figure of the report from the aggregates'''
+def render_figures(aggregates, summary, directory=FIGURES_DIR):
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    figures = {}
+
+    def save(name, fig):
+        fig.tight_layout()
+        fig.savefig(directory / ('%s.png' % name), dpi=100)
+        plt.close(fig)
+        figures[name] = directory / ('%s.png' % name)
+
+    fig, ax = plt.subplots(figsize=(8, 6))
+    plot_rating_votes(aggregates, ax)
+    save('rating_votes_hexbin', fig)
+
+    fig, ax = plt.subplots(figsize=(10, 5))
+    plot_year_rating(aggregates, ax)
+    save('year_rating_histogram', fig)
+
+    fig, axes = plt.subplots(1, 3, figsize=(15, 4))
+    plot_distribution(axes[0], aggregates['rating'], RATING_EDGES,
+                      'Rating Distribution', 'Rating')
+    plot_distribution(axes[1], aggregates['log_votes'], LOG_VOTES_EDGES,
+                      'Votes Distribution', 'log10(1 + Votes)')
+    plot_distribution(axes[2], aggregates['runtime'], RUNTIME_EDGES,
+                      'Runtime Distribution', 'Runtime (min)')
+    save('distributions', fig)
+
+    fig, axes = plt.subplots(1, 2, figsize=(14, 5))
+    plot_decades(aggregates, axes)
+    save('decades', fig)
+
+    fig, ax = plt.subplots(figsize=(6, 5))
+    plot_correlations(aggregates, ax)
+    save('correlations', fig)
+
+    fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+    plot_bars(axes[0], summary['certificates'], 'Certificates', 'Count')
+    frequent = summary['frequent_directors']
+    plot_bars(axes[1], frequent, 'Top %d Directors' % len(frequent), 'Count')
+    plot_bars(axes[2], summary['best_directors'], 'Average Rating by Director',
+              'Average Rating')
+    save('categories', fig)
+
+    return figures
+
+@click.command()
+@click.argument('input_filepath', type=click.Path(exists=True))
+@click.argument('output_filepath', default=FIGURES_DIR, type=click.Path())
+@click.option('--batch-size', default=BATCH_SIZE)
+@click.option('--refresh', is_flag=True,
+              help='Aggregates the movies again even if the cache is up to '
+                   'date')
+def main(input_filepath, output_filepath, batch_size, refresh):
+    """ Renders the report figures of the processed movies in INPUT_FILEPATH
+        into OUTPUT_FILEPATH from binned aggregates.
+    """
+    source = get_source_state(input_filepath)
+    cached = None if refresh else load_aggregates(output_filepath, source)
+    if cached is None:
+        aggregates, summary = get_aggregates(input_filepath, batch_size)
+        save_aggregates(output_filepath, aggregates, summary, source)
+    else:
+        LOGGER.info('using the cached aggregates of %s' % input_filepath)
+        aggregates, summary = cached
+
+    figures = render_figures(aggregates, summary, output_filepath)
+    LOGGER.info('%d figures saved to %s' % (len(figures), output_filepath))
+
+if __name__ == '__main__':
+    log_fmt = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    logging.basicConfig(level=logging.INFO, format=log_fmt)
+
+    # find .env automagically by walking up directories until it's found, then
+    # load up the .env entries as environment variables
+    load_dotenv(find_dotenv())
+
+    main()
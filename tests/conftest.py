@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from src.data import crawler
+from src.data.rate_control import RateController
+from src.data.stub_server import StubServer, save_page
+from tests.helpers import STARTS
+
+@pytest.fixture
+def corpus(tmp_path):
+    '''Directory of small search pages whose body tells them apart'''
+    for start in STARTS:
+        save_page(tmp_path, 'mystery', start,
+                  '<html><body>page %d</body></html>' % start)
+    return tmp_path
+
+@pytest.fixture
+def stub_server(corpus):
+    with StubServer(corpus) as server:
+        yield server
+
+@pytest.fixture
+def controller(monkeypatch):
+    '''
+    Unpaced controller replacing the shared one, the stub server never
+    throttles
+    '''
+    controller = RateController(crawler.get_session(), rate=float('inf'),
+                                max_rate=float('inf'),
+                                concurrency=crawler.MAX_CONNECTIONS,
+                                max_concurrency=crawler.MAX_CONNECTIONS)
+    monkeypatch.setattr(crawler, 'CONTROLLER', controller)
+    return controller
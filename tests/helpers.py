@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+
+'''Starts of the saved pages of the test corpus'''
+STARTS = [1, 51, 101, 151, 201]
+
+'''Function to get the url of a saved page on the stub server'''
+def get_page_url(server, start):
+    if start == 1:
+        return server.base_url + '?genres=mystery'
+    return server.base_url + '?genres=mystery&start=%d' % start
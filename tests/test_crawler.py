@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from src.data.crawler import fetch_pages, PageError
+from tests.helpers import STARTS, get_page_url
+
+def test_fetch_pages_keeps_the_order_of_the_urls(stub_server, controller):
+    starts = list(reversed(STARTS)) + STARTS
+    pages = fetch_pages([get_page_url(stub_server, start) for start in starts],
+                        max_connections=4, max_connections_per_host=2)
+
+    assert pages == ['<html><body>page %d</body></html>' % start
+                     for start in starts]
+
+def test_fetch_pages_returns_failures_in_place(stub_server, controller):
+    urls = [get_page_url(stub_server, 1), get_page_url(stub_server, 9999),
+            get_page_url(stub_server, 51)]
+    pages = fetch_pages(urls)
+
+    assert pages[0] == '<html><body>page 1</body></html>'
+    assert isinstance(pages[1], PageError)
+    assert pages[1].status == 404
+    assert pages[2] == '<html><body>page 51</body></html>'
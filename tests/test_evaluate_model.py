@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import math
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models.evaluate_model import (evaluate, get_relevance,
+                                       get_relevant_counts)
+
+'''Ranked recommendations of every title, E gets none'''
+RECOMMENDATIONS = {
+    'A': ['B', 'D'],
+    'B': ['D', 'A'],
+    'C': ['A', 'B'],
+    'D': ['A', 'B'],
+    'E': [],
+}
+
+'''Class to recommend fixed lists, picklable for the worker processes'''
+class FixedRecommender:
+
+    def __call__(self, uid, k):
+        return RECOMMENDATIONS[uid][:k]
+
+@pytest.fixture
+def movies():
+    # A shares its genre with B and its director with C, D and E have no
+    # relevant title
+    return pd.DataFrame({
+        'uid': ['A', 'B', 'C', 'D', 'E'],
+        'genre': [['x'], ['x'], ['y'], ['z'], ['w']],
+        'director': ['d1', 'd2', 'd1', '', ''],
+    })
+
+def test_relevant_titles_share_the_genres_or_the_director(movies):
+    counts = get_relevant_counts(get_relevance(movies))
+
+    assert counts.tolist() == [2, 1, 1, 0, 0]
+
+def test_metrics_match_the_hand_computed_values(movies):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        results = evaluate(movies, FixedRecommender(), k=2, num_workers=1)
+
+    # A finds 1 of its 2 relevant titles at rank 1, B its only one at rank
+    # 2, C at rank 1
+    discount = 1 / math.log2(3)
+    assert results['scored_queries'] == 3
+    assert results['recall'] == pytest.approx((0.5 + 1 + 1) / 3)
+    ndcg = (1 / (1 + discount) + discount + 1) / 3
+    assert results['ndcg'] == pytest.approx(ndcg)
+    # A, B and D are recommended out of 5 titles
+    assert results['coverage'] == pytest.approx(3 / 5)
+    # the lists of A and B mix genres, those of C and D do not, E has no pair
+    assert results['diversity'] == pytest.approx(0.5)
+
+def test_titles_without_relevant_titles_are_not_scored(movies):
+    unscored = movies[movies['uid'].isin(['D', 'E'])]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        results = evaluate(unscored, FixedRecommender(), k=2, num_workers=1)
+
+    assert results['scored_queries'] == 0
+    assert np.isnan(results['recall']) and np.isnan(results['ndcg'])
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.models.incremental_index import IncrementalIndex
+from src.models.train_model import get_block_neighbors
+
+'''Number of neighbors kept for every title'''
+K = 5
+
+'''Genres the titles are drawn from'''
+GENRES = ['Drama', 'Comedy', 'Crime', 'Horror']
+
+def make_movies(uids, seed):
+    rng = np.random.default_rng(seed)
+    n = len(uids)
+    return pd.DataFrame({
+        'uid': uids,
+        'year': rng.integers(1950, 2020, n),
+        'runtime': rng.integers(60, 180, n),
+        'rating': rng.uniform(1, 10, n).round(2),
+        'num_votes': rng.integers(10, 100000, n),
+        'genre': [list(rng.choice(GENRES, 2, replace=False))
+                  for _ in range(n)],
+        'director': ['Director %d' % rng.integers(10) for _ in range(n)],
+        'stars': [['Star %d' % star
+                   for star in rng.choice(20, 2, replace=False)]
+                  for _ in range(n)],
+    })
+
+def get_rebuilt_neighbors(index, df):
+    '''
+    Neighbors of the whole catalog computed from scratch by train_model, with
+    the index encoding
+    '''
+    matrix = index.encode(df)
+    indices, scores = get_block_neighbors(matrix, matrix.T.tocsr(), 0,
+                                          len(df), K)
+    uids = df['uid'].to_numpy()
+    return {uid: (uids[row].tolist(), row_scores)
+            for uid, row, row_scores in zip(uids, indices, scores)}
+
+@pytest.fixture
+def movies():
+    return make_movies(['tt%07d' % i for i in range(60)], seed=0)
+
+def test_patched_neighbors_match_a_rebuild(movies):
+    index = IncrementalIndex(K).fit(movies.iloc[:40])
+
+    # new titles, then changed ones, then the same titles changed again,
+    # which compacts
+    index.update(movies.iloc[40:])
+    changed = movies.iloc[::3].assign(
+        num_votes=lambda df: df['num_votes'] + 5000)
+    index.update(changed)
+    changed = changed.assign(
+        rating=lambda df: (df['rating'] + 1).clip(upper=10))
+    index.update(changed)
+
+    catalog = movies.set_index('uid')
+    catalog.update(changed.set_index('uid')[['num_votes', 'rating']])
+    catalog = catalog.reset_index()
+
+    rebuilt = get_rebuilt_neighbors(index, catalog)
+    for uid, (neighbors, scores) in rebuilt.items():
+        recommended = index.recommend(uid, K)
+        assert [neighbor for neighbor, _ in recommended] == neighbors
+        np.testing.assert_allclose([score for _, score in recommended],
+                                   scores, rtol=1e-5)
+
+def test_removed_rows_are_compacted(movies):
+    index = IncrementalIndex(K).fit(movies)
+
+    # more than a quarter of the rows change, leaving that many removed rows
+    # behind
+    changed = movies.iloc[:25].assign(
+        num_votes=lambda df: df['num_votes'] + 1)
+    assert index.update(changed) == 25
+
+    assert index.alive.all()
+    assert index.matrix.shape[0] == len(index.uids) == len(movies)
+    assert None not in index.uids
+    assert index.indices.max() < len(movies)
+
+def test_unchanged_titles_are_skipped(movies):
+    index = IncrementalIndex(K).fit(movies)
+
+    assert index.update(movies.iloc[:10]) == 0
+    assert index.matrix.shape[0] == len(movies)
+
+def test_a_single_title_has_no_neighbors(movies):
+    index = IncrementalIndex(K).fit(movies.iloc[:1])
+
+    assert index.recommend(movies['uid'].iat[0]) == []
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import mongomock
+import pytest
+
+from src.data.mongo_writer import MongoWriter
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient()['imdb']['movies']
+
+def get_record(uid, rank, rating=7.0):
+    return {'uid': uid, 'rank': rank, 'name': 'Title %s' % uid,
+            'rating': rating, 'num_votes': 100}
+
+def test_writes_are_upserts_keyed_on_uid(collection):
+    with MongoWriter(collection, batch_size=2) as writer:
+        writer.write([get_record('tt0000001', 1), get_record('tt0000002', 2),
+                      get_record('tt0000003', 3)])
+    assert writer.get_stats()['inserted'] == 3
+
+    with MongoWriter(collection) as writer:
+        writer.write([get_record('tt0000001', 1, rating=8.5),
+                      get_record('tt0000004', 4)])
+    assert writer.get_stats()['inserted'] == 1
+    assert writer.get_stats()['updated'] == 1
+
+    assert collection.count_documents({}) == 4
+    assert collection.find_one({'uid': 'tt0000001'})['rating'] == 8.5
+
+def test_ranks_are_kept_for_every_genre(collection):
+    with MongoWriter(collection) as writer:
+        writer.write([get_record('tt0000001', 5)], genre='mystery')
+        writer.write([get_record('tt0000001', 12)], genre='thriller')
+        writer.write_ranks('sci-fi', [('tt0000001', 40)])
+
+    document = collection.find_one({'uid': 'tt0000001'})
+    assert document['ranks'] == {'mystery': 5, 'thriller': 12, 'sci-fi': 40}
+    assert collection.count_documents({}) == 1
+
+def test_rank_updates_do_not_create_titles(collection):
+    with MongoWriter(collection) as writer:
+        writer.write_ranks('mystery', [('tt0000009', 1)])
+
+    assert collection.count_documents({}) == 0
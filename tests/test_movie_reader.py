@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import mongomock
+import numpy as np
+import pyarrow.parquet as pq
+import pytest
+
+from src.data.movie_reader import (get_query, iter_batches, read_table,
+                                   read_arrays, export_parquet)
+
+@pytest.fixture
+def collection():
+    collection = mongomock.MongoClient()['imdb']['movies']
+    collection.insert_many([{
+        'uid': 'tt%07d' % i,
+        'rank': i + 1,
+        'name': 'Title %d' % i,
+        'year': 1990 + i,
+        'certificate': 'PG-13' if i % 2 else 'R',
+        'runtime': 90 + i,
+        'genre': ['Mystery', 'Thriller'] if i % 3 == 0 else ['Comedy'],
+        'rating': 5.0 + i / 4,
+        'director': 'Director %d' % (i % 4),
+        'stars': ['Star %d' % i],
+        'num_votes': 1000 * i,
+        'ranks': {'mystery': i + 1},
+    } for i in range(12)])
+    return collection
+
+def test_query_skips_the_conditions_not_given():
+    assert get_query() == {}
+    assert get_query(genres=['Mystery'], min_year=2000) == {
+        'genre': {'$in': ['Mystery']}, 'year': {'$gte': 2000}}
+
+def test_filters_select_the_matching_movies(collection):
+    query = get_query(genres=['Mystery'], min_year=1993, min_votes=4000)
+    table = read_table(collection, query, columns=['uid', 'year', 'num_votes'])
+
+    assert table.column('uid').to_pylist() == ['tt0000006', 'tt0000009']
+    assert min(table.column('year').to_pylist()) >= 1993
+
+def test_only_the_projected_columns_are_read(collection):
+    table = read_table(collection, columns=['uid', 'certificate', 'genre'])
+
+    assert table.schema.names == ['uid', 'certificate', 'genre']
+    assert table.num_rows == 12
+    # fields outside the schema, such as the ranks, never come back
+    assert 'ranks' not in table.schema.names
+    assert table.column('genre').to_pylist()[0] == ['Mystery', 'Thriller']
+
+def test_batches_are_bounded(collection):
+    batches = list(iter_batches(collection, columns=['uid'], batch_size=5))
+
+    assert [batch.num_rows for batch in batches] == [5, 5, 2]
+
+def test_arrays_are_typed_numpy_columns(collection):
+    arrays = read_arrays(collection, get_query(min_rating=7.0), batch_size=2)
+
+    assert arrays['num_votes'].dtype == np.int64
+    assert arrays['rating'].dtype == np.float32
+    np.testing.assert_array_equal(arrays['year'], np.arange(1998, 2002))
+
+def test_empty_results_give_empty_arrays(collection):
+    arrays = read_arrays(collection, get_query(min_year=3000))
+
+    assert all(len(array) == 0 for array in arrays.values())
+
+def test_export_writes_every_batch(collection, tmp_path):
+    path = tmp_path / 'movies.parquet'
+
+    query = get_query(genres=['Comedy'])
+    assert export_parquet(path, collection, query, batch_size=3) == 8
+    assert pq.read_table(path).num_rows == 8
+
+def test_reading_creates_the_analytic_indexes(collection):
+    list(iter_batches(collection, get_query(min_rating=6.0), columns=['uid']))
+
+    keys = [info['key'] for info in collection.index_information().values()]
+    assert [('uid', 1)] in keys
+    assert [('genre', 1), ('num_votes', -1)] in keys
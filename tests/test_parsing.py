@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from src.data.benchmark_parsing import parse_per_field
+from src.data.fixtures import render_search_page, MOVIES_PER_PAGE
+from src.data.scrap_dataset import get_movie_records, MOVIE_COLUMNS
+
+@pytest.mark.parametrize('start, seed', [(1, 0), (51, 0), (951, 3)])
+def test_single_pass_matches_the_per_field_parser(start, seed):
+    page = render_search_page(start, seed)
+
+    records = get_movie_records(page)
+
+    assert len(records) == MOVIES_PER_PAGE
+    assert records == parse_per_field(page)
+
+def test_single_pass_fills_every_column():
+    record = get_movie_records(render_search_page(51))[0]
+
+    assert list(record) == MOVIE_COLUMNS
+    assert record['uid'].startswith('tt')
+    assert record['rank'] == '51'
+    assert record['genre']
+    assert all(genre.islower() for genre in record['genre'])
+    assert len(record['stars']) == 4
+    assert record['num_votes'].isdigit()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+import time
+import requests
+
+from src.data.rate_control import RateController, RateGovernor, get_retry_after
+from src.data.stub_server import StubServer, FaultInjector
+from tests.helpers import STARTS, get_page_url
+
+'''Class to answer requests with a fixed sequence of statuses'''
+class ScriptedSession:
+
+    def __init__(self, statuses, retry_after='0.1'):
+        self.statuses = list(statuses)
+        self.retry_after = retry_after
+        self.calls = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.calls.append(time.monotonic())
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response._content = b''
+        if response.status_code in (429, 503):
+            response.headers['Retry-After'] = self.retry_after
+        return response
+
+def test_get_retry_after_reads_seconds_and_dates():
+    assert get_retry_after('2') == 2.0
+    assert get_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert get_retry_after(None) is None
+    assert get_retry_after('soon') is None
+
+def test_throttled_requests_wait_for_retry_after():
+    session = ScriptedSession([429, 200])
+    controller = RateController(session)
+
+    response = controller.get('http://stub/page')
+
+    assert response.status_code == 200
+    assert len(session.calls) == 2
+    assert session.calls[1] - session.calls[0] >= 0.1
+
+def test_throttled_requests_lower_the_rate():
+    controller = RateController(ScriptedSession([429, 200]), rate=4.0,
+                                concurrency=2.0)
+
+    controller.get('http://stub/page')
+
+    stats = controller.get_stats()['stub']
+    assert stats['decreases'] == 1
+    # halved by the 429, then grown back by a single success
+    assert stats['rate'] < 4.0
+
+def test_successes_raise_the_rate_up_to_the_maximum():
+    governor = RateGovernor(rate=50.0, max_rate=60.0)
+    for _ in range(20):
+        governor.acquire()
+        governor.release()
+
+    assert governor.rate == 60.0
+
+def test_pages_of_a_rate_limited_server_are_all_fetched(corpus):
+    faults = FaultInjector(max_rate=3, retry_after=0.3)
+    controller = RateController(requests.Session(), rate=20.0,
+                                concurrency=4.0, backoff_base=0.05)
+
+    with StubServer(corpus, faults=faults) as server:
+        responses = [controller.get(get_page_url(server, start))
+                     for start in STARTS * 2]
+
+    statuses = [response.status_code for response in responses]
+    assert statuses == [200] * len(STARTS) * 2
+    assert faults.get_stats()['throttled'] > 0
+    assert controller.get_stats()[server.base_url.split('/')[2]]['rate'] < 20.0
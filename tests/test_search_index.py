@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import pandas as pd
+import pytest
+
+from src.features.search_index import SearchIndex, get_edit_distance
+
+@pytest.fixture
+def index():
+    df = pd.DataFrame([
+        ('tt0000001', 'The Godfather', 'Francis Ford Coppola',
+         ['Marlon Brando', 'Al Pacino'], 1900000),
+        ('tt0000002', 'The Godfather Part II', 'Francis Ford Coppola',
+         ['Al Pacino', 'Robert De Niro'], 1300000),
+        ('tt0000003', 'Goodfellas', 'Martin Scorsese',
+         ['Robert De Niro', 'Ray Liotta'], 1200000),
+        ('tt0000004', 'Heat', 'Michael Mann',
+         ['Al Pacino', 'Robert De Niro'], 700000),
+        ('tt0000005', 'Amélie', 'Jean-Pierre Jeunet',
+         ['Audrey Tautou'], 800000),
+    ], columns=['uid', 'name', 'director', 'stars', 'num_votes'])
+    index = SearchIndex()
+    index.add(df)
+    return index
+
+def get_uids(results):
+    return [uid for uid, _ in results]
+
+def test_exact_words_match_every_field_by_votes(index):
+    assert get_uids(index.search('godfather')) == ['tt0000001', 'tt0000002']
+    assert get_uids(index.search('pacino de niro')) == ['tt0000002',
+                                                         'tt0000004']
+    assert get_uids(index.search('AMELIE')) == ['tt0000005']
+
+def test_the_last_word_is_a_prefix_when_autocompleting(index):
+    assert index.search('godf') == []
+    assert get_uids(index.autocomplete('the godf')) == ['tt0000001',
+                                                         'tt0000002']
+    assert get_uids(index.autocomplete('scors')) == ['tt0000003']
+
+def test_a_typo_is_tolerated(index):
+    # a deletion, a substitution and a swap of neighbors
+    assert get_uids(index.search('goodfelas')) == ['tt0000003']
+    assert get_uids(index.search('coppela')) == ['tt0000001', 'tt0000002']
+    assert get_uids(index.search('paicno heat')) == ['tt0000004']
+
+def test_empty_and_unknown_queries_find_nothing(index):
+    assert index.search('') == []
+    assert index.search('  ,. ') == []
+    assert index.search('godfather zzzzzzzz') == []
+
+def test_edit_distance_gives_up_above_the_limit():
+    assert get_edit_distance('pacino', 'paicno', 2) == 1
+    assert get_edit_distance('kitten', 'sitting', 3) == 3
+    assert get_edit_distance('kitten', 'sitting', 1) == 2